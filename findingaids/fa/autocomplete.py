@@ -0,0 +1,209 @@
+# file findingaids/fa/autocomplete.py
+#
+#   Copyright 2012 Emory University Library
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+In-memory prefix indexes for search term suggestions.
+
+Suggestions are generated from the distinct controlled access headings
+(subjects, names, places, etc.) and list titles of all published finding
+aids.  Indexes are built once per process for the current collection
+watermark version (see :class:`~findingaids.fa.models.CollectionWatermark`)
+and rebuilt in a background thread when the collection changes, so looking
+up suggestions never queries eXist; the previous indexes are used until the
+rebuild is finished.  To avoid a database query on every lookup, the
+watermark is checked at most every :data:`WATERMARK_CHECK_INTERVAL` seconds.
+"""
+
+from bisect import bisect_left
+import logging
+import re
+import threading
+import time
+import unicodedata
+
+from django.db import connection
+from eulexistdb.db import ExistDBException
+
+from findingaids.fa.models import CollectionWatermark, ControlledAccessHeading, \
+    BrowseTitle, ListTitle
+
+logger = logging.getLogger(__name__)
+
+#: maximum number of seconds between checks for collection changes
+WATERMARK_CHECK_INTERVAL = 30
+
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def normalize(term):
+    '''Normalize a term for prefix matching: lower case, with accents
+    removed and whitespace normalized.'''
+    term = unicodedata.normalize('NFKD', unicode(term))
+    term = u''.join(c for c in term if not unicodedata.combining(c))
+    return u' '.join(term.lower().split())
+
+
+class PrefixIndex(object):
+    '''Sorted index of terms for prefix lookup with :mod:`bisect`.  Terms
+    match a prefix at the beginning of the term or at the beginning of any
+    word in the term; matches at the beginning of the term are listed first.
+
+    :param terms: list of terms to index; duplicates are ignored
+    '''
+
+    def __init__(self, terms):
+        terms = set(t for t in terms if normalize(t))
+        # sorted lists of (normalized key, term) for full terms and
+        # for each word after the first
+        self._terms = sorted((normalize(t), t) for t in terms)
+        words = set()
+        for key, term in self._terms:
+            for match in WORD_RE.finditer(key):
+                if match.start():
+                    words.add((key[match.start():], term))
+        self._words = sorted(words)
+
+    def __len__(self):
+        return len(self._terms)
+
+    def search(self, prefix, limit=10):
+        '''Find terms matching a prefix.
+
+        :param prefix: text to match
+        :param limit: maximum number of terms to return
+        :returns: list of matching terms, sorted alphabetically within
+            matches at the beginning of the term and matches on later words
+        '''
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        matches = []
+        for entries in [self._terms, self._words]:
+            i = bisect_left(entries, (prefix,))
+            while i < len(entries) and len(matches) < limit:
+                key, term = entries[i]
+                if not key.startswith(prefix):
+                    break
+                if term not in matches:
+                    matches.append(term)
+                i += 1
+        return matches
+
+
+_indexes = None
+_rebuild_thread = None
+_lock = threading.Lock()
+
+
+def build_indexes():
+    '''Build prefix indexes for controlled access headings and list titles
+    of all published finding aids.  List titles are taken from the local
+    browse titles when available.
+
+    :returns: dictionary of :class:`PrefixIndex` keyed on suggestion
+        type ('subject' and 'title')
+    '''
+    start = time.time()
+    if BrowseTitle.available():
+        titles = BrowseTitle.objects.values_list('list_title', flat=True)
+    else:
+        titles = ListTitle.objects.only('normalized').distinct()
+    indexes = {
+        'subject': PrefixIndex(ControlledAccessHeading.distinct()),
+        'title': PrefixIndex(titles),
+    }
+    logger.debug('Built suggestion indexes (%d subjects, %d titles) in %dms' %
+                 (len(indexes['subject']), len(indexes['title']),
+                  (time.time() - start) * 1000))
+    return indexes
+
+
+def update_indexes():
+    '''Build the suggestion indexes for the current version of the
+    collection and make them available to :meth:`get_indexes`.  Called in a
+    background thread by :meth:`get_indexes` when the collection changes;
+    can also be called directly to build the indexes in advance.  If the
+    indexes cannot be built because of an eXist error, any previously built
+    indexes continue to be used until the next watermark check.'''
+    global _indexes
+    version = CollectionWatermark.current().version
+    try:
+        indexes = build_indexes()
+    except ExistDBException, e:
+        logger.error('Error building suggestion indexes: %s' % e)
+        return
+    with _lock:
+        _indexes = {'version': version, 'indexes': indexes,
+                    'checked': time.time()}
+
+
+def _update_in_background():
+    global _rebuild_thread
+    try:
+        update_indexes()
+    finally:
+        # close the database connection opened by this thread
+        connection.close()
+        with _lock:
+            _rebuild_thread = None
+
+
+def get_indexes():
+    '''Get the suggestion indexes for the current version of the
+    collection.  When the collection has changed (or no indexes have been
+    built yet), the indexes are rebuilt in a single background thread (see
+    :meth:`update_indexes`), and the previous indexes (or empty ones) are
+    used until the rebuild is finished, so looking up suggestions never
+    waits on eXist.'''
+    global _indexes, _rebuild_thread
+    now = time.time()
+    current = _indexes
+    if current is not None and now - current['checked'] < WATERMARK_CHECK_INTERVAL:
+        return current['indexes']
+
+    version = CollectionWatermark.current().version
+    with _lock:
+        if _indexes is None:
+            _indexes = {'version': None,
+                        'indexes': {'subject': PrefixIndex([]), 'title': PrefixIndex([])}}
+        _indexes['checked'] = now
+        if _indexes['version'] != version and _rebuild_thread is None:
+            _rebuild_thread = threading.Thread(target=_update_in_background,
+                                               name='suggestion-indexes')
+            _rebuild_thread.daemon = True
+            _rebuild_thread.start()
+        return _indexes['indexes']
+
+
+def suggest(prefix, types=['subject', 'title'], limit=10):
+    '''Search term suggestions for a prefix.
+
+    :param prefix: partial search term
+    :param types: list of suggestion types to include
+    :param limit: maximum number of suggestions of each type
+    :returns: list of (type, term) tuples
+    '''
+    indexes = get_indexes()
+    return [(type, term) for type in types
+            for term in indexes[type].search(prefix, limit)]
+
+
+def reset():
+    '''Discard the suggestion indexes; they will be rebuilt on next use.'''
+    global _indexes, _rebuild_thread
+    with _lock:
+        _indexes = None
+        _rebuild_thread = None
@@ -0,0 +1,311 @@
+# file findingaids/fa/foppool.py
+#
+#   Copyright 2012 Emory University Library
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+Pool of persistent XSL-FO processor workers.
+
+Running the **XSLFO_PROCESSOR** command for every PDF starts (and warms up)
+a new Java VM each time.  When a worker command is configured, PDFs are
+instead rendered by a small pool of long-running worker processes (see
+``findingaids/fa/fopworker/FopWorker.java``), which read render requests
+one line at a time on stdin and respond on stdout.  Workers are started on
+first use, checked with a ``PING`` request if they have been idle, and
+replaced if they exit, time out, or have rendered **MAX_JOBS** PDFs.
+Each web server or celery process has its own pool.
+
+The pool is configured with the **FINDINGAID_FOP_POOL** setting, which
+should be a dictionary with the following keys:
+
+ * **COMMAND**: command to start a worker, as a list; if not set, the pool
+   is disabled and **XSLFO_PROCESSOR** is run for every PDF
+ * **WORKERS**: number of workers per process
+ * **TIMEOUT**: maximum number of seconds to wait for a worker and for a
+   PDF to be rendered
+ * **STARTUP_TIMEOUT**: maximum number of seconds to wait for a new worker
+   to be ready
+ * **MAX_JOBS**: number of PDFs a worker renders before it is restarted
+ * **IDLE_CHECK**: workers idle for longer than this many seconds are
+   checked before they are used
+
+For example::
+
+    FINDINGAID_FOP_POOL = {
+        'COMMAND': ['java', '-cp',
+                    '/usr/share/java/fop.jar:/home/findingaids/findingaids/fa/fopworker',
+                    'FopWorker'],
+        'WORKERS': 2,
+    }
+"""
+
+import atexit
+import logging
+import os
+import Queue
+import select
+import subprocess
+import threading
+import time
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'COMMAND': None,
+    'WORKERS': 2,
+    'TIMEOUT': 300,
+    'STARTUP_TIMEOUT': 60,
+    'MAX_JOBS': 500,
+    'IDLE_CHECK': 60,
+}
+
+#: worker request for each rendering mode: XSL-FO to PDF, XSL-FO to FOP
+#: intermediate format, and intermediate format to PDF
+REQUESTS = {
+    'pdf': 'RENDER',
+    'if': 'RENDER_IF',
+    'ifin': 'RENDER_IFIN',
+}
+
+
+class FopError(Exception):
+    '''The XSL-FO processor failed to render a PDF.'''
+    pass
+
+
+class WorkerError(FopError):
+    '''An XSL-FO worker process failed (exited, timed out, or sent an
+    unexpected response) and needs to be replaced.'''
+    pass
+
+
+class FopWorker(object):
+    '''A single persistent XSL-FO worker process.
+
+    :param command: command to start the worker, as a list
+    :param startup_timeout: seconds to wait for the worker to be ready
+    :raises: :class:`WorkerError` if the worker could not be started
+    '''
+
+    def __init__(self, command, startup_timeout=60):
+        try:
+            self.proc = subprocess.Popen(command, stdin=subprocess.PIPE,
+                                         stdout=subprocess.PIPE, close_fds=True)
+        except OSError, e:
+            raise WorkerError('Failed to start XSL-FO worker: %s' % e)
+        self.jobs = 0
+        self.last_used = time.time()
+        try:
+            response = self._readline(startup_timeout)
+        except WorkerError:
+            self.stop()
+            raise
+        if response != 'READY':
+            self.stop()
+            raise WorkerError('Unexpected XSL-FO worker startup response: %s' % response)
+        logger.debug('Started XSL-FO worker (pid %d)' % self.proc.pid)
+
+    def _readline(self, timeout):
+        ready = select.select([self.proc.stdout], [], [], timeout)[0]
+        if not ready:
+            raise WorkerError('XSL-FO worker timed out after %ss' % timeout)
+        line = self.proc.stdout.readline()
+        if not line:
+            raise WorkerError('XSL-FO worker exited unexpectedly')
+        return line.rstrip('\n')
+
+    def request(self, request, timeout):
+        '''Send a single-line request to the worker and return the response.
+
+        :raises: :class:`WorkerError` if the worker is not running or does
+            not respond within the timeout
+        '''
+        try:
+            self.proc.stdin.write('%s\n' % request)
+            self.proc.stdin.flush()
+        except IOError, e:
+            raise WorkerError('Failed to send request to XSL-FO worker: %s' % e)
+        response = self._readline(timeout)
+        self.last_used = time.time()
+        return response
+
+    def alive(self):
+        '''True if the worker process is still running.'''
+        return self.proc.poll() is None
+
+    def ping(self, timeout=5):
+        '''Health check: True if the worker responds to a ``PING`` request.'''
+        try:
+            return self.request('PING', timeout) == 'OK'
+        except WorkerError, e:
+            logger.warn('XSL-FO worker failed health check: %s' % e)
+            return False
+
+    def render(self, input_path, output_path, timeout, mode='pdf'):
+        '''Render an XSL-FO file to PDF, or another mode (see :data:`REQUESTS`).
+
+        :raises: :class:`FopError` if the output could not be generated, or
+            :class:`WorkerError` if the worker failed
+        '''
+        response = self.request('%s %s\t%s' % (REQUESTS[mode], input_path, output_path),
+                                timeout)
+        self.jobs += 1
+        if response.startswith('ERROR'):
+            raise FopError(response[len('ERROR'):].strip())
+        if response != 'OK':
+            raise WorkerError('Unexpected XSL-FO worker response: %s' % response)
+
+    def stop(self, timeout=5):
+        '''Stop the worker, killing it if it does not exit within the timeout.'''
+        if self.alive():
+            try:
+                self.proc.stdin.write('QUIT\n')
+                self.proc.stdin.close()
+            except IOError:
+                pass
+            end = time.time() + timeout
+            while self.alive() and time.time() < end:
+                time.sleep(0.05)
+            if self.alive():
+                self.proc.kill()
+        self.proc.wait()
+
+
+class FopPool(object):
+    '''Pool of persistent XSL-FO workers.  Each worker renders one PDF at a
+    time; requests wait up to **timeout** seconds for a free worker.
+
+    :param command: command to start a worker, as a list
+    :param workers: number of workers
+    :param timeout: seconds to wait for a free worker and for each PDF
+    :param startup_timeout: seconds to wait for a new worker to be ready
+    :param max_jobs: number of PDFs a worker renders before it is replaced
+    :param idle_check: seconds a worker can be idle before it is checked
+        with a ``PING`` request
+    '''
+
+    def __init__(self, command, workers=2, timeout=300, startup_timeout=60,
+                 max_jobs=500, idle_check=60):
+        self.command = command
+        self.timeout = timeout
+        self.startup_timeout = startup_timeout
+        self.max_jobs = max_jobs
+        self.idle_check = idle_check
+        self.pid = os.getpid()
+        self.started = self.restarted = 0
+        # one slot per worker; workers are started when first needed
+        self._idle = Queue.Queue()
+        for i in range(workers):
+            self._idle.put(None)
+
+    def _healthy(self, worker):
+        if worker is None or not worker.alive():
+            return False
+        if self.max_jobs and worker.jobs >= self.max_jobs:
+            return False
+        if time.time() - worker.last_used > self.idle_check:
+            return worker.ping()
+        return True
+
+    def render(self, input_path, output_path, mode='pdf'):
+        '''Render an XSL-FO file to PDF with the next available worker.
+
+        :param input_path: path to the XSL-FO input file
+        :param output_path: path where the PDF should be written
+        :param mode: rendering mode; see :data:`REQUESTS`
+        :raises: :class:`FopError` if the PDF could not be generated
+        '''
+        try:
+            worker = self._idle.get(timeout=self.timeout)
+        except Queue.Empty:
+            raise FopError('No XSL-FO worker available after %ss' % self.timeout)
+        try:
+            if not self._healthy(worker):
+                if worker is not None:
+                    worker.stop()
+                    self.restarted += 1
+                worker = None
+                worker = FopWorker(self.command, self.startup_timeout)
+                self.started += 1
+            worker.render(input_path, output_path, self.timeout, mode)
+        except WorkerError, e:
+            logger.error('XSL-FO worker failed: %s' % e)
+            if worker is not None:
+                worker.stop(timeout=0)
+                worker = None
+            raise
+        finally:
+            self._idle.put(worker)
+
+    def shutdown(self):
+        '''Stop all idle workers.'''
+        while True:
+            try:
+                worker = self._idle.get_nowait()
+            except Queue.Empty:
+                break
+            if worker is not None:
+                worker.stop()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_config():
+    '''Pool configuration from the **FINDINGAID_FOP_POOL** setting, with
+    defaults for any values that are not set.'''
+    config = DEFAULTS.copy()
+    config.update(getattr(settings, 'FINDINGAID_FOP_POOL', {}))
+    return config
+
+
+def enabled():
+    '''True if a worker command is configured.'''
+    return bool(get_config()['COMMAND'])
+
+
+def get_pool():
+    '''Get the worker pool for the current process, creating it if
+    necessary.  A pool inherited from a parent process (e.g., a forked
+    celery worker) is not reused, since its workers belong to the parent.'''
+    global _pool
+    with _pool_lock:
+        if _pool is None or _pool.pid != os.getpid():
+            config = get_config()
+            _pool = FopPool(config['COMMAND'], workers=config['WORKERS'],
+                            timeout=config['TIMEOUT'],
+                            startup_timeout=config['STARTUP_TIMEOUT'],
+                            max_jobs=config['MAX_JOBS'],
+                            idle_check=config['IDLE_CHECK'])
+        return _pool
+
+
+def render(input_path, output_path, mode='pdf'):
+    '''Render an XSL-FO file to PDF with the configured worker pool.
+    See :meth:`FopPool.render`.'''
+    get_pool().render(input_path, output_path, mode)
+
+
+def shutdown():
+    '''Stop the workers for the current process.'''
+    global _pool
+    with _pool_lock:
+        if _pool is not None and _pool.pid == os.getpid():
+            _pool.shutdown()
+        _pool = None
+
+atexit.register(shutdown)
@@ -0,0 +1,142 @@
+/*
+ * file findingaids/fa/fopworker/FopWorker.java
+ *
+ *   Copyright 2012 Emory University Library
+ *
+ *   Licensed under the Apache License, Version 2.0 (the "License");
+ *   you may not use this file except in compliance with the License.
+ *   You may obtain a copy of the License at
+ *
+ *       http://www.apache.org/licenses/LICENSE-2.0
+ *
+ *   Unless required by applicable law or agreed to in writing, software
+ *   distributed under the License is distributed on an "AS IS" BASIS,
+ *   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ *   See the License for the specific language governing permissions and
+ *   limitations under the License.
+ */
+
+import java.io.BufferedOutputStream;
+import java.io.BufferedReader;
+import java.io.File;
+import java.io.FileDescriptor;
+import java.io.FileOutputStream;
+import java.io.InputStreamReader;
+import java.io.OutputStream;
+import java.io.PrintStream;
+
+import javax.xml.transform.Transformer;
+import javax.xml.transform.TransformerFactory;
+import javax.xml.transform.sax.SAXResult;
+import javax.xml.transform.stream.StreamResult;
+import javax.xml.transform.stream.StreamSource;
+
+import org.apache.fop.apps.FOUserAgent;
+import org.apache.fop.apps.Fop;
+import org.apache.fop.apps.FopFactory;
+import org.apache.fop.apps.MimeConstants;
+import org.apache.fop.render.intermediate.IFDocumentHandler;
+import org.apache.fop.render.intermediate.IFParser;
+import org.apache.fop.render.intermediate.IFUtil;
+
+/**
+ * Persistent Apache FOP worker for findingaids.fa.foppool.
+ *
+ * Reads one request per line on stdin and writes one response line per
+ * request on stdout, reusing a single FopFactory (and a warm JVM) for
+ * every PDF:
+ *
+ *   PING                              -> OK
+ *   RENDER <fo path>\t<pdf path>      -> OK | ERROR <message>
+ *   RENDER_IF <fo path>\t<if path>    -> OK | ERROR <message>
+ *   RENDER_IFIN <if path>\t<pdf path> -> OK | ERROR <message>
+ *   QUIT                              -> exits
+ *
+ * RENDER_IF and RENDER_IFIN render XSL-FO to the FOP intermediate format
+ * and intermediate format to PDF, for rendering large documents in parts
+ * (see findingaids.fa.pdfsplit).
+ *
+ * READY is written on startup.  An optional FOP configuration file may be
+ * passed as the only argument.  Compile against the installed FOP jar:
+ *
+ *   javac -cp /usr/share/java/fop.jar FopWorker.java
+ */
+public class FopWorker {
+
+    public static void main(String[] args) throws Exception {
+        FopFactory fopFactory = FopFactory.newInstance();
+        if (args.length > 0) {
+            fopFactory.setUserConfig(new File(args[0]));
+        }
+        TransformerFactory transformerFactory = TransformerFactory.newInstance();
+
+        BufferedReader in = new BufferedReader(new InputStreamReader(System.in, "UTF-8"));
+        PrintStream out = new PrintStream(new FileOutputStream(FileDescriptor.out), true, "UTF-8");
+        // keep any FOP console output off the response channel
+        System.setOut(System.err);
+
+        out.println("READY");
+        String line;
+        while ((line = in.readLine()) != null) {
+            if (line.equals("PING")) {
+                out.println("OK");
+            } else if (line.equals("QUIT")) {
+                break;
+            } else if (line.startsWith("RENDER")) {
+                int space = line.indexOf(' ');
+                String command = space == -1 ? line : line.substring(0, space);
+                String[] paths = space == -1 ? new String[0] : line.substring(space + 1).split("\t");
+                if (paths.length != 2) {
+                    out.println("ERROR invalid " + command + " request");
+                    continue;
+                }
+                File input = new File(paths[0]);
+                File output = new File(paths[1]);
+                try {
+                    if (command.equals("RENDER")) {
+                        render(fopFactory, transformerFactory, input, output, MimeConstants.MIME_PDF);
+                    } else if (command.equals("RENDER_IF")) {
+                        render(fopFactory, transformerFactory, input, output, MimeConstants.MIME_FOP_IF);
+                    } else if (command.equals("RENDER_IFIN")) {
+                        renderIntermediate(fopFactory, input, output);
+                    } else {
+                        out.println("ERROR unknown request");
+                        continue;
+                    }
+                    out.println("OK");
+                } catch (Exception e) {
+                    out.println("ERROR " + String.valueOf(e.getMessage()).replace('\n', ' '));
+                }
+            } else {
+                out.println("ERROR unknown request");
+            }
+        }
+    }
+
+    private static void render(FopFactory fopFactory, TransformerFactory transformerFactory,
+                               File fo, File out, String mimeType) throws Exception {
+        OutputStream output = new BufferedOutputStream(new FileOutputStream(out));
+        try {
+            Fop fop = fopFactory.newFop(mimeType, output);
+            Transformer transformer = transformerFactory.newTransformer();
+            transformer.transform(new StreamSource(fo), new SAXResult(fop.getDefaultHandler()));
+        } finally {
+            output.close();
+        }
+    }
+
+    private static void renderIntermediate(FopFactory fopFactory, File in, File pdf)
+            throws Exception {
+        OutputStream output = new BufferedOutputStream(new FileOutputStream(pdf));
+        try {
+            FOUserAgent userAgent = fopFactory.newFOUserAgent();
+            IFDocumentHandler handler = fopFactory.getRendererFactory().createDocumentHandler(
+                userAgent, MimeConstants.MIME_PDF);
+            handler.setResult(new StreamResult(output));
+            IFUtil.setupFonts(handler);
+            new IFParser().parse(new StreamSource(in), handler, userAgent);
+        } finally {
+            output.close();
+        }
+    }
+}
@@ -16,17 +16,19 @@
 
 from django import forms
 from findingaids.fa.models import EadRepository
-import re
+from findingaids.fa.querysyntax import parse_query, QuerySyntaxError
 
+#: message for users when a full-text search query cannot be parsed
+QUERY_ERROR_MESSAGE = 'Your search query could not be parsed.  ' + \
+    'Please revise your search and try again.'
 
-def boolean_to_upper(data):
-    """Convert boolean operators to uppercase"""
-    ops = ['and', 'or', 'not']
 
-    for op in ops:
-        data = re.sub(r"\b%s\b" % (op), op.upper(), data)
-
-    return data
+def _clean_query(query):
+    # validate and normalize a full-text query for use as cleaned form data
+    try:
+        return parse_query(query)
+    except QuerySyntaxError:
+        raise forms.ValidationError(QUERY_ERROR_MESSAGE)
 
 
 class KeywordSearchForm(forms.Form):
@@ -40,15 +42,27 @@ class KeywordSearchForm(forms.Form):
         required=False,
         help_text='only collections with digital resources')
 
+    #: fields that contain full-text queries
+    query_fields = ['keywords']
+
     def clean_keywords(self):
         """
         Performs any cleanup / validation specific to keywords field
         """
-        # convert boolean operators to uppercase
-        return boolean_to_upper(self.cleaned_data['keywords'])
+        # check query syntax and convert to canonical form (including
+        # converting boolean operators to uppercase)
+        return _clean_query(self.cleaned_data['keywords'])
+
+    def has_query_error(self):
+        """Check if the form is invalid because a full-text query could
+        not be parsed."""
+        return any(field in self.errors for field in self.query_fields)
 
     def clean(self):
         cleaned_data = super(KeywordSearchForm, self).clean()
+        # no additional validation when search terms could not be parsed
+        if any(field in self._errors for field in self.query_fields):
+            return cleaned_data
         keywords = cleaned_data.get('keywords')
         dao = cleaned_data.get("dao")
 
@@ -71,6 +85,8 @@ class AdvancedSearchForm(KeywordSearchForm):
     repository = forms.ChoiceField(
         required=False, initial='', help_text="Filter by repository")
 
+    query_fields = ['keywords', 'subject']
+
     def __init__(self, *args, **kwargs):
         super(AdvancedSearchForm, self).__init__(*args, **kwargs)
         # generate a list of repository choices
@@ -82,11 +98,16 @@ class AdvancedSearchForm(KeywordSearchForm):
         # configure select widget so all choices will be displayed
         self.fields['repository'].widget.attrs['size'] = len(repo_choices)
 
+    def clean_subject(self):
+        return _clean_query(self.cleaned_data['subject'])
+
     def clean(self):
         """Custom form validation.  Keywords, dao filter, and subjects
         are all optional, but at least one of them should contain search terms
         or be set."""
         cleaned_data = self.cleaned_data
+        if any(field in self._errors for field in self.query_fields):
+            return cleaned_data
 
         keywords = cleaned_data.get('keywords')
         subject = cleaned_data.get('subject')
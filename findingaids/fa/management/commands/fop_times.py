@@ -0,0 +1,231 @@
+# file findingaids/fa/management/commands/fop_times.py
+#
+#   Copyright 2012 Emory University Library
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+from copy import deepcopy
+import glob
+from optparse import make_option
+import os
+import Queue
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from eulxml.xmlmap import load_xmlobject_from_file, load_xmlobject_from_string
+from eulxml.xmlmap.eadmap import EAD_NAMESPACE
+from lxml import etree
+
+from findingaids.fa import foppool, pdfsplit
+from findingaids.fa.models import FindingAid
+from findingaids.fa.pdfstore import findingaid_xslfo
+from findingaids.fa.utils import html_to_xslfo, xslfo_to_pdf, full_findingaid_args
+
+
+class Command(BaseCommand):
+    """Benchmark PDF generation throughput, comparing running the
+**XSLFO_PROCESSOR** command for every PDF (a new JVM each time) with the
+persistent worker pool configured in **FINDINGAID_FOP_POOL**.
+
+Takes a list of EAD files to use; if none are specified, uses the EAD
+documents in the test fixtures.  XSL-FO for each document is generated
+once, then rendered to PDF the specified number of times in each mode,
+with the same number of concurrent jobs as there are pool workers.
+
+With --split, instead compares rendering each document with series as a
+single PDF with rendering it in parts by series (see
+:mod:`findingaids.fa.pdfsplit`), using the configured XSL-FO processor or
+worker pool.  Use --synthetic to generate a large finding aid to compare
+by repeating the series of the first document with series.
+"""
+    help = __doc__
+
+    args = '[<filename> <filename> ...]'
+    option_list = BaseCommand.option_list + (
+        make_option('--repeat', '-r',
+            type='int',
+            dest='repeat',
+            default=3,
+            help='Number of times to render each document (default: %default)'),
+        make_option('--workers', '-w',
+            type='int',
+            dest='workers',
+            help='Number of pool workers and concurrent jobs (default: configured WORKERS)'),
+        make_option('--pool-only',
+            action='store_true',
+            dest='pool_only',
+            default=False,
+            help='Only time the worker pool, not the XSL-FO processor command'),
+        make_option('--split',
+            action='store_true',
+            dest='split',
+            default=False,
+            help='Compare single and split rendering of documents with series'),
+        make_option('--synthetic',
+            type='int',
+            dest='synthetic',
+            help='Generate a large document with the series of the first document ' +
+                 'with series repeated this many times'),
+        make_option('--output', '-o',
+            dest='output',
+            help='With --split, save the single and split PDFs in this directory for comparison'),
+        )
+
+    fixture_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__)))), 'tests', 'fixtures')
+
+    def handle(self, *files, **options):
+        verbosity = int(options['verbosity'])    # 1 = normal, 0 = minimal, 2 = all
+        v_normal = 1
+
+        if not files:
+            files = sorted(glob.glob(os.path.join(self.fixture_dir, '*.xml')))
+        if not files:
+            raise CommandError('No EAD files to benchmark')
+        eads = [(os.path.basename(filename), load_xmlobject_from_file(filename, FindingAid))
+                for filename in files]
+
+        if options['synthetic']:
+            with_series = [(name, ead) for name, ead in eads
+                           if ead.dsc is not None and ead.dsc.hasSeries()]
+            if not with_series:
+                raise CommandError('No EAD with series to generate a synthetic document')
+            name, ead = with_series[0]
+            ead = self.synthetic_ead(ead, options['synthetic'])
+            eads = [('%s x%d' % (name, options['synthetic']), ead)]
+            if verbosity >= v_normal:
+                print 'Generated %s with %d components' % \
+                    (eads[0][0], pdfsplit.component_count(ead))
+
+        if options['split']:
+            return self.time_split(eads, options['repeat'], verbosity, options['output'])
+
+        config = foppool.get_config()
+        if not config['COMMAND']:
+            raise CommandError('No XSL-FO worker command configured in FINDINGAID_FOP_POOL')
+        workers = options['workers'] or config['WORKERS']
+
+        tmpdir = tempfile.mkdtemp(prefix='findingaids-fop-times-')
+        try:
+            fo_files = []
+            for name, ead in eads:
+                xslfo = html_to_xslfo('fa/full.html', full_findingaid_args(ead, None, 'pdf'))
+                fo_path = os.path.join(tmpdir, '%s.fo' % name)
+                xslfo.write(fo_path, encoding='UTF-8', xml_declaration=True)
+                fo_files.append(fo_path)
+            jobs = fo_files * options['repeat']
+
+            modes = []
+            if not options['pool_only']:
+                def run_command(fo_path, pdf_path):
+                    if subprocess.call([settings.XSLFO_PROCESSOR, fo_path, pdf_path]) != 0:
+                        raise Exception('%s failed' % settings.XSLFO_PROCESSOR)
+                modes.append(('command', run_command))
+
+            pool = foppool.FopPool(config['COMMAND'], workers=workers,
+                                   timeout=config['TIMEOUT'],
+                                   startup_timeout=config['STARTUP_TIMEOUT'])
+            modes.append(('pool', pool.render))
+
+            try:
+                for label, render in modes:
+                    elapsed, errors = self.run_jobs(jobs, render, workers, tmpdir)
+                    if verbosity >= v_normal:
+                        print '%s: %d PDF%s in %.1fs (%.2f PDFs/second, %d error%s)' % \
+                            (label, len(jobs), 's' if len(jobs) != 1 else '', elapsed,
+                             len(jobs) / elapsed if elapsed else 0,
+                             errors, 's' if errors != 1 else '')
+            finally:
+                pool.shutdown()
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def run_jobs(self, jobs, render, concurrency, tmpdir):
+        '''Render a list of XSL-FO files with the specified number of
+        concurrent jobs.
+
+        :returns: tuple of elapsed seconds and number of errors
+        '''
+        queue = Queue.Queue()
+        for i, fo_path in enumerate(jobs):
+            queue.put((fo_path, os.path.join(tmpdir, '%d.pdf' % i)))
+        errors = []
+
+        def run():
+            while True:
+                try:
+                    fo_path, pdf_path = queue.get_nowait()
+                except Queue.Empty:
+                    return
+                try:
+                    render(fo_path, pdf_path)
+                except Exception, e:
+                    errors.append(e)
+                    print 'Error rendering %s: %s' % (os.path.basename(fo_path), e)
+
+        start = time.time()
+        threads = [threading.Thread(target=run) for i in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.time() - start, len(errors)
+
+
+    def time_split(self, eads, repeat, verbosity, output_dir=None):
+        '''Compare rendering documents with series as a single PDF and in
+        parts by series; optionally save the PDFs to check the output.'''
+        for name, ead in eads:
+            if ead.dsc is None or not ead.dsc.hasSeries():
+                if verbosity > 1:
+                    print 'Skipping %s (no series)' % name
+                continue
+            xslfo = findingaid_xslfo(ead, None)[0]
+            parts = findingaid_xslfo(ead, None, split=True)
+            modes = [('single', lambda: xslfo_to_pdf(xslfo)),
+                     ('split', lambda: pdfsplit.render_pdf(parts))]
+            for label, render in modes:
+                start = time.time()
+                for i in range(repeat):
+                    pdf = render()
+                elapsed = time.time() - start
+                print '%s %s (%d part%s): %.1fs per PDF (%d bytes)' % \
+                    (name, label, len(parts) if label == 'split' else 1,
+                     's' if label == 'split' and len(parts) != 1 else '',
+                     elapsed / repeat, len(pdf))
+                if output_dir:
+                    filename = '%s-%s.pdf' % (name.replace(' ', '-'), label)
+                    with open(os.path.join(output_dir, filename), 'wb') as pdf_file:
+                        pdf_file.write(pdf)
+
+    def synthetic_ead(self, ead, copies):
+        '''Generate a large finding aid by repeating the top-level series
+        of a finding aid; ids in the copies are made unique so anchors and
+        links are still distinct.'''
+        node = deepcopy(ead.node)
+        dsc = node.xpath('e:archdesc/e:dsc', namespaces={'e': EAD_NAMESPACE})[0]
+        series = dsc.xpath('e:c01', namespaces={'e': EAD_NAMESPACE})
+        for i in range(1, copies):
+            for c01 in series:
+                c01 = deepcopy(c01)
+                for el in c01.iter():
+                    if el.get('id'):
+                        el.set('id', '%s-%d' % (el.get('id'), i))
+                dsc.append(c01)
+        return load_xmlobject_from_string(etree.tostring(node), FindingAid)
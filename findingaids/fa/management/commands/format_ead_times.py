@@ -0,0 +1,142 @@
+# file findingaids/fa/management/commands/format_ead_times.py
+#
+#   Copyright 2012 Emory University Library
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import glob
+from optparse import make_option
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.html import conditional_escape
+
+from eulxml.xmlmap import load_xmlobject_from_file
+
+from findingaids.fa.models import FindingAid
+from findingaids.fa.templatetags.ead import format_ead_node, eadns, \
+    rend_attributes, simple_tags, other_tags, name_tags, semantic_tags, \
+    format_nametag
+
+
+def recursive_format_ead_node(node, escape, rdfa=False, default_rel=None):
+    '''Original recursive implementation of
+    :meth:`findingaids.fa.templatetags.ead.format_ead_node`, used as a
+    baseline for comparing output and render times.'''
+    rend = node.get('render', None)
+
+    rdfa_start, rdfa_end = '', ''
+    if rdfa and node.tag in name_tags.keys():
+        rdfa_start, rdfa_end = format_nametag(node, default_rel)
+    elif rdfa and node.tag in semantic_tags.keys():
+        rdfa_start, rdfa_end = semantic_tags[node.tag](node, default_rel)
+
+    start, end = '', ''
+    if rend is not None and rend in rend_attributes.keys():
+        s, e = rend_attributes[rend]
+        start += s
+        end = e + end
+    elif node.tag in simple_tags.keys():
+        start, end = simple_tags[node.tag]
+    elif node.tag in other_tags.keys():
+        start, end = other_tags[node.tag](node)
+
+    start += rdfa_start
+    end = rdfa_end + end
+
+    contents = [start]
+    if node.text is not None:
+        contents.append(escape(node.text))
+    contents.extend([recursive_format_ead_node(el, escape=escape, rdfa=rdfa,
+                                               default_rel=default_rel)
+                     for el in node.iterchildren()])
+    contents.extend([end, escape(node.tail or '')])
+    return ''.join(contents)
+
+
+class Command(BaseCommand):
+    """Benchmark conversion of EAD content to HTML (as done by the
+``format_ead`` and ``format_ead_rdfa`` template filters), comparing the
+current renderer with the original recursive implementation and reporting
+any differences in output.
+
+Takes a list of EAD files to use; if none are specified, uses the EAD
+documents in the test fixtures.  For each document, times rendering the
+entire archdesc in a single pass and rendering the unittitle of every
+component in the container list separately, as is done on series pages.
+"""
+    help = __doc__
+
+    args = '[<filename> <filename> ...]'
+    option_list = BaseCommand.option_list + (
+        make_option('--repeat', '-r',
+            type='int',
+            dest='repeat',
+            default=5,
+            help='Number of times to render each document (default: %default)'),
+        make_option('--rdfa',
+            action='store_true',
+            dest='rdfa',
+            default=False,
+            help='Render with RDFa (as the format_ead_rdfa filter does)'),
+        )
+
+    fixture_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__)))), 'tests', 'fixtures')
+
+    def handle(self, *files, **options):
+        verbosity = int(options['verbosity'])    # 1 = normal, 0 = minimal, 2 = all
+        v_normal = 1
+
+        if not files:
+            files = sorted(glob.glob(os.path.join(self.fixture_dir, '*.xml')))
+        if not files:
+            raise CommandError('No EAD files to benchmark')
+
+        totals = {'current': 0, 'recursive': 0}
+        mismatches = 0
+        for filename in files:
+            ead = load_xmlobject_from_file(filename, FindingAid)
+            # archdesc as a single node, then each component title separately
+            nodes = [ead.archdesc.node] + \
+                ead.node.xpath('//e:dsc//e:did/e:unittitle', **eadns)
+
+            times = {}
+            output = {}
+            for label, render in [('current', format_ead_node),
+                                  ('recursive', recursive_format_ead_node)]:
+                start = time.time()
+                for i in range(options['repeat']):
+                    output[label] = [render(node, conditional_escape,
+                                            rdfa=options['rdfa'])
+                                     for node in nodes]
+                times[label] = (time.time() - start) * 1000
+                totals[label] += times[label]
+
+            if output['current'] != output['recursive']:
+                mismatches += 1
+                print 'Error: output for %s does not match the original renderer' \
+                    % filename
+
+            if verbosity >= v_normal:
+                print '%s (%d components): %dms current, %dms recursive' % \
+                    (os.path.basename(filename), len(nodes) - 1,
+                     times['current'], times['recursive'])
+
+        print '\nTotal for %d document%s, %d render%s each: %dms current, %dms recursive' % \
+            (len(files), 's' if len(files) != 1 else '', options['repeat'],
+             's' if options['repeat'] != 1 else '',
+             totals['current'], totals['recursive'])
+        print '%d document%s with differences in output' % \
+            (mismatches, 's' if mismatches != 1 else '')
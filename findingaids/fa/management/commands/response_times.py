@@ -21,8 +21,11 @@ from django.core.management.base import BaseCommand
 from django.core.urlresolvers import reverse
 from django.test import Client
 
-from findingaids.fa.models import FindingAid, title_letters
-from findingaids.fa.views import fa_listfields
+from eulexistdb.exceptions import DoesNotExist
+
+from findingaids.fa.models import FindingAid, title_letters, Series, Index, \
+    SeriesOrIndex, shortform_id
+from findingaids.fa.views import fa_listfields, series_ead_fields
 
 class Command(BaseCommand):
     """
@@ -33,10 +36,15 @@ class Command(BaseCommand):
 
     In pages mode, tests a few pre-specified page urls.
 
+    In indexes mode, compares retrieving every index in the database by
+    trying a series query first and then an index query (the way index pages
+    were originally retrieved) with the single combined series-or-index query,
+    and tests page load times for all index pages.
+
     """
     help = __doc__
 
-    _args = ['browse', 'search', 'pages']
+    _args = ['browse', 'search', 'pages', 'indexes']
     args = ' | '.join(_args)
     option_list = BaseCommand.option_list + (
         make_option('--pages', '-p',
@@ -231,6 +239,67 @@ class Command(BaseCommand):
             print "\nMax/Min/Average - all letters, all pages"
             max_min_avg(query_times.values(), zero=timedelta())
 
+        # INDEXES
+        elif cmd == 'indexes':
+            indexes = [(i.ead.eadid.value, i.id) for i in
+                       Index.objects.only('id', 'ead__eadid')]
+
+            if not options['pages_only']:
+                if verbosity == v_all:
+                    print 'Testing response times for index lookups'
+
+                separate_times = {}
+                combined_times = {}
+                for eadid, index_id in indexes:
+                    search_fields = {'ead__eadid': eadid, 'id': index_id}
+
+                    # separate queries: look for a series first, then an index
+                    start_time = datetime.now()
+                    try:
+                        Series.objects.also(*series_ead_fields).filter(**search_fields).get()
+                    except DoesNotExist:
+                        Index.objects.also(*series_ead_fields).filter(**search_fields).get()
+                    separate_times[index_id] = datetime.now() - start_time
+
+                    # combined query: series or index in a single request
+                    start_time = datetime.now()
+                    queryset = SeriesOrIndex.objects.also(*series_ead_fields).filter(**search_fields)
+                    SeriesOrIndex.get_typed(queryset)
+                    combined_times[index_id] = datetime.now() - start_time
+
+                    if verbosity >= v_normal:
+                        print '%s : separate %s, combined %s' % \
+                            (index_id, separate_times[index_id], combined_times[index_id])
+
+                print "\nMax/Min/Average - index lookup, separate series and index queries"
+                max_min_avg(separate_times.values(), zero=timedelta())
+                print "Max/Min/Average - index lookup, combined series or index query"
+                max_min_avg(combined_times.values(), zero=timedelta())
+
+            if not options['xquery_only']:
+                if verbosity == v_all:
+                    print 'Testing response times for index pages'
+
+                client = Client()
+                query_times = {}
+                for eadid, index_id in indexes:
+                    uri = reverse('fa:series-or-index',
+                                  kwargs={'id': eadid, 'series_id': shortform_id(index_id, eadid)})
+                    start_time = datetime.now()
+                    response = client.get(uri)
+                    end_time = datetime.now()
+                    if response.status_code == 200:
+                        duration = end_time - start_time
+                        query_times[uri] = duration
+                        if duration > self.timedelta_threshold:
+                            print "Warning: page load for %s took %s" % \
+                                (uri, duration)
+                        if verbosity == v_all:
+                            print "%s : %s" % (uri, duration)
+
+                print "\nMax/Min/Average - all index pages"
+                max_min_avg(query_times.values(), zero=timedelta())
+
 
 def max_min_avg(times, zero=0):
     if not times:
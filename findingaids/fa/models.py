@@ -14,20 +14,26 @@
 #   See the License for the specific language governing permissions and
 #   limitations under the License.
 
+from copy import deepcopy
 from datetime import datetime
 import logging
+from lxml import etree
 import os
+import time
 
 from django.conf import settings
 from django.contrib.sites.models import Site
 from django.core.cache import cache
 from django.core.urlresolvers import reverse
-from django.db import models
+from django.db import models, transaction
 
 from eulxml import xmlmap
 from eulxml.xmlmap import eadmap
+from eulexistdb.db import ExistDB
+from eulexistdb.exceptions import DoesNotExist, ReturnedMultiple
 from eulexistdb.manager import Manager
 from eulexistdb.models import XmlModel
+from eulexistdb.query import _create_return_class, _quote_as_string_literal
 
 from findingaids.utils import normalize_whitespace
 
@@ -167,22 +173,15 @@ class FindingAid(XmlModel, eadmap.EncodedArchivalDescription):
 
 
     # -- map as regular xmlmap field, for use when entire object is returned
+    #    (see HighlightSummary for counts without the entire document)
     admin_info_matches = xmlmap.IntegerField(
         'count(./e:archdesc/*[' +
         '|'.join(['self::e:%s' % field for field in _admin_info]) + ']//exist:match)')
-    # -- eXist-specific xpath for returning count without entire document
-    admin_info_matches_xpath = 'count(util:expand(%(xq_var)s/e:archdesc/(' + \
-        '|'.join(['e:%s' % field for field in _admin_info]) + '))//exist:match)'
     # - collection description fields
     _coll_desc = ['bioghist', 'bibliography', 'scopecontent', 'arrangement', 'otherfindaid']
     # -- map as regular xmlmap field, for use when entire object is returned
     coll_desc_matches = xmlmap.IntegerField(
         'count(' + '|'.join('./e:archdesc/e:%s//exist:match' % field for field in _coll_desc) + ')')
-    # -- eXist-specific xpath for returning count without entire document
-    coll_desc_matches_xpath = 'count(util:expand(%(xq_var)s/e:archdesc/(' +  \
-        '|'.join('e:%s' % field for field in _coll_desc) + '))//exist:match)'
-    # - controlaccess match-count
-    controlaccess_matches_xpath = 'count(util:expand(%(xq_var)s/e:archdesc/e:controlaccess)//exist:match)'
 
     origination_name = xmlmap.NodeField('e:archdesc/e:did/e:origination/e:*', Name)
     'origination name, as an instance of :class:`Name`'
@@ -193,6 +192,8 @@ class FindingAid(XmlModel, eadmap.EncodedArchivalDescription):
     #: "public" is defined as audience external or not set, xlink:href present,
     #: and show not set to none.
     public_dao_count = xmlmap.IntegerField('count(.//e:dao[@xlink:href][not(@xlink:show="none")][not(@audience) or @audience="external"])')
+    #: count of all dao elements in a record, public or internal
+    dao_count = xmlmap.IntegerField('count(.//e:dao)')
 
     objects = Manager('/e:ead')
     """:class:`eulcore.django.existdb.manager.Manager` - similar to an object manager
@@ -351,15 +352,22 @@ class ListTitle(XmlModel):
     # first letter of list title field (using generic item field to avoid string() conversion)
     first_letter = xmlmap.ItemField("substring(.,1,1)")
     "First letter of a finding aid list title: use to generate list of first-letters for browse."
+    normalized = xmlmap.StringField('normalize-space(.)')
+    "List title with whitespace normalized"
     objects = Manager(xpath)
 
 
 def title_letters():
     """Cached list of distinct, sorted first letters present in all Finding Aid titles.
-    Cached results should be refreshed after half an hour."""
-    cache_key = 'browse-title-letters'
+    Uses the local browse titles (see :class:`BrowseTitle`) when available.
+    Cached results should be refreshed after half an hour, or when the
+    collection changes (see :class:`CollectionWatermark`)."""
+    cache_key = CollectionWatermark.current().cache_key('browse-title-letters')
     if cache.get(cache_key) is None:
-        letters = ListTitle.objects.only('first_letter').order_by('first_letter').distinct()
+        if BrowseTitle.available():
+            letters = BrowseTitle.letters()
+        else:
+            letters = ListTitle.objects.only('first_letter').order_by('first_letter').distinct()
         cache.set(cache_key, list(letters))  # use configured cache timeout
     return cache.get(cache_key)
 
@@ -371,8 +379,10 @@ class EadRepository(XmlModel):
 
     @staticmethod
     def distinct():
-        """Cached list of distinct owning repositories in all Finding Aids."""
-        cache_key = 'findingaid-repositories'
+        """Cached list of distinct owning repositories in all Finding Aids.
+        Cached results are refreshed when the collection changes (see
+        :class:`CollectionWatermark`)."""
+        cache_key = CollectionWatermark.current().cache_key('findingaid-repositories')
         if cache.get(cache_key) is None:
             # using normalized version because whitespace is inconsistent in this field
             repos = EadRepository.objects.only('normalized').distinct()
@@ -380,6 +390,23 @@ class EadRepository(XmlModel):
         return cache.get(cache_key)
 
 
+class ControlledAccessHeading(XmlModel):
+    """Controlled access heading (subject, name, place, genre, etc.) in
+    a published finding aid; used to generate search suggestions."""
+    ROOT_NAMESPACES = {'e': eadmap.EAD_NAMESPACE}
+    heading_tags = ['corpname', 'famname', 'function', 'genreform', 'geogname',
+                    'name', 'occupation', 'persname', 'subject', 'title']
+    normalized = xmlmap.StringField('normalize-space(.)')
+    objects = Manager('//e:controlaccess/*[%s]' %
+                      ' or '.join('self::e:%s' % tag for tag in heading_tags))
+
+    @staticmethod
+    def distinct():
+        """List of distinct controlled access headings in all published
+        finding aids, with whitespace normalized."""
+        return list(ControlledAccessHeading.objects.only('normalized').distinct())
+
+
 class LocalComponent(eadmap.Component):
     '''Extend default :class:`eulcore.xmlmap.eadmap.Component` class to add a
     method to detect first file-item in a list.  (Needed for container list display
@@ -777,6 +804,140 @@ class Index(XmlModel, eadmap.Index):
 eadmap.ArchivalDescription._fields['index'].node_class = Index
 
 
+class SeriesOrIndex(XmlModel):
+    """
+    Top-level (c01) series or index in a finding aid.  Used to find a series
+    or index by id with a single eXist query when it is not known in advance
+    which one the id refers to; use :meth:`get_typed` to retrieve the result
+    as a :class:`Series` or :class:`Index`.
+    """
+
+    ROOT_NAMESPACES = {
+        'e': eadmap.EAD_NAMESPACE,
+        'exist': 'http://exist.sourceforge.net/NS/exist'
+    }
+
+    id = xmlmap.StringField('@id')
+    ead = xmlmap.NodeField("ancestor::e:ead", FindingAid)
+    ":class:`findingaids.fa.models.FindingAid` access to ancestor EAD element"
+
+    objects = Manager('(e:ead//e:c01|e:ead//e:index)')
+    """:class:`eulcore.django.existdb.manager.Manager`
+
+        Configured to find any c01 or index element.
+    """
+
+    INDEX_TAG = '{%s}index' % eadmap.EAD_NAMESPACE
+
+    @staticmethod
+    def get_typed(queryset, highlight=False):
+        """Retrieve a single series or index from a :class:`SeriesOrIndex`
+        queryset.  Unlike :meth:`eulexistdb.query.QuerySet.get`, the hit count
+        and the result are retrieved from eXist in a single request.
+
+        :param queryset: :class:`SeriesOrIndex` queryset, with any filters and
+            additional return fields (via ``also``) already specified
+        :param highlight: boolean; set to True when the queryset includes
+            a highlighting filter, so matches will be returned by eXist
+        :returns: :class:`Series` or :class:`Index` instance, including any
+            additional return fields from the queryset
+        :raises: :class:`~eulexistdb.exceptions.DoesNotExist` if no match is
+            found; :class:`~eulexistdb.exceptions.ReturnedMultiple` if there
+            is more than one match
+        """
+        xquery = queryset.query.getQuery()
+        opts = {}
+        if highlight:
+            # same options used by eulexistdb for retrieving highlighted results
+            opts = {'highlight-matches': 'elements', 'indent': 'no'}
+        start = time.time()
+        result = ExistDB().query(xquery, how_many=1, **opts)
+        query_time = int((time.time() - start) * 1000)
+
+        if result.hits == 0:
+            raise DoesNotExist("no series or index found for query %s" % xquery)
+        elif result.hits > 1:
+            raise ReturnedMultiple("returned %s series or indexes for query %s" %
+                                   (result.hits, xquery))
+
+        node = result.results[0]
+        # with additional fields, the series or index is the first node
+        # under the constructed return element
+        if queryset.additional_fields:
+            node = node[0]
+        typed_class = Index if node.tag == SeriesOrIndex.INDEX_TAG else Series
+        if queryset.additional_fields:
+            # generate a return class for the actual type with the same
+            # fields eulexistdb would use for a Series or Index queryset
+            typed_class = _create_return_class(typed_class, queryset.additional_fields,
+                override_xpaths=queryset.query.get_return_xpaths())
+        obj = typed_class(node)
+        # make query time available, as for a single item retrieved from a queryset
+        obj.queryTime = lambda: query_time
+        return obj
+
+
+class HighlightSummary(xmlmap.XmlObject):
+    """
+    Keyword match counts for the table of contents of a single finding aid:
+    descriptive summary, administrative information, collection description,
+    controlled access headings, and each top-level series and index.  Use
+    :meth:`get` to retrieve all of the counts from eXist with a single query,
+    which expands the keyword matches in the document only once.
+    """
+
+    did_matches = xmlmap.IntegerField('@did')
+    'number of matches in the descriptive summary'
+    admin_info_matches = xmlmap.IntegerField('@admin-info')
+    'number of matches in the administrative information sections'
+    coll_desc_matches = xmlmap.IntegerField('@coll-desc')
+    'number of matches in the collection description sections'
+    controlaccess_matches = xmlmap.IntegerField('@controlaccess')
+    'number of matches in the controlled access headings'
+
+    xquery = '''declare namespace e='%(ead_ns)s';
+declare namespace exist='http://exist.sourceforge.net/NS/exist';
+let $archdesc := util:expand(collection(%(collection)s)/e:ead[e:eadheader/e:eadid = %(eadid)s][ft:query(., %(keywords)s)]/e:archdesc)
+return <highlight-summary did="{count($archdesc/e:did//exist:match)}"
+    admin-info="{count($archdesc/(%(admin_info)s)//exist:match)}"
+    coll-desc="{count($archdesc/(%(coll_desc)s)//exist:match)}"
+    controlaccess="{count($archdesc/e:controlaccess//exist:match)}">{
+  for $c in ($archdesc/e:dsc/e:c01 | $archdesc/e:index)[.//exist:match]
+  return <component id="{$c/@id}" matches="{count($c//exist:match)}"/>
+}</highlight-summary>'''
+
+    @property
+    def component_matches(self):
+        'dictionary of top-level series and index ids to number of matches'
+        return dict((c.get('id'), int(c.get('matches')))
+                    for c in self.node.iterchildren('component'))
+
+    @staticmethod
+    def get(eadid, keywords, collection):
+        """Retrieve keyword match counts for a single finding aid from eXist.
+        If the document does not match the keywords, all counts are zero.
+
+        :param eadid: eadid for the document
+        :param keywords: full-text search terms to be counted
+        :param collection: eXist collection to query
+        :rtype: :class:`HighlightSummary`
+        """
+        xquery = HighlightSummary.xquery % {
+            'ead_ns': eadmap.EAD_NAMESPACE,
+            'collection': _quote_as_string_literal(collection),
+            'eadid': _quote_as_string_literal(eadid),
+            'keywords': _quote_as_string_literal(keywords),
+            'admin_info': '|'.join('e:%s' % field for field in FindingAid._admin_info),
+            'coll_desc': '|'.join('e:%s' % field for field in FindingAid._coll_desc),
+        }
+        start = time.time()
+        result = ExistDB().query(xquery, how_many=1)
+        query_time = int((time.time() - start) * 1000)
+        summary = HighlightSummary(result.results[0])
+        summary.queryTime = lambda: query_time
+        return summary
+
+
 class FileComponent(XmlModel, eadmap.Component):
     """
     Any EAD component with a level of *file*, with item-level information (box &
@@ -856,3 +1017,579 @@ class Archive(models.Model):
     @property
     def svn_local_path(self):
         return os.path.join(settings.SVN_WORKING_DIR, self.slug)
+
+
+class NavigationItem(models.Model):
+    '''Navigation information for a single series (c01, c02, or c03) or index
+    in an EAD document, used to generate series and index navigation links
+    without querying eXist for the structure of the document.  Navigation
+    items are generated by :meth:`build` whenever a document is loaded to
+    eXist for publication or preview.
+    '''
+    SERIES = 'series'
+    INDEX = 'index'
+    KIND_CHOICES = (
+        (SERIES, 'Series'),
+        (INDEX, 'Index'),
+    )
+
+    eadid = models.CharField('EAD Identifier', max_length=50, db_index=True)
+    preview = models.BooleanField(default=False,
+        help_text='navigation for a document in the preview collection')
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    component_id = models.CharField(max_length=255,
+        help_text='full id of the series or index, as stored in eXist')
+    short_id = models.CharField(max_length=255,
+        help_text='short-form id (without eadid prefix) for use in urls')
+    parent = models.CharField(max_length=255, blank=True,
+        help_text='full id of the parent series, for subseries')
+    level = models.PositiveSmallIntegerField(
+        help_text='series level (1 for c01, 2 for c02, 3 for c03); 0 for an index')
+    unitid = models.CharField(max_length=255, blank=True)
+    label = models.TextField(help_text='plain-text display label (unitid and unittitle)')
+    title = models.TextField(help_text='unittitle or index head, formatted as HTML')
+    position = models.PositiveIntegerField(help_text='order within the document')
+
+    #: number of keyword matches; not stored, but set by views when
+    #: search terms are highlighted
+    match_count = 0
+
+    #: deepest series level that is displayed on a separate page (c03)
+    MAX_SERIES_LEVEL = 3
+
+    class Meta:
+        ordering = ['position']
+
+    def __unicode__(self):
+        return self.component_id
+
+    @property
+    def is_index(self):
+        return self.kind == self.INDEX
+
+    @staticmethod
+    def from_component(component, eadid, position=0, level=1, parent='',
+                       preview=False):
+        '''Initialize (but do not save) a navigation item from a
+        :class:`Series` or :class:`Index` instance.
+
+        :param component: series or index; expected to include at least id
+            and did (for series) or head (for indexes)
+        :param eadid: eadid of the document the component belongs to
+        :param position: numerical position of the item in the document
+        :param level: series level; ignored for indexes
+        :param parent: full id of the parent series, if any
+        :param preview: boolean; True for documents in the preview collection
+        '''
+        # NOTE: importing here to avoid a circular import (templatetags import models)
+        from findingaids.fa.templatetags.ead import format_ead
+
+        item = NavigationItem(eadid=eadid, preview=preview, position=position,
+                              component_id=component.id,
+                              short_id=shortform_id(component.id, eadid),
+                              parent=parent)
+        if isinstance(component, eadmap.Index):
+            item.kind = NavigationItem.INDEX
+            item.level = 0
+            item.title = format_ead(component.head, autoescape=True)
+            item.label = unicode(component.head or '')
+        else:
+            item.kind = NavigationItem.SERIES
+            item.level = level
+            if component.did.unitid:
+                item.unitid = unicode(component.did.unitid)
+            item.title = format_ead(component.did.unittitle, autoescape=True)
+            item.label = ': '.join([unicode(u) for u in
+                                    [component.did.unitid, component.did.unittitle] if u])
+        if hasattr(component, 'match_count'):
+            item.match_count = component.match_count
+        return item
+
+    @staticmethod
+    def series_tree(components, level=1):
+        '''Select the series, subseries, and sub-subseries to include in
+        navigation from a list of components, with their subseries.  Used
+        both for stored navigation (see :meth:`build`) and for series links
+        generated from the EAD xml, so they always agree.  Components without
+        ids are skipped along with their subseries, since they can't be
+        linked to (check_series_ids should prevent this for published
+        documents), and only levels up to :attr:`MAX_SERIES_LEVEL` are
+        included.
+
+        :param components: list of series components (e.g., the c01s of
+            a dsc)
+        :param level: series level of the components
+        :returns: list of (component, level, subseries) tuples, where
+            subseries is a list in the same format
+        '''
+        tree = []
+        if level > NavigationItem.MAX_SERIES_LEVEL:
+            return tree
+        for c in components:
+            if not c.id:
+                continue
+            subseries = []
+            if level < NavigationItem.MAX_SERIES_LEVEL and c.hasSubseries():
+                subseries = NavigationItem.series_tree(c.c, level + 1)
+            tree.append((c, level, subseries))
+        return tree
+
+    @staticmethod
+    def build(ead, preview=False):
+        '''Generate and save navigation items for all series, subseries,
+        and indexes in an EAD document, replacing any navigation previously
+        stored for the same eadid and mode.  Series are selected by
+        :meth:`series_tree`.
+
+        :param ead: :class:`FindingAid` instance for the full document
+        :param preview: boolean; True for documents in the preview collection
+        :returns: list of :class:`NavigationItem`
+        '''
+        eadid = ead.eadid.value
+        items = []
+
+        def add_series(tree, parent=''):
+            for c, level, subseries in tree:
+                items.append(NavigationItem.from_component(c, eadid,
+                    position=len(items), level=level, parent=parent,
+                    preview=preview))
+                add_series(subseries, parent=c.id)
+
+        # only series-level components are displayed on separate pages
+        if ead.dsc and ead.dsc.hasSeries():
+            add_series(NavigationItem.series_tree(ead.dsc.c))
+        for index in ead.archdesc.index:
+            if index.id:
+                items.append(NavigationItem.from_component(index, eadid,
+                    position=len(items), preview=preview))
+
+        with transaction.commit_on_success():
+            NavigationItem.remove(eadid, preview)
+            NavigationItem.objects.bulk_create(items)
+        return items
+
+    @staticmethod
+    def remove(eadid, preview=False):
+        'Remove any navigation items stored for the specified document.'
+        NavigationItem.objects.filter(eadid=eadid, preview=preview).delete()
+
+    @staticmethod
+    def for_document(eadid, preview=False):
+        '''Navigation items stored for the specified document, in document order.
+
+        :returns: list of :class:`NavigationItem`; empty if nothing has been
+            stored for this document
+        '''
+        return list(NavigationItem.objects.filter(eadid=eadid, preview=preview))
+
+
+class CatalogStatus(models.Model):
+    '''Record of when a kind of local information about the documents in
+    eXist (e.g., browse titles) was last regenerated for all documents by
+    the **reconcile_catalog** script.  Local information is updated as
+    individual documents are published, loaded, or removed, but it only
+    covers every document in eXist once it has been regenerated in full, so
+    it should not be used in place of eXist until it has been reconciled
+    (see :meth:`is_reconciled`).
+    '''
+    name = models.CharField(max_length=50, unique=True)
+    reconciled = models.DateTimeField(
+        help_text='last time this information was regenerated from eXist')
+
+    #: status name for browse titles (see :class:`BrowseTitle`)
+    BROWSE_TITLES = 'browse-titles'
+    #: status name for catalog entries for published documents (see :class:`CatalogEntry`)
+    CATALOG = 'catalog'
+    #: status name for catalog entries for preview documents
+    PREVIEW_CATALOG = 'catalog-preview'
+
+    class Meta:
+        verbose_name_plural = 'catalog status'
+
+    def __unicode__(self):
+        return self.name
+
+    @staticmethod
+    def mark_reconciled(name):
+        '''Record that the named information has been regenerated for all
+        documents currently in eXist.'''
+        updated = CatalogStatus.objects.filter(name=name).update(reconciled=datetime.now())
+        if not updated:
+            CatalogStatus.objects.get_or_create(name=name,
+                                                defaults={'reconciled': datetime.now()})
+
+    @staticmethod
+    def is_reconciled(name):
+        '''Check if the named information has ever been regenerated for all
+        documents in eXist.'''
+        return CatalogStatus.objects.filter(name=name).exists()
+
+
+class CatalogEntry(models.Model):
+    '''Local catalog information about a single EAD document loaded to eXist
+    (either published or in the preview collection), so that basic details
+    about a document such as checksum and last modification time can be
+    retrieved without querying eXist.  Entries are updated by :meth:`update`
+    whenever a document is loaded to or removed from eXist by the admin site
+    or the **load_ead** script; the **reconcile_catalog** script regenerates
+    all entries from the documents currently in eXist.  Catalog entries are
+    only used in place of eXist once they have been regenerated for all
+    documents (see :meth:`available`).
+    '''
+    eadid = models.CharField('EAD Identifier', max_length=50, db_index=True)
+    preview = models.BooleanField(default=False,
+        help_text='document is in the preview collection')
+    document_name = models.CharField(max_length=255, db_index=True)
+    collection_name = models.CharField(max_length=255)
+    hash = models.CharField(max_length=40, help_text='SHA-1 checksum from eXist')
+    last_modified = models.DateTimeField(
+        help_text='last modification time in eXist (eXist server time)')
+    repository = models.CharField(max_length=255, blank=True,
+        help_text='repository subarea (the first, if there is more than one)')
+    dao_count = models.PositiveIntegerField(default=0,
+        help_text='number of digital archival objects, public or internal')
+    public_dao_count = models.PositiveIntegerField(default=0,
+        help_text='number of public digital archival objects')
+
+    #: fields to retrieve from eXist for generating catalog entries
+    exist_fields = ['eadid', 'document_name', 'collection_name', 'hash',
+                    'last_modified', 'repository', 'dao_count', 'public_dao_count']
+
+    class Meta:
+        unique_together = ('collection_name', 'document_name')
+        verbose_name_plural = 'catalog entries'
+
+    def __unicode__(self):
+        return self.eadid
+
+    @staticmethod
+    def from_exist(eadid=None, preview=False):
+        '''Initialize (but do not save) catalog entries for documents
+        currently in eXist.
+
+        :param eadid: optional eadid; if specified, only documents with this
+            eadid will be included
+        :param preview: boolean; True to catalog the preview collection
+        :returns: list of :class:`CatalogEntry`
+        '''
+        fa = FindingAid.objects.only(*CatalogEntry.exist_fields)
+        if eadid is not None:
+            fa = fa.filter(eadid=eadid)
+        if preview:
+            fa = fa.using(settings.EXISTDB_PREVIEW_COLLECTION)
+        return [CatalogEntry(eadid=doc.eadid.value, preview=preview,
+                             document_name=doc.document_name,
+                             collection_name=doc.collection_name,
+                             hash=doc.hash, last_modified=doc.last_modified,
+                             repository=doc.repository[0] if doc.repository else '',
+                             dao_count=doc.dao_count or 0,
+                             public_dao_count=doc.public_dao_count or 0)
+                for doc in fa]
+
+    @staticmethod
+    def update(eadid, preview=False):
+        '''Update the catalog entries for an eadid with the current
+        information in eXist, replacing any entries previously stored.
+
+        :param eadid: eadid of the document that was loaded
+        :param preview: boolean; True for the preview collection
+        :returns: list of :class:`CatalogEntry`
+        '''
+        entries = CatalogEntry.from_exist(eadid, preview)
+        with transaction.commit_on_success():
+            CatalogEntry.remove(eadid, preview)
+            CatalogEntry.objects.bulk_create(entries)
+        return entries
+
+    @staticmethod
+    def remove(eadid, preview=False):
+        'Remove any catalog entries for the specified eadid.'
+        CatalogEntry.objects.filter(eadid=eadid, preview=preview).delete()
+
+    @staticmethod
+    def _status_name(preview=False):
+        return CatalogStatus.PREVIEW_CATALOG if preview else CatalogStatus.CATALOG
+
+    @staticmethod
+    def mark_reconciled(preview=False):
+        '''Record that catalog entries have been regenerated for all
+        documents currently in eXist, so that they can be used in place of
+        eXist (see :meth:`available`).'''
+        CatalogStatus.mark_reconciled(CatalogEntry._status_name(preview))
+
+    @staticmethod
+    def available(preview=False):
+        '''Check if catalog information is available; returns False if
+        entries have not been generated for all documents (i.e.,
+        **reconcile_catalog** has not been run), in which case eXist should
+        be queried instead.  Entries stored by :meth:`update` for documents
+        loaded since then do not make the catalog available.'''
+        return CatalogStatus.is_reconciled(CatalogEntry._status_name(preview))
+
+    @staticmethod
+    def find(eadid, preview=False):
+        '''Find the catalog entry for a document by eadid.
+
+        :returns: :class:`CatalogEntry`, or None if there is no entry
+        '''
+        entries = list(CatalogEntry.objects.filter(eadid=eadid, preview=preview)[:1])
+        if entries:
+            return entries[0]
+
+    @staticmethod
+    def has_daos(eadid, internal=False, preview=False):
+        '''Check whether a cataloged document includes any digital archival
+        objects, without querying eXist.
+
+        :param eadid: eadid of the document
+        :param internal: boolean; if True, internal daos are included
+            (i.e., for users with permission to view them); otherwise,
+            only public daos are counted
+        :returns: boolean, or None if the document is not cataloged or
+            catalog information is not available (see :meth:`available`)
+        '''
+        if not CatalogEntry.available(preview):
+            return None
+        entry = CatalogEntry.find(eadid, preview)
+        if entry is not None:
+            return (entry.dao_count if internal else entry.public_dao_count) > 0
+
+    @staticmethod
+    def dao_eadids(internal=False, preview=False):
+        '''Eadids of all cataloged documents with digital archival objects,
+        for filtering searches without evaluating daos in eXist.  Only
+        available once the catalog has been reconciled, since a partial
+        catalog would leave out uncataloged documents with daos.
+
+        :param internal: boolean; if True, documents with only internal
+            daos are included; otherwise, only documents with public daos
+        :returns: set of eadids, or None if catalog information is not
+            available (see :meth:`available`)
+        '''
+        if not CatalogEntry.available(preview):
+            return None
+        entries = CatalogEntry.objects.filter(preview=preview)
+        if internal:
+            entries = entries.filter(dao_count__gt=0)
+        else:
+            entries = entries.filter(public_dao_count__gt=0)
+        return set(entries.values_list('eadid', flat=True))
+
+    @staticmethod
+    def last_modified_by_name(document_names, preview=False):
+        '''Last modification times for documents by document name.
+
+        :param document_names: list of document names
+        :returns: dictionary of document name to last modification time,
+            for the documents that are in the catalog
+        '''
+        return dict(CatalogEntry.objects.filter(document_name__in=document_names,
+                                                preview=preview)
+                                        .values_list('document_name', 'last_modified'))
+
+    @staticmethod
+    def most_recently_modified(preview=False):
+        '''Last modification time of the most recently modified document,
+        or None if there are no entries.'''
+        return CatalogEntry.objects.filter(preview=preview) \
+                   .aggregate(models.Max('last_modified'))['last_modified__max']
+
+
+class BrowseTitle(models.Model):
+    '''Browse information for a single published EAD document, so that
+    the alphabetical title browse and the list of browse letters can be
+    generated without querying eXist.  Browse titles are generated by
+    :meth:`build` whenever a document is published or loaded, removed when a
+    document is deleted, and regenerated for all published documents by the
+    **reconcile_catalog** script.  Browse titles are only used once they have
+    been regenerated for all documents (see :meth:`available`).
+    '''
+    eadid = models.CharField('EAD Identifier', max_length=50, unique=True)
+    sort_key = models.CharField(max_length=255,
+        help_text='normalized, lower-case list title, for case-insensitive sorting')
+    first_letter = models.CharField(max_length=1,
+        help_text='first letter of the list title, for browse by letter')
+    list_title = models.TextField(help_text='plain-text list title')
+    unittitle = models.TextField(blank=True)
+    abstract = models.TextField(blank=True)
+    physdesc = models.TextField(blank=True,
+        help_text='physical descriptions, separated by semicolons')
+    summary = models.TextField(
+        help_text='EAD xml with eadid and archdesc did only, for display')
+
+    #: fields to retrieve from eXist for generating browse titles
+    exist_fields = ['eadid', 'list_title', 'archdesc__did']
+
+    class Meta:
+        ordering = ['sort_key', 'eadid']
+        index_together = [['first_letter', 'sort_key']]
+
+    def __unicode__(self):
+        return self.list_title
+
+    @property
+    def findingaid(self):
+        ''':class:`FindingAid` initialized from the stored summary, with the
+        fields used for list display (eadid, list title, unittitle, abstract,
+        physical descriptions, and repository).'''
+        return xmlmap.load_xmlobject_from_string(self.summary.encode('utf-8'),
+                                                 FindingAid)
+
+    @staticmethod
+    def from_findingaid(ead):
+        '''Initialize (but do not save) a browse title for a finding aid.
+
+        :param ead: :class:`FindingAid`, either the full document or a
+            partial one with at least the fields in :attr:`exist_fields`
+        '''
+        # construct a minimal EAD document with the content needed for display
+        ns = '{%s}' % eadmap.EAD_NAMESPACE
+        root = etree.Element(ns + 'ead', nsmap={None: eadmap.EAD_NAMESPACE})
+        eadid = etree.SubElement(etree.SubElement(root, ns + 'eadheader'), ns + 'eadid')
+        eadid.text = ead.eadid.value
+        did = etree.SubElement(etree.SubElement(root, ns + 'archdesc'), ns + 'did')
+        for child in ead.archdesc.did.node:
+            did.append(deepcopy(child))
+        summary = xmlmap.load_xmlobject_from_string(etree.tostring(root), FindingAid)
+
+        list_title = unicode(summary.list_title or '')
+        return BrowseTitle(eadid=ead.eadid.value,
+                           sort_key=list_title.lower()[:255],
+                           first_letter=list_title[:1],
+                           list_title=list_title,
+                           unittitle=unicode(summary.unittitle or ''),
+                           abstract=unicode(summary.abstract or ''),
+                           physdesc='; '.join(summary.physical_descriptions),
+                           summary=etree.tostring(root, encoding=unicode))
+
+    @staticmethod
+    def build(ead):
+        '''Generate and save the browse title for a published document,
+        replacing any previously stored for the same eadid.
+
+        :param ead: :class:`FindingAid` instance for the full document
+        :returns: :class:`BrowseTitle`
+        '''
+        title = BrowseTitle.from_findingaid(ead)
+        with transaction.commit_on_success():
+            BrowseTitle.remove(title.eadid)
+            title.save()
+        return title
+
+    @staticmethod
+    def rebuild():
+        '''Regenerate browse titles for all documents currently in the
+        public eXist collection, replacing all stored browse titles, and
+        mark browse titles as available.
+
+        :returns: list of :class:`BrowseTitle`
+        '''
+        titles = [BrowseTitle.from_findingaid(ead) for ead in
+                  FindingAid.objects.only(*BrowseTitle.exist_fields)]
+        with transaction.commit_on_success():
+            BrowseTitle.objects.all().delete()
+            BrowseTitle.objects.bulk_create(titles)
+            CatalogStatus.mark_reconciled(CatalogStatus.BROWSE_TITLES)
+        return titles
+
+    @staticmethod
+    def remove(eadid):
+        'Remove the browse title for the specified eadid, if any.'
+        BrowseTitle.objects.filter(eadid=eadid).delete()
+
+    @staticmethod
+    def available():
+        '''Check if browse titles are available; returns False if they have
+        not been generated for all documents (i.e., **reconcile_catalog** has
+        not been run), in which case eXist should be queried instead.
+        Titles stored by :meth:`build` for documents published since then
+        do not make browse titles available.'''
+        return CatalogStatus.is_reconciled(CatalogStatus.BROWSE_TITLES)
+
+    @staticmethod
+    def letters():
+        'Sorted list of distinct first letters of all browse titles.'
+        return list(BrowseTitle.objects.order_by('first_letter')
+                               .values_list('first_letter', flat=True).distinct())
+
+
+class CollectionWatermark(models.Model):
+    '''Version number and modification time for the published finding aid
+    collection as a whole, used to generate Last-Modified and ETag headers
+    for views based on the entire collection (browse and search) and to
+    generate keys for collection-level cached values, without querying eXist.
+    There is a single watermark, which is incremented by :meth:`bump`
+    whenever a document is published, loaded, or deleted.
+    '''
+    version = models.PositiveIntegerField(default=1)
+    modified = models.DateTimeField(null=True,
+        help_text='last time a document was published, loaded, or deleted (eXist server time)')
+
+    #: primary key of the single watermark record
+    WATERMARK_ID = 1
+
+    def __unicode__(self):
+        return u'%d' % self.version
+
+    @staticmethod
+    def current():
+        '''Get the current watermark.  If no watermark has been stored yet,
+        initializes one with the last modification time of the most recently
+        modified document in eXist or the most recently deleted document,
+        whichever is more recent (or no modification time, if there
+        are neither).'''
+        try:
+            return CollectionWatermark.objects.get(pk=CollectionWatermark.WATERMARK_ID)
+        except CollectionWatermark.DoesNotExist:
+            last_modified = None
+            # most recently modified document in the eXist collection
+            fa = FindingAid.objects.order_by('-last_modified').only('last_modified')
+            if fa.count():
+                last_modified = fa[0].last_modified
+            # most recently deleted document from sql DB
+            deleted = Deleted.objects.order_by('-date').all()
+            if deleted.exists():
+                deleted_last = deleted[0].date
+                if last_modified is None or deleted_last > last_modified:
+                    last_modified = deleted_last
+
+            watermark, created = CollectionWatermark.objects.get_or_create(
+                pk=CollectionWatermark.WATERMARK_ID,
+                defaults={'modified': last_modified})
+            return watermark
+
+    @staticmethod
+    def exist_now():
+        '''Current time in the configured eXist server timezone
+        (**EXISTDB_SERVER_TIMEZONE**), without timezone information, so it
+        can be compared with last modification times from eXist.'''
+        return datetime.now(settings.EXISTDB_SERVER_TIMEZONE).replace(tzinfo=None)
+
+    @staticmethod
+    def bump():
+        '''Increment the collection version and set the modification time
+        to the current time.  Like document modification times, the time is
+        stored as eXist server time (see :meth:`exist_now`).
+
+        :returns: updated :class:`CollectionWatermark`
+        '''
+        now = CollectionWatermark.exist_now()
+        updated = CollectionWatermark.objects.filter(pk=CollectionWatermark.WATERMARK_ID) \
+            .update(version=models.F('version') + 1, modified=now)
+        if not updated:
+            # no watermark stored yet; initialize a new one at the current time
+            watermark, created = CollectionWatermark.objects.get_or_create(
+                pk=CollectionWatermark.WATERMARK_ID,
+                defaults={'modified': now})
+            if not created:
+                return CollectionWatermark.bump()
+        return CollectionWatermark.current()
+
+    def cache_key(self, name):
+        '''Generate a cache key for a collection-level value, so that cached
+        values are not used after the collection changes.
+
+        :param name: base name for the cache key
+        '''
+        return '%s:%d' % (name, self.version)
+
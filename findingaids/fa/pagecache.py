@@ -0,0 +1,247 @@
+# file findingaids/fa/pagecache.py
+#
+#   Copyright 2012 Emory University Library
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+Cache for rendered single finding aid pages.
+
+Pages are cached by eadid, the eXist SHA-1 hash of the EAD document, preview
+mode, and url parameters (e.g., keywords used for highlighting), so a cached
+page is never served for a different version of a document or a different
+request.  Cached pages for a document are also
+removed when that document is published, previewed, or deleted (see
+:meth:`findingaids.fa_admin.utils.document_loaded`).
+
+The cache backend is configured with the **FINDINGAID_PAGE_CACHE** setting,
+which should be a dictionary with a **BACKEND** (python path to the backend
+class) and optional **OPTIONS** (keyword arguments for initializing the
+backend), e.g.::
+
+    FINDINGAID_PAGE_CACHE = {
+        'BACKEND': 'findingaids.fa.pagecache.LRUCache',
+        'OPTIONS': {'max_size': 20 * 1024 * 1024},
+    }
+
+A backend must implement ``get(key, group)``, ``set(key, value, group)``,
+``delete_group(group)``, and ``stats()``, where group is the eadid of the
+document a page belongs to.
+"""
+
+from collections import OrderedDict
+import hashlib
+import logging
+import threading
+from urllib import urlencode
+
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.core.cache import cache as django_cache
+from django.utils.importlib import import_module
+
+logger = logging.getLogger(__name__)
+
+
+class LRUCache(object):
+    '''Local-memory page cache with least-recently-used eviction, bounded by
+    the total size in bytes of the cached content.  Pages are cached
+    separately for each process.
+
+    :param max_size: maximum total size of cached content, in bytes
+    '''
+
+    def __init__(self, max_size=10 * 1024 * 1024):
+        self.max_size = max_size
+        self.size = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # key -> (value, group), oldest first
+        self._groups = {}   # group -> set of keys
+        self._lock = threading.Lock()
+
+    def get(self, key, group=None):
+        with self._lock:
+            if key not in self._entries:
+                return None
+            # re-insert to mark as most recently used
+            entry = self._entries.pop(key)
+            self._entries[key] = entry
+            return entry[0]
+
+    def set(self, key, value, group=None):
+        if len(value) > self.max_size:
+            return
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (value, group)
+            self.size += len(value)
+            self._groups.setdefault(group, set()).add(key)
+            # evict least recently used pages until under the size limit
+            while self.size > self.max_size:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def delete_group(self, group):
+        with self._lock:
+            for key in list(self._groups.get(group, [])):
+                self._remove(key)
+
+    def _remove(self, key):
+        # NOTE: expects lock to be held by caller
+        if key in self._entries:
+            value, group = self._entries.pop(key)
+            self.size -= len(value)
+            keys = self._groups.get(group)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._groups[group]
+
+    def stats(self):
+        return {'entries': len(self._entries), 'size': self.size,
+                'max_size': self.max_size, 'evictions': self.evictions}
+
+
+class DjangoCache(object):
+    '''Page cache backend that stores pages in the configured Django cache,
+    so that cached pages can be shared by multiple processes.  Pages for a
+    document are invalidated by updating a per-document version number that is
+    included in the cache key.
+
+    :param timeout: cache timeout in seconds; uses the Django default if
+        not specified
+    '''
+
+    key_prefix = 'findingaid-page'
+
+    def __init__(self, timeout=None):
+        self.timeout = timeout
+
+    def _version_key(self, group):
+        return '%s-version:%s' % (self.key_prefix, group)
+
+    def _cache_key(self, key, group):
+        version = django_cache.get(self._version_key(group))
+        if version is None:
+            version = 1
+        # hash to ensure key is short enough for any cache backend
+        return '%s:%s' % (self.key_prefix,
+            hashlib.md5((u'%s:%s' % (version, key)).encode('utf-8')).hexdigest())
+
+    def get(self, key, group=None):
+        return django_cache.get(self._cache_key(key, group))
+
+    def set(self, key, value, group=None):
+        django_cache.set(self._cache_key(key, group), value, self.timeout)
+
+    def delete_group(self, group):
+        version_key = self._version_key(group)
+        try:
+            django_cache.incr(version_key)
+        except ValueError:
+            # no version set yet; any pages were cached with the default version
+            django_cache.set(version_key, 2)
+
+    def stats(self):
+        return {}
+
+
+DEFAULT_CONFIG = {
+    'BACKEND': 'findingaids.fa.pagecache.LRUCache',
+    'OPTIONS': {},
+}
+
+_backend = None
+_counts = {'hits': 0, 'misses': 0}
+
+
+def get_backend():
+    '''Get the configured page cache backend, initializing it on first use.'''
+    global _backend
+    if _backend is None:
+        config = getattr(settings, 'FINDINGAID_PAGE_CACHE', DEFAULT_CONFIG)
+        module_name, class_name = config['BACKEND'].rsplit('.', 1)
+        backend_class = getattr(import_module(module_name), class_name)
+        _backend = backend_class(**config.get('OPTIONS', {}))
+    return _backend
+
+
+def cacheable(request):
+    '''Determine if a rendered page can be cached for the current request.
+    Pages include user-specific content for logged in users and messages,
+    so only pages without either of those are cached.'''
+    if request.user.is_authenticated():
+        return False
+    # NOTE: len does not mark messages as used
+    if len(get_messages(request)):
+        return False
+    return True
+
+
+def page_key(request, eadid, hash, preview=False):
+    '''Generate a cache key for a rendered finding aid page.  The key
+    includes all url parameters (e.g., keywords used for highlighting),
+    since the page content includes the full request url.
+
+    :param eadid: eadid of the document being displayed
+    :param hash: eXist SHA-1 hash of the current version of the document
+    :param preview: boolean indicating preview mode
+    '''
+    # page content includes absolute urls, so include host and path in the key
+    parts = [request.get_host(), request.path, eadid, hash,
+             'preview' if preview else 'public']
+    if request.GET:
+        # normalize parameter order; values for a parameter keep their order
+        params = sorted(((name.encode('utf-8'), value.encode('utf-8'))
+                         for name, values in request.GET.lists() for value in values),
+                        key=lambda param: param[0])
+        parts.append(hashlib.md5(urlencode(params)).hexdigest())
+    return ':'.join(parts)
+
+
+def get_page(key, eadid):
+    '''Get a cached page, if available.  Updates hit and miss counts.'''
+    content = get_backend().get(key, eadid)
+    if content is None:
+        _counts['misses'] += 1
+    else:
+        _counts['hits'] += 1
+    return content
+
+
+def set_page(key, eadid, content):
+    'Cache rendered page content for a document.'
+    get_backend().set(key, content, eadid)
+
+
+def invalidate(eadid):
+    'Remove all cached pages for a document.'
+    logger.debug('Removing cached pages for %s' % eadid)
+    get_backend().delete_group(eadid)
+
+
+def stats():
+    '''Page cache statistics for the current process: hit and miss counts
+    and any statistics provided by the backend.'''
+    info = dict(_counts)
+    info.update(get_backend().stats())
+    return info
+
+
+def reset():
+    '''Discard the current backend (and all pages cached in local memory)
+    and reset hit and miss counts; the backend will be re-initialized from
+    current settings on next use.'''
+    global _backend
+    _backend = None
+    _counts.update({'hits': 0, 'misses': 0})
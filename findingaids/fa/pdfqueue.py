@@ -0,0 +1,189 @@
+# file findingaids/fa/pdfqueue.py
+#
+#   Copyright 2012 Emory University Library
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+Coordination of on-demand PDF generation.
+
+Generating the PDF for a large finding aid (rendering the template,
+converting to XSL-FO, and running FOP) takes a lot of memory, so PDF
+renders are coordinated per process:
+
+ * concurrent requests for the same version of a document share a single
+   in-flight render and all get its result
+ * at most **MAX_RENDERS** PDFs are generated at once; other renders wait
+   in a queue of up to **MAX_QUEUE** renders, and requests that would
+   exceed the queue are refused (the PDF view responds with a 503 and a
+   Retry-After header)
+
+Configured with the **FINDINGAID_PDF_RENDER** setting, which should be a
+dictionary with the following keys:
+
+ * **MAX_RENDERS**: maximum number of simultaneous PDF renders per process
+ * **MAX_QUEUE**: maximum number of renders waiting to start
+ * **TIMEOUT**: maximum number of seconds to wait for a render
+ * **RETRY_AFTER**: number of seconds clients are asked to wait before
+   retrying when PDF generation is busy
+"""
+
+import logging
+import threading
+import time
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'MAX_RENDERS': 2,
+    'MAX_QUEUE': 10,
+    'TIMEOUT': 300,
+    'RETRY_AFTER': 60,
+}
+
+
+class QueueFull(Exception):
+    '''A render could not be started or completed because PDF generation
+    is at capacity.'''
+    pass
+
+
+class _Render(object):
+    # a single in-flight render shared by all callers for the same key
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiting = 0
+
+
+class RenderQueue(object):
+    '''Single-flight render queue with bounded concurrency.
+
+    :param max_renders: maximum number of renders running at once
+    :param max_queue: maximum number of renders waiting to start
+    :param timeout: maximum number of seconds to wait for a render to
+        start, or for a shared render to complete
+    '''
+
+    def __init__(self, max_renders=2, max_queue=10, timeout=300):
+        self.max_renders = max_renders
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self._lock = threading.Condition()
+        self._renders = {}
+        self._running = 0
+        self._queued = 0
+
+    def stats(self):
+        '''Dictionary with the number of running and queued renders.'''
+        with self._lock:
+            return {'running': self._running, 'queued': self._queued}
+
+    def render(self, key, func):
+        '''Run a render, or share the result of the render already in
+        progress for the same key.  Exceptions raised by the render are
+        raised to every caller sharing it.
+
+        :param key: identifier for the render (e.g., eadid and document hash)
+        :param func: function to generate the result, called with no arguments
+        :returns: the result of **func**
+        :raises: :class:`QueueFull` if the queue is full, or the render does
+            not start or complete within the timeout
+        '''
+        leader = False
+        with self._lock:
+            current = self._renders.get(key, None)
+            if current is not None:
+                current.waiting += 1
+            else:
+                if self._running >= self.max_renders and \
+                   self._queued >= self.max_queue:
+                    raise QueueFull('PDF render queue is full')
+                current = _Render()
+                self._renders[key] = current
+                self._queued += 1
+                leader = True
+
+        if not leader:
+            # another request is already rendering this key
+            logger.debug('Waiting for in-progress render of %s' % (key,))
+            if not current.done.wait(self.timeout):
+                raise QueueFull('Timed out waiting for PDF render of %s' % (key,))
+            if current.error is not None:
+                raise current.error
+            return current.result
+
+        try:
+            self._start(key)
+            try:
+                current.result = func()
+            finally:
+                with self._lock:
+                    self._running -= 1
+                    self._lock.notify()
+            return current.result
+        except Exception, e:
+            current.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._renders[key]
+            current.done.set()
+
+    def _start(self, key):
+        # wait for a free render slot
+        deadline = time.time() + self.timeout
+        with self._lock:
+            try:
+                while self._running >= self.max_renders:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise QueueFull('Timed out waiting to start PDF render of %s' % (key,))
+                    self._lock.wait(remaining)
+            finally:
+                self._queued -= 1
+            self._running += 1
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_config():
+    '''Render configuration from the **FINDINGAID_PDF_RENDER** setting,
+    with defaults for any values that are not set.'''
+    config = DEFAULTS.copy()
+    config.update(getattr(settings, 'FINDINGAID_PDF_RENDER', {}))
+    return config
+
+
+def get_queue():
+    '''Get the render queue for the current process, creating it from the
+    configured settings if necessary.'''
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            config = get_config()
+            _queue = RenderQueue(max_renders=config['MAX_RENDERS'],
+                                 max_queue=config['MAX_QUEUE'],
+                                 timeout=config['TIMEOUT'])
+        return _queue
+
+
+def render(key, func):
+    '''Run a render with the render queue for the current process.  See
+    :meth:`RenderQueue.render`.'''
+    return get_queue().render(key, func)
@@ -0,0 +1,354 @@
+# file findingaids/fa/pdfsplit.py
+#
+#   Copyright 2012 Emory University Library
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+Rendering of very large finding aid PDFs in parts.
+
+Apache FOP lays out a document as a single job on a single core, which can
+take minutes for finding aids with thousands of components.  Finding aids
+with series and at least **MIN_COMPONENTS** components are instead split
+into the front matter and one part for each top-level series (see
+:meth:`split_xhtml`), which are laid out in parallel by separate FOP
+processes into the FOP intermediate format (IF).  The intermediate
+documents are then merged (see :meth:`merge_intermediate`) and the merged
+document is rendered to PDF, which does not require any layout.
+
+When merging, pages are renumbered: series parts are laid out with page
+numbers starting at :data:`PAGE_NUMBER_MARKER`, and the marker page
+numbers are replaced with the page numbers in the merged document.  The
+bookmark tree (document title, with a bookmark for each series) is
+generated for the merged document.  Links to content in another part
+(e.g., from the list of series in the front matter) are laid out as links
+to a ``pdfsplit:`` uri, and anchors linked from other parts are declared
+as named destinations; when merging, those links are replaced with links
+to the page and position of the destination.
+
+Configured with the **FINDINGAID_PDF_SPLIT** setting, which should be a
+dictionary with the following keys:
+
+ * **MIN_COMPONENTS**: minimum number of components in a finding aid for
+   its PDF to be rendered in parts; if not set (the default), PDFs are
+   never split
+ * **PROCESSES**: maximum number of parts to lay out at the same time
+   (when using the FOP worker pool, parts are also limited by the number
+   of workers; see :mod:`findingaids.fa.foppool`)
+"""
+
+import logging
+from multiprocessing.pool import ThreadPool
+import os
+import shutil
+import tempfile
+
+from django.conf import settings
+from lxml import etree
+
+from eulxml.xmlmap.eadmap import EAD_NAMESPACE
+
+from findingaids.fa.utils import xslfo_to_pdf, run_xslfo_processor
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'MIN_COMPONENTS': None,
+    'PROCESSES': 4,
+}
+
+FO_NAMESPACE = 'http://www.w3.org/1999/XSL/Format'
+IF_NAMESPACE = 'http://xmlgraphics.apache.org/fop/intermediate'
+NAV_NAMESPACE = 'http://xmlgraphics.apache.org/fop/intermediate/document-navigation'
+
+#: initial page number for series parts; must have more digits than any
+#: real page number, so footer page numbers can be identified and replaced
+PAGE_NUMBER_MARKER = 1000001
+
+#: uri prefix for links to content in another part (see xhtml_to_xslfo.xsl)
+LINK_PREFIX = 'pdfsplit:'
+
+#: width of a digit in the footer font, in ems (Times, FOP's default font)
+DIGIT_WIDTH = 0.5
+
+
+def get_config():
+    '''Split configuration from the **FINDINGAID_PDF_SPLIT** setting, with
+    defaults for any values that are not set.'''
+    config = DEFAULTS.copy()
+    config.update(getattr(settings, 'FINDINGAID_PDF_SPLIT', {}))
+    return config
+
+
+def component_count(ead):
+    '''Number of components in the container list of a finding aid.
+
+    :param ead: :class:`~findingaids.fa.models.FindingAid`
+    '''
+    return int(ead.node.xpath('count(e:archdesc/e:dsc//*[e:did])',
+                              namespaces={'e': EAD_NAMESPACE}))
+
+
+def should_split(ead):
+    '''True if the PDF for a finding aid should be rendered in parts: the
+    finding aid has series and at least the configured minimum number of
+    components.'''
+    min_components = get_config()['MIN_COMPONENTS']
+    return bool(min_components) and ead.dsc is not None and \
+        ead.dsc.hasSeries() and component_count(ead) >= min_components
+
+
+def split_xhtml(xhtml):
+    '''Split the xhtml for a full finding aid (as rendered by the
+    **fa/full.html** template) into the front matter and one part for each
+    top-level series; content after the last series (e.g., indexes) is
+    included in the last part.  Each part includes the page header and
+    footer content.  Content is moved from the original xhtml, which should
+    not be used afterwards.
+
+    Anchors in each part that are linked from other parts are passed to
+    the stylesheet as named destinations (see :meth:`merge_intermediate`).
+
+    :param xhtml: parsed xhtml for the full finding aid
+    :returns: list of tuples of part xhtml and parameters for
+        :meth:`~findingaids.fa.utils.xhtml_to_xslfo`; a single part with no
+        parameters if the document has no series
+    '''
+    content = xhtml.xpath("//div[@class='fa']")
+    if not content or not content[0].xpath("div[@class='series-part']"):
+        return [(xhtml, {})]
+    content = content[0]
+
+    groups = [[]]
+    for child in list(content):
+        if child.tag == 'div' and child.get('class') == 'series-part':
+            groups.append([])
+        groups[-1].append(child)
+        content.remove(child)
+
+    # anchors in each part, and internal link targets from each part
+    anchors, targets = [], []
+    for group in groups:
+        links = [a for element in group for a in element.iter('a')]
+        anchors.append(set(a.get('name') for a in links if a.get('name')))
+        targets.append(set(a.get('href')[1:] for a in links
+                           if a.get('href', '').startswith('#')))
+
+    # xhtml is now a skeleton with page header and footer content only;
+    # copy it for each series, and use the original for the front matter
+    skeletons = [xhtml] + [etree.fromstring(etree.tostring(xhtml))
+                           for group in groups[1:]]
+    parts = []
+    for i, group in enumerate(groups):
+        part = skeletons[i]
+        part_content = part.xpath("//div[@class='fa']")[0]
+        part_content.extend(group)
+        if i == 0:
+            params = {'part': 'front'}
+        else:
+            # part starts on a new page; no page break needed
+            first = part_content.xpath("div[@class='series-part']/div[@class='nextpage']")
+            if first:
+                del first[0].attrib['class']
+            params = {'part': 'series', 'initial_page_number': PAGE_NUMBER_MARKER}
+        other_targets = set().union(*[t for j, t in enumerate(targets) if j != i])
+        destinations = anchors[i] & other_targets
+        if destinations:
+            params['destinations'] = ' '.join(sorted(destinations))
+        parts.append((part, params))
+    return parts
+
+
+def bookmark_title(xslfo):
+    '''Bookmark title for a part: the text of the first anchor (the
+    document title in the front matter, or the series title).
+
+    :param xslfo: XSL-FO for the part, as generated from :meth:`split_xhtml`
+    '''
+    return xslfo.xpath('normalize-space((//fo:flow//fo:inline[@id])[1])',
+                       namespaces={'fo': FO_NAMESPACE})
+
+
+def _font_size(text):
+    # font size for an IF text element, from the preceding font element
+    for sibling in text.itersiblings(preceding=True):
+        if sibling.tag == '{%s}font' % IF_NAMESPACE and sibling.get('size'):
+            return int(sibling.get('size'))
+
+
+def _replace_page_number(page, old, new):
+    # replace the footer page number on an IF page; adjust the horizontal
+    # position of the (centered) number for the difference in width
+    for text in page.iter('{%s}text' % IF_NAMESPACE):
+        if text.text == old:
+            text.text = new
+            if 'dx' in text.attrib:
+                del text.attrib['dx']
+            size = _font_size(text)
+            if size and text.get('x'):
+                shift = (len(old) - len(new)) * size * DIGIT_WIDTH / 2
+                text.set('x', str(int(int(text.get('x')) + shift)))
+            return True
+    return False
+
+
+def _bookmark(title, page_index, id):
+    bookmark = etree.Element('{%s}bookmark' % NAV_NAMESPACE, title=title)
+    bookmark.set('starting-state', 'show')
+    action = etree.SubElement(bookmark, '{%s}goto-xy' % NAV_NAMESPACE, id=id, x='0', y='0')
+    action.set('page-index', str(page_index))
+    return bookmark
+
+
+def _prefix_action_ids(root, prefix):
+    # add a prefix to navigation action ids and references to them
+    for element in root.iter():
+        if isinstance(element.tag, basestring) and \
+           element.tag.startswith('{%s}' % NAV_NAMESPACE):
+            for attr in ('id', 'idref'):
+                if element.get(attr):
+                    element.set(attr, prefix + element.get(attr))
+
+
+def _resolve_links(root, destinations):
+    # replace links to content in another part with links to the position
+    # of the named destination in the merged document
+    for action in list(root.iter('{%s}goto-uri' % NAV_NAMESPACE)):
+        uri = action.get('uri', '')
+        if not uri.startswith(LINK_PREFIX):
+            continue
+        target = destinations.get(uri[len(LINK_PREFIX):], None)
+        if target is None:
+            logger.warn('No destination found for link to %s' % uri)
+            continue
+        resolved = etree.Element('{%s}goto-xy' % NAV_NAMESPACE)
+        for attr in ('id', 'idref', 'page-index', 'x', 'y'):
+            value = action.get(attr) if attr in ('id', 'idref') else target.get(attr)
+            if value is not None:
+                resolved.set(attr, value)
+        resolved.tail = action.tail
+        action.getparent().replace(action, resolved)
+
+
+def merge_intermediate(documents, titles):
+    '''Merge FOP intermediate format documents for the parts of a PDF
+    into a single document: pages are renumbered, series footer page
+    numbers (see :data:`PAGE_NUMBER_MARKER`) are replaced, navigation
+    targets are adjusted for the new page positions, navigation action ids
+    (numbered separately in each part) are made unique, links to content in
+    another part (see :data:`LINK_PREFIX`) are resolved to the named
+    destination for that content, and a bookmark tree is added with the
+    front matter title and a bookmark for each series.
+
+    :param documents: list of parsed intermediate format documents
+        (:class:`lxml.etree.ElementTree`), front matter first
+    :param titles: list of bookmark titles for each part
+    :returns: merged document, as an :class:`lxml.etree.ElementTree`
+    '''
+    merged = documents[0].getroot()
+    trailer = merged.find('{%s}trailer' % IF_NAMESPACE)
+    if trailer is None:
+        trailer = etree.SubElement(merged, '{%s}trailer' % IF_NAMESPACE)
+
+    offset = 0
+    first_pages = []
+    destinations = {}
+    for i, document in enumerate(documents):
+        root = document.getroot()
+        first_pages.append(offset)
+        pages = list(root.iter('{%s}page' % IF_NAMESPACE))
+        for n, page in enumerate(pages):
+            page.set('index', str(offset + n))
+            if i:
+                page.set('name', str(offset + n + 1))
+                if not _replace_page_number(page, str(PAGE_NUMBER_MARKER + n),
+                                            str(offset + n + 1)):
+                    logger.warn('Page number not found on page %d of part %d' % (n, i))
+        _prefix_action_ids(root, 'p%d-' % i)
+        if offset:
+            for action in root.iter('{%s}goto-xy' % NAV_NAMESPACE):
+                page_index = action.get('page-index')
+                if page_index is not None and int(page_index) >= 0:
+                    action.set('page-index', str(int(page_index) + offset))
+        for destination in root.iter('{%s}named-destination' % NAV_NAMESPACE):
+            action = destination.find('{%s}goto-xy' % NAV_NAMESPACE)
+            if action is not None and destination.get('name'):
+                destinations[destination.get('name')] = action
+        if i:
+            for sequence in root.findall('{%s}page-sequence' % IF_NAMESPACE):
+                trailer.addprevious(sequence)
+            part_trailer = root.find('{%s}trailer' % IF_NAMESPACE)
+            if part_trailer is not None:
+                trailer.extend(list(part_trailer))
+        offset += len(pages)
+    _resolve_links(merged, destinations)
+
+    # replace any bookmarks from the parts with bookmarks for the whole document
+    for tree in list(merged.iter('{%s}bookmark-tree' % NAV_NAMESPACE)):
+        tree.getparent().remove(tree)
+    tree = etree.SubElement(trailer, '{%s}bookmark-tree' % NAV_NAMESPACE)
+    title = _bookmark(titles[0], 0, 'pdfsplit-bookmark-0')
+    for i in range(1, len(documents)):
+        title.append(_bookmark(titles[i], first_pages[i], 'pdfsplit-bookmark-%d' % i))
+    tree.append(title)
+    return etree.ElementTree(merged)
+
+
+def _render_part(paths):
+    fo_path, if_path = paths
+    return run_xslfo_processor(fo_path, if_path, mode='if',
+                               cwd=os.path.dirname(fo_path))
+
+
+def render_pdf(parts):
+    '''Render XSL-FO to a single PDF.  If there is more than one part, the
+    parts are laid out in parallel and merged.
+
+    :param parts: list of XSL-FO parts (:class:`lxml.etree.ElementTree`),
+        e.g. as generated from :meth:`split_xhtml`
+    :returns: PDF content as a string
+    :raises: Exception if the XSL-FO processor fails to generate the PDF
+    '''
+    if len(parts) == 1:
+        return xslfo_to_pdf(parts[0])
+
+    tmpdir = tempfile.mkdtemp(prefix='findingaids-pdfsplit-')
+    try:
+        jobs = []
+        for i, part in enumerate(parts):
+            fo_path = os.path.join(tmpdir, 'part%03d.fo' % i)
+            part.write(fo_path, encoding='UTF-8', xml_declaration=True)
+            jobs.append((fo_path, os.path.join(tmpdir, 'part%03d.if' % i)))
+
+        pool = ThreadPool(min(get_config()['PROCESSES'], len(jobs)))
+        try:
+            results = pool.map(_render_part, jobs)
+        finally:
+            pool.close()
+            pool.join()
+        if not all(results):
+            raise Exception("There was an error generating the PDF (%d of %d parts failed)"
+                            % (results.count(False), len(results)))
+
+        merged = merge_intermediate([etree.parse(if_path) for fo_path, if_path in jobs],
+                                    [bookmark_title(part) for part in parts])
+        merged_path = os.path.join(tmpdir, 'merged.if')
+        merged.write(merged_path, encoding='UTF-8', xml_declaration=True)
+        pdf_path = os.path.join(tmpdir, 'merged.pdf')
+        if not run_xslfo_processor(merged_path, pdf_path, mode='ifin', cwd=tmpdir):
+            raise Exception("There was an error generating the PDF")
+        logger.debug('Rendered PDF in %d parts' % len(parts))
+        with open(pdf_path, 'rb') as pdf:
+            return pdf.read()
+    finally:
+        shutil.rmtree(tmpdir)
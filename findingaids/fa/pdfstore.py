@@ -0,0 +1,331 @@
+# file findingaids/fa/pdfstore.py
+#
+#   Copyright 2012 Emory University Library
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+On-disk store for generated finding aid PDFs.
+
+PDFs are stored by eadid and the eXist SHA-1 hash of the EAD document they
+were generated from (as ``<eadid>/<hash>.pdf`` under the store directory),
+so a stored PDF is never served for a different version of a document.
+PDFs for published documents are generated in the background when a document
+is published or loaded (see :meth:`findingaids.fa_admin.tasks.store_pdf`);
+the printable PDF view serves the stored file when there is one, and
+otherwise generates the PDF on demand and stores it.
+
+This module also generates the XSL-FO and PDF for the full contents of a
+finding aid (see :meth:`full_findingaid_xslfo` and
+:meth:`store_findingaid_pdf`), so the background tasks that fill the store
+do not depend on the views.
+
+Storing a new version of a PDF removes any other versions for the same
+document, PDFs are removed when a document is deleted, and the total size of
+the store is kept within a budget by removing the least recently served PDFs.
+
+The store is configured with the **FINDINGAID_PDF_STORE** setting, which
+should be a dictionary with the following keys:
+
+ * **DIR**: directory for stored PDFs; if not set, the store is disabled
+   and PDFs are always generated on demand
+ * **MAX_SIZE**: maximum total size of stored PDFs, in bytes
+ * **SENDFILE**: optional header for delivering stored PDFs directly from
+   disk by the web server: ``X-Sendfile`` (e.g., Apache mod_xsendfile), or
+   ``X-Accel-Redirect`` (nginx; also requires **SENDFILE_URL**, the internal
+   url location that maps to the store directory).  If not set, stored PDFs
+   are streamed from disk by the application.
+
+For example::
+
+    FINDINGAID_PDF_STORE = {
+        'DIR': '/var/cache/findingaids/pdf',
+        'MAX_SIZE': 2 * 1024 * 1024 * 1024,
+        'SENDFILE': 'X-Sendfile',
+    }
+"""
+
+import errno
+import logging
+import os
+import shutil
+import tempfile
+import zlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import StreamingHttpResponse
+from lxml import etree
+
+from findingaids.fa import pdfsplit
+from findingaids.fa.utils import pdf_response, read_chunks, XSLFO_VERSION, \
+    get_findingaid, ead_etag, render_xhtml, xhtml_to_xslfo, full_findingaid_args
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'DIR': None,
+    'MAX_SIZE': 2 * 1024 * 1024 * 1024,
+    'SENDFILE': None,
+    'SENDFILE_URL': None,
+}
+
+
+def get_config():
+    '''Store configuration from the **FINDINGAID_PDF_STORE** setting,
+    with defaults for any values that are not set.'''
+    config = DEFAULTS.copy()
+    config.update(getattr(settings, 'FINDINGAID_PDF_STORE', {}))
+    return config
+
+
+def enabled():
+    '''True if a PDF store directory is configured.'''
+    return bool(get_config()['DIR'])
+
+
+def pdf_path(eadid, hash):
+    '''Full path where the PDF for a version of a document is stored.'''
+    return os.path.join(get_config()['DIR'], eadid, '%s.pdf' % hash)
+
+
+def get(eadid, hash):
+    '''Get the stored PDF for a version of a document.  The modification
+    time of the file is updated, so that the least recently served PDFs are
+    removed first when the store is over its size budget.
+
+    :param eadid: eadid of the document
+    :param hash: eXist SHA-1 hash of the document
+    :returns: path to the stored PDF, or None if it is not stored
+    '''
+    if not enabled():
+        return None
+    path = pdf_path(eadid, hash)
+    try:
+        os.utime(path, None)
+    except OSError:
+        return None
+    return path
+
+
+def store(eadid, hash, content):
+    '''Store the PDF for a version of a document, removing any other
+    versions of the PDF for the same document, and then removing the least
+    recently served PDFs if the store is over its size budget (see
+    :meth:`collect_garbage`).  The file is written under a temporary name
+    and renamed when complete, so a partially written PDF is never served.
+
+    :param eadid: eadid of the document
+    :param hash: eXist SHA-1 hash of the document the PDF was generated from
+    :param content: PDF content, as a string
+    :returns: path to the stored PDF, or None if the store is disabled or
+        the PDF could not be stored
+    '''
+    if not enabled():
+        return None
+    path = pdf_path(eadid, hash)
+    docdir = os.path.dirname(path)
+    try:
+        try:
+            os.makedirs(docdir)
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                raise
+        tmp = tempfile.NamedTemporaryFile(prefix='.tmp-', suffix='.pdf',
+                                          dir=docdir, delete=False)
+        try:
+            tmp.write(content)
+            tmp.close()
+            os.rename(tmp.name, path)
+        except:
+            os.unlink(tmp.name)
+            raise
+    except (IOError, OSError), e:
+        logger.error('Failed to store PDF for %s: %s' % (eadid, e))
+        return None
+
+    # remove any other versions of this PDF
+    for filename in os.listdir(docdir):
+        if filename.endswith('.pdf') and not filename.startswith('.') and \
+           os.path.join(docdir, filename) != path:
+            _remove_file(os.path.join(docdir, filename))
+    logger.debug('Stored PDF for %s (%d bytes)' % (eadid, len(content)))
+    collect_garbage()
+    return path
+
+
+def remove(eadid):
+    '''Remove all stored PDFs for a document (e.g., when it is deleted).'''
+    if enabled():
+        shutil.rmtree(os.path.join(get_config()['DIR'], eadid), ignore_errors=True)
+
+
+def _remove_file(path):
+    try:
+        os.unlink(path)
+    except OSError, e:
+        # may already have been removed by another process
+        if e.errno != errno.ENOENT:
+            logger.error('Failed to remove stored PDF %s: %s' % (path, e))
+
+
+def stored_files():
+    '''List all stored PDFs, as a list of (modification time, size, path)
+    tuples, least recently served first.'''
+    files = []
+    store_dir = get_config()['DIR']
+    if not store_dir or not os.path.isdir(store_dir):
+        return files
+    for eadid in os.listdir(store_dir):
+        docdir = os.path.join(store_dir, eadid)
+        if not os.path.isdir(docdir):
+            continue
+        for filename in os.listdir(docdir):
+            # skip partially written temporary files
+            if not filename.endswith('.pdf') or filename.startswith('.'):
+                continue
+            path = os.path.join(docdir, filename)
+            try:
+                info = os.stat(path)
+            except OSError:
+                continue
+            files.append((info.st_mtime, info.st_size, path))
+    return sorted(files)
+
+
+def collect_garbage(max_size=None):
+    '''Remove the least recently served PDFs until the total size of the
+    store is within the size budget, and remove any empty document
+    directories.
+
+    :param max_size: size budget in bytes; defaults to the configured
+        **MAX_SIZE**
+    :returns: tuple of number of PDFs removed and total bytes removed
+    '''
+    if max_size is None:
+        max_size = get_config()['MAX_SIZE']
+    files = stored_files()
+    total = sum(size for mtime, size, path in files)
+    removed = removed_size = 0
+    for mtime, size, path in files:
+        if total <= max_size:
+            break
+        _remove_file(path)
+        total -= size
+        removed += 1
+        removed_size += size
+        try:
+            os.rmdir(os.path.dirname(path))
+        except OSError:
+            pass    # directory is not empty
+    if removed:
+        logger.info('Removed %d stored PDF%s (%d bytes) to stay within size limit' %
+                    (removed, '' if removed == 1 else 's', removed_size))
+    return removed, removed_size
+
+
+def serve(path, filename=None):
+    '''Generate a response for a stored PDF.  If **SENDFILE** is configured,
+    the response only includes a header telling the web server to send the
+    file from disk; otherwise, the file is streamed in chunks (see
+    :meth:`~findingaids.fa.utils.read_chunks`).
+
+    :param path: path to the stored PDF, as returned by :meth:`get` or
+        :meth:`store`
+    :param filename: optional filename, to specify to the browser in the response
+    :rtype: :class:`django.http.HttpResponse`
+    '''
+    config = get_config()
+    if config['SENDFILE'] == 'X-Accel-Redirect':
+        response = pdf_response('', filename)
+        response['X-Accel-Redirect'] = '%s/%s' % (config['SENDFILE_URL'].rstrip('/'),
+            os.path.relpath(path, config['DIR']).replace(os.sep, '/'))
+    elif config['SENDFILE']:
+        response = pdf_response('', filename)
+        response[config['SENDFILE']] = path
+    else:
+        response = StreamingHttpResponse(read_chunks(open(path, 'rb')),
+                                         content_type='application/pdf')
+        response['Content-Length'] = os.path.getsize(path)
+        if filename:
+            response['Content-Disposition'] = "inline; filename=%s" % filename
+    return response
+
+
+def full_findingaid_xslfo(eadid, hash, preview=False, request=None, parts=False):
+    """Get the XSL-FO for the full contents of a finding aid, as used to
+    generate the PDF.  The XSL-FO is cached (serialized and compressed) by
+    eadid, document hash, preview mode, whether it is split into parts,
+    and XSL-FO version (see :data:`findingaids.fa.utils.XSLFO_VERSION`), so
+    regenerating a PDF or viewing the XSL-FO does not render the template
+    or run the XSLT again.
+
+    :param eadid: eadid for the document
+    :param hash: eXist SHA-1 hash of the current version of the document
+    :param preview: boolean indicating preview mode
+    :param request: current request, if any
+    :param parts: if True, return a list of XSL-FO parts; very large
+        finding aids are split by series for rendering in parallel (see
+        :mod:`findingaids.fa.pdfsplit`), and others are a single part
+    :returns: :class:`lxml.etree.ElementTree`, or a list of them if
+        **parts** is True
+    """
+    cache_key = 'xslfo:%s:%s:%s:%s:%s' % (eadid, hash, 'preview' if preview else 'published',
+                                          'parts' if parts else 'full', XSLFO_VERSION)
+    cached = cache.get(cache_key) if hash else None
+    if cached is not None:
+        xslfo = [etree.ElementTree(etree.fromstring(zlib.decompress(part)))
+                 for part in cached]
+    else:
+        fa = get_findingaid(eadid, preview=preview)
+        xslfo = findingaid_xslfo(fa, hash, preview, request,
+                                  split=parts and pdfsplit.should_split(fa))
+        if hash:
+            # use configured default cache timeout
+            cache.set(cache_key, [zlib.compress(etree.tostring(part, encoding='UTF-8'))
+                                  for part in xslfo])
+    return xslfo if parts else xslfo[0]
+
+
+def findingaid_xslfo(fa, hash, preview=False, request=None, split=False):
+    """Generate the XSL-FO for the full contents of a finding aid.
+
+    :param fa: :class:`~findingaids.fa.models.FindingAid` for the full document
+    :param split: if True, split the document into parts by series (see
+        :meth:`findingaids.fa.pdfsplit.split_xhtml`)
+    :returns: list of XSL-FO parts, as :class:`lxml.etree.ElementTree`
+    """
+    xhtml = render_xhtml('fa/full.html', full_findingaid_args(fa, hash, 'pdf',
+                                                              preview, request))
+    if split:
+        return [xhtml_to_xslfo(part, **params)
+                for part, params in pdfsplit.split_xhtml(xhtml)]
+    return [xhtml_to_xslfo(xhtml)]
+
+
+def store_findingaid_pdf(eadid):
+    """Generate the PDF for a published finding aid and save it in the PDF
+    store, unless the current version of the document is already stored.
+    Used by :meth:`findingaids.fa_admin.tasks.store_pdf` to generate PDFs in
+    the background when a document is published or loaded.
+
+    :param eadid: eadid of the published document
+    :returns: path to the stored PDF, or None if the PDF store is not
+        enabled or the PDF could not be stored
+    """
+    hash = ead_etag(None, eadid)
+    pdf_path = get(eadid, hash)
+    if pdf_path is None and enabled():
+        pdf = pdfsplit.render_pdf(full_findingaid_xslfo(eadid, hash, parts=True))
+        pdf_path = store(eadid, hash, pdf)
+    return pdf_path
@@ -0,0 +1,231 @@
+# file findingaids/fa/querysyntax.py
+#
+#   Copyright 2012 Emory University Library
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+Local parsing and normalization of full-text search queries.
+
+Full-text searches are passed to eXist as Lucene queries, and eXist reports
+malformed queries (missing close quotes or parentheses, boolean operators
+without terms, etc.) with a 'Cannot parse' error.  :meth:`parse_query`
+checks a query against the Lucene query syntax before it is sent to eXist,
+so invalid queries can be reported to the user without an eXist request, and
+generates a canonical form of the query so that equivalent searches can
+share cached results.
+
+The parser follows the classic Lucene query parser grammar: terms (with
+``*`` and ``?`` wildcards and backslash escapes), quoted phrases, ``field:``
+prefixes, ``(grouping)``, inclusive and exclusive ranges, ``~`` fuzzy or
+proximity modifiers and ``^`` boosts, ``+``, ``-``, ``!`` and ``NOT``
+modifiers, and ``AND``/``&&`` and ``OR``/``||`` operators.  As on the rest of
+the site, lower-case ``and``, ``or``, and ``not`` are treated as operators.
+
+Only problems that Lucene would always reject are reported here; anything
+that depends on eXist index configuration (e.g., leading wildcards) is
+still validated by eXist.
+"""
+
+import re
+
+# characters that end a term (unless escaped); + and - are only special
+# at the beginning of a term
+TERM_END_CHARS = u' \t\n\r\u3000!():^[]"{}~\\'
+NUMBER_RE = re.compile(r'\d+(\.\d+)?')
+
+OPERATORS = {
+    'AND': 'AND', '&&': 'AND', 'and': 'AND',
+    'OR': 'OR', '||': 'OR', 'or': 'OR',
+    'NOT': 'NOT', 'not': 'NOT',
+}
+
+# token types
+TERM, PHRASE, RANGE, FUZZY, BOOST, COLON, LPAREN, RPAREN, \
+    MODIFIER, CONJUNCTION = range(10)
+
+
+class QuerySyntaxError(ValueError):
+    '''Exception raised when a full-text query is not valid Lucene query syntax.'''
+    pass
+
+
+def tokenize(query):
+    '''Split a full-text query into a list of (type, value) tokens.  Phrase
+    and range tokens are returned with internal whitespace normalized; range
+    contents are otherwise left for eXist to validate.
+
+    :raises: :class:`QuerySyntaxError` for unterminated phrases or ranges,
+        dangling escapes, or a boost without a number
+    '''
+    tokens = []
+    i, length = 0, len(query)
+    while i < length:
+        char = query[i]
+        if char.isspace():
+            i += 1
+        elif char in u'()':
+            tokens.append((LPAREN if char == u'(' else RPAREN, char))
+            i += 1
+        elif char == u':':
+            tokens.append((COLON, char))
+            i += 1
+        elif char in u'+-!':
+            tokens.append((MODIFIER, u'NOT' if char == u'!' else char))
+            i += 1
+        elif char == u'"':
+            end = _find_unescaped(query, u'"', i + 1)
+            if end == -1:
+                raise QuerySyntaxError('Missing close quote for phrase starting at position %d' % i)
+            tokens.append((PHRASE, u'"%s"' % u' '.join(query[i + 1:end].split())))
+            i = end + 1
+        elif char in u'[{':
+            close = u']' if char == u'[' else u'}'
+            end = _find_unescaped(query, close, i + 1)
+            if end == -1:
+                raise QuerySyntaxError('Missing %s for range starting at position %d' % (close, i))
+            tokens.append((RANGE, u'%s%s%s' % (char, u' '.join(query[i + 1:end].split()), close)))
+            i = end + 1
+        elif char in u'~^':
+            match = NUMBER_RE.match(query, i + 1)
+            if char == u'^' and match is None:
+                raise QuerySyntaxError('Boost at position %d must be followed by a number' % i)
+            end = match.end() if match else i + 1
+            tokens.append((FUZZY if char == u'~' else BOOST, query[i:end]))
+            i = end
+        elif char in u']}':
+            raise QuerySyntaxError('Unexpected %s at position %d' % (char, i))
+        else:
+            start = i
+            while i < length and (query[i] not in TERM_END_CHARS or query[i] == u'\\'):
+                if query[i] == u'\\':
+                    if i + 1 == length:
+                        raise QuerySyntaxError('Query cannot end with an escape character')
+                    i += 1
+                i += 1
+            word = query[start:i]
+            if word in OPERATORS:
+                operator = OPERATORS[word]
+                tokens.append((MODIFIER if operator == 'NOT' else CONJUNCTION, operator))
+            else:
+                tokens.append((TERM, word))
+    return tokens
+
+
+def _find_unescaped(query, char, start):
+    # index of the next unescaped occurrence of char, or -1
+    i = start
+    while i < len(query):
+        if query[i] == u'\\':
+            i += 2
+            continue
+        if query[i] == char:
+            return i
+        i += 1
+    return -1
+
+
+class _Parser(object):
+    # recursive-descent parser for a list of tokens, following the
+    # classic Lucene query parser grammar:
+    #   Query  ::= Modifier? Clause ( Conjunction? Modifier? Clause )*
+    #   Clause ::= ( TERM COLON )? ( Term | LPAREN Query RPAREN BOOST? )
+    #   Term   ::= ( TERM | PHRASE ) FUZZY? ( BOOST FUZZY? )? | RANGE BOOST?
+
+    def __init__(self, tokens, fold_case=False):
+        self.tokens = tokens
+        self.pos = 0
+        self.fold_case = fold_case
+
+    def peek(self, offset=0):
+        if self.pos + offset < len(self.tokens):
+            return self.tokens[self.pos + offset][0]
+
+    def next(self):
+        self.pos += 1
+        return self.tokens[self.pos - 1][1]
+
+    def parse(self):
+        query = self.query()
+        if self.peek() is not None:
+            # only an unmatched close paren stops a query before the end
+            raise QuerySyntaxError('Unmatched close parenthesis')
+        return query
+
+    def query(self):
+        clauses = []
+        while self.peek() not in (None, RPAREN):
+            conjunction = modifier = u''
+            if self.peek() == CONJUNCTION:
+                if not clauses:
+                    raise QuerySyntaxError('%s must be preceded by a search term' %
+                                           self.tokens[self.pos][1])
+                conjunction = self.next() + u' '
+            if self.peek() == MODIFIER:
+                modifier = self.next()
+                if modifier == u'NOT':
+                    modifier += u' '
+            clauses.append(conjunction + modifier + self.clause())
+        if not clauses:
+            raise QuerySyntaxError('Search terms are required')
+        return u' '.join(clauses)
+
+    def clause(self):
+        field = u''
+        if self.peek() == TERM and self.peek(1) == COLON:
+            field = self.next() + self.next()
+        token = self.peek()
+        if token == LPAREN:
+            self.next()
+            group = u'(%s)' % self.query()
+            if self.peek() != RPAREN:
+                raise QuerySyntaxError('Missing close parenthesis')
+            self.next()
+            return field + group + self.optional(BOOST)
+        if token in (TERM, PHRASE):
+            term = self.next()
+            if self.fold_case:
+                term = term.lower()
+            term += self.optional(FUZZY)
+            if self.peek() == BOOST:
+                term += self.next() + self.optional(FUZZY)
+            return field + term
+        if token == RANGE:
+            return field + self.next() + self.optional(BOOST)
+        if token is None or token == RPAREN:
+            raise QuerySyntaxError('Query ends without a search term')
+        raise QuerySyntaxError('Unexpected %s' % self.tokens[self.pos][1])
+
+    def optional(self, token_type):
+        if self.peek() == token_type:
+            return self.next()
+        return u''
+
+
+def parse_query(query, fold_case=False):
+    '''Check that a full-text query is valid and return it in canonical
+    form: boolean operators in upper case, whitespace normalized, and
+    modifiers, field prefixes, and grouping parentheses adjacent to the
+    terms they apply to.  Blank queries are returned as an empty string.
+
+    :param query: full-text query string
+    :param fold_case: if True, convert search terms to lower case.  Full-text
+        indexes use a lower-casing analyzer, so queries that differ only in
+        the case of search terms return the same results; use this to generate
+        cache keys, but not for display.
+    :raises: :class:`QuerySyntaxError` if the query is not valid
+    '''
+    tokens = tokenize(query)
+    if not tokens:
+        return u''
+    return _Parser(tokens, fold_case=fold_case).parse()
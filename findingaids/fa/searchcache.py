@@ -0,0 +1,157 @@
+# file findingaids/fa/searchcache.py
+#
+#   Copyright 2012 Emory University Library
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+Cache for finding aid search result sets.
+
+A search result set is the ordered list of eadids (with relevance scores,
+for keyword searches) matching a search.  Result sets are cached by the
+normalized search parameters and the collection watermark version (see
+:class:`~findingaids.fa.models.CollectionWatermark`), so a cached result
+set is never used after the collection changes.  Paging through cached
+search results only requires retrieving display fields for the documents on
+the current page, and facet counts for the search are calculated from the
+same results.
+
+Result sets are cached in local memory for each process, with
+least-recently-used eviction bounded by the total number of cached hits.
+The limit can be configured with the **FINDINGAID_SEARCH_CACHE_SIZE**
+setting (defaults to 50,000 hits).
+"""
+
+from collections import defaultdict
+import hashlib
+import logging
+
+from django.conf import settings
+
+from findingaids.fa.models import CatalogEntry, CollectionWatermark
+from findingaids.fa.pagecache import LRUCache
+from findingaids.fa.utils import fetch_results
+
+logger = logging.getLogger(__name__)
+
+
+class ResultSet(object):
+    '''Ordered results for a single search, as a list of (eadid, score)
+    tuples; score is None when results are not ordered by relevance.
+    Supports ``len`` and indexing, so it can be paginated with a django
+    paginator.
+
+    Also includes facet counts for all results: number of results for each
+    repository, and number of results with public digital archival objects.
+    '''
+
+    def __init__(self, hits, repository_counts=None, dao_count=0):
+        self.hits = hits
+        #: list of (repository, count) tuples, most results first
+        self.repository_counts = repository_counts or []
+        #: number of results with public daos
+        self.dao_count = dao_count
+
+    def __len__(self):
+        return len(self.hits)
+
+    def __getitem__(self, k):
+        return self.hits[k]
+
+    @property
+    def eadids(self):
+        return [eadid for eadid, score in self.hits]
+
+    @staticmethod
+    def from_queryset(qs, score=False):
+        '''Run a search and generate a result set with a single query.
+
+        :param qs: :class:`~findingaids.fa.models.FindingAid` queryset with
+            all search filters and ordering, without any ``only`` fields
+        :param score: include fulltext relevance scores (keyword searches only)
+        '''
+        fields = ['eadid', 'repository']
+        if score:
+            fields.append('fulltext_score')
+        # use dao counts from the local catalog once it has been reconciled,
+        # rather than counting daos in every result document in eXist
+        dao_eadids = CatalogEntry.dao_eadids()
+        if dao_eadids is None:
+            fields.append('public_dao_count')
+        hits = []
+        repositories = defaultdict(int)
+        dao_count = 0
+        for item in fetch_results(qs.only(*fields)):
+            hits.append((item.eadid.value,
+                         float(item.fulltext_score) if score else None))
+            for repo in set(item.repository):
+                repositories[repo] += 1
+            if dao_eadids is None:
+                if item.public_dao_count:
+                    dao_count += 1
+            elif item.eadid.value in dao_eadids:
+                dao_count += 1
+        repository_counts = sorted(repositories.iteritems(),
+                                   key=lambda (repo, count): (-count, repo))
+        return ResultSet(hits, repository_counts, dao_count)
+
+
+_cache = None
+
+
+def get_cache():
+    '''Get the result set cache, initializing it on first use.'''
+    global _cache
+    if _cache is None:
+        _cache = LRUCache(max_size=getattr(settings, 'FINDINGAID_SEARCH_CACHE_SIZE', 50000))
+    return _cache
+
+
+def search_key(**params):
+    '''Generate a cache key for a search from normalized search parameters
+    and the current collection watermark.  Values should include anything
+    that affects which documents are returned, including user permissions.
+    '''
+    normalized = u'|'.join(u'%s:%s' % (name, u' '.join(unicode(params[name]).split()))
+                           for name in sorted(params) if params[name])
+    return CollectionWatermark.current().cache_key('search:%s' %
+        hashlib.md5(normalized.encode('utf-8')).hexdigest())
+
+
+def get_results(key, qs, score=False):
+    '''Get the cached result set for a search, running the search and
+    caching the results if they are not already cached.
+
+    :param key: search key, as generated by :meth:`search_key`
+    :param qs: search queryset, for use if results are not cached (see
+        :meth:`ResultSet.from_queryset`)
+    :param score: include fulltext relevance scores
+    :rtype: :class:`ResultSet`
+    '''
+    cache = get_cache()
+    results = cache.get(key)
+    if results is None:
+        results = ResultSet.from_queryset(qs, score=score)
+        # empty result sets would never be evicted based on size
+        if len(results):
+            cache.set(key, results)
+    else:
+        logger.debug('Using cached search results for %s' % key)
+    return results
+
+
+def reset():
+    '''Discard all cached result sets; the cache will be re-initialized
+    from current settings on next use.'''
+    global _cache
+    _cache = None
@@ -419,67 +419,79 @@ def format_ead_rdfa(value, default_rel=None, autoescape=None):
     return format_ead(value, autoescape, rdfa=True, default_rel=default_rel)
 
 
+def _static_markup(start, end):
+    # handler for tags that always convert to the same start/end markup
+    return lambda node: (start, end)
+
+# precomputed dispatch tables used by format_ead_node, so that each node
+# requires a single dictionary lookup for display formatting and one for RDFa
+# - key is tag name, value is a callable that takes a node and returns a
+#   tuple of start/end markup
+_display_handlers = dict((tag, _static_markup(start, end))
+                         for tag, (start, end) in simple_tags.iteritems())
+_display_handlers.update(other_tags)
+# - key is tag name, value is a callable that takes a node and default rel
+#   and returns a tuple of start/end markup; names take precedence
+_rdfa_handlers = dict(semantic_tags)
+_rdfa_handlers.update((tag, format_nametag) for tag in name_tags)
+
+
 def format_ead_node(node, escape, rdfa=False, default_rel=None):
-    '''Recursive method to generate HTML with the text and any
-    formatting for the contents of an EAD node.
+    '''Generate HTML with the text and any formatting for the contents
+    of an EAD node.
+
+    Nodes are processed in a single iterative pass, using a stack of
+    pending nodes instead of recursion, so large sections such as a
+    container list do not require one Python call per element and cannot
+    exceed the recursion limit.  All output is collected in a single list
+    and joined once.
 
     :param node: lxml element or node to be converted from EAD to HTML
     :param escape: template escape method to be used on node text content
     :returns: string with the HTML output
     '''
-    # find any start/end tags for the current element
-
-    # check for supported render attributes
-    rend = node.get('render', None)
-
-    rdfa_start, rdfa_end = '', ''
-
-    # convert names to semantic web / rdfa if requested
-    if rdfa and node.tag in name_tags.keys():
-        rdfa_start, rdfa_end = format_nametag(node, default_rel)
-
-    elif rdfa and node.tag in semantic_tags.keys():
-        rdfa_start, rdfa_end = semantic_tags[node.tag](node, default_rel)
-
-    # convert display/formatting
-    # NOTE: a few semantic tags also have formatting conversion
-
-    start, end = '', ''
-    if rend is not None and rend in rend_attributes.keys():
-        s, e = rend_attributes[rend]
-        start += s
-        end = e + end
-
-    # simple tags that can be converted to html markup
-    elif node.tag in simple_tags.keys():
-        start, end = simple_tags[node.tag]
-
-    # more complex tags
-    elif node.tag in other_tags.keys():
-        start, end = other_tags[node.tag](node)
-
-    # unsupported tags that do not get converted
-    else:
+    output = []
+    # nodes still to be processed, last item first; the end markup and tail
+    # text for each node is pushed as a string below its children, so
+    # that it is output once all of the children have been processed
+    pending = [node]
+    while pending:
+        current = pending.pop()
+        if isinstance(current, basestring):
+            output.append(current)
+            continue
+
+        # find any start/end tags for the current element
+        # - check for supported render attributes first, then tags
+        #   that can be converted to html markup
+        # NOTE: a few semantic tags also have formatting conversion
         start, end = '', ''
-
-    start += rdfa_start
-    end = rdfa_end + end
-
-    # list of text contents to be compiled
-    contents = [start]  # start tag
-    # include any text directly in this node, before the first child
-    if node.text is not None:
-        contents.append(escape(node.text))
-
-    # format any child nodes and add to the list of text
-    contents.extend([format_ead_node(el, escape=escape, rdfa=rdfa,
-                                     default_rel=default_rel)
-                     for el in node.iterchildren()])
-
-    # end tag for this node + any tail text
-    contents.extend([end, escape(node.tail or '')])
-
-    return ''.join(contents)
+        rend = current.get('render', None)
+        if rend is not None and rend in rend_attributes:
+            start, end = rend_attributes[rend]
+        else:
+            handler = _display_handlers.get(current.tag, None)
+            if handler is not None:
+                start, end = handler(current)
+
+        # convert names and other semantic tags to rdfa if requested
+        if rdfa:
+            handler = _rdfa_handlers.get(current.tag, None)
+            if handler is not None:
+                rdfa_start, rdfa_end = handler(current, default_rel)
+                start += rdfa_start
+                end = rdfa_end + end
+
+        output.append(start)
+        # include any text directly in this node, before the first child
+        if current.text is not None:
+            output.append(escape(current.text))
+
+        # end tag for this node + any tail text, followed by child nodes
+        pending.append(end + escape(current.tail or ''))
+        pending.extend(reversed(current))
+
+    return ''.join(output)
 
 EAD_SCOPECONTENT = '{%s}scopecontent' % EAD_NAMESPACE
 EAD_BIOGHIST = '{%s}bioghist' % EAD_NAMESPACE
@@ -17,3 +17,11 @@
 from findingaids.fa.tests.models import *
 from findingaids.fa.tests.views import *
 from findingaids.fa.tests.utils import *
+from findingaids.fa.tests.pagecache import *
+from findingaids.fa.tests.foppool import *
+from findingaids.fa.tests.pdfstore import *
+from findingaids.fa.tests.pdfqueue import *
+from findingaids.fa.tests.pdfsplit import *
+from findingaids.fa.tests.searchcache import *
+from findingaids.fa.tests.querysyntax import *
+from findingaids.fa.tests.autocomplete import *
@@ -0,0 +1,104 @@
+# file findingaids/fa/tests/autocomplete.py
+#
+#   Copyright 2012 Emory University Library
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+from os import path
+from mock import patch
+
+from django.test import TestCase as DjangoTestCase
+
+from eulexistdb.testutil import TestCase
+
+from findingaids.fa import autocomplete
+from findingaids.fa.autocomplete import PrefixIndex, normalize
+from findingaids.fa.models import CollectionWatermark
+
+exist_fixture_path = path.join(path.dirname(path.abspath(__file__)), 'fixtures')
+
+
+class PrefixIndexTest(DjangoTestCase):
+
+    terms = [u'Irish drama--20th century.', u'Theater--Ireland--20th century.',
+             u'Dublin (Ireland)', u'Scripts.', u'Theater programs.',
+             u'Theater programs.', u'  ', u'Caf\xe9 society']
+
+    def test_normalize(self):
+        self.assertEqual(u'cafe society', normalize(u' Caf\xe9   Society'))
+
+    def test_search(self):
+        index = PrefixIndex(self.terms)
+        self.assertEqual(6, len(index), 'duplicate and blank terms are not indexed')
+        self.assertEqual([u'Theater programs.', u'Theater--Ireland--20th century.'],
+                         index.search('theater'))
+        self.assertEqual([u'Theater programs.'], index.search('THEATER P'))
+        # matches on later words follow matches on the beginning of the term
+        self.assertEqual([u'Irish drama--20th century.', u'Dublin (Ireland)',
+                          u'Theater--Ireland--20th century.'],
+                         index.search('ir'))
+        self.assertEqual([u'Caf\xe9 society'], index.search('cafe'))
+        self.assertEqual([u'Caf\xe9 society'], index.search('soc'))
+        self.assertEqual([u'Theater programs.'], index.search('theater', limit=1))
+        self.assertEqual([], index.search('zzz'))
+        self.assertEqual([], index.search(' '))
+
+
+class SuggestTest(TestCase):
+    exist_fixtures = {'files': [path.join(exist_fixture_path, 'abbey244.xml'),
+                                path.join(exist_fixture_path, 'raoul548.xml')]}
+
+    def setUp(self):
+        autocomplete.reset()
+
+    def tearDown(self):
+        autocomplete.reset()
+
+    def test_suggest(self):
+        autocomplete.update_indexes()
+        suggestions = autocomplete.suggest('theater')
+        self.assert_(('subject', u'Theater programs.') in suggestions)
+        self.assert_(('subject', u'Theater--Ireland--20th century.') in suggestions)
+        suggestions = autocomplete.suggest('abbey', types=['title'])
+        self.assert_(suggestions)
+        self.assert_(all(type == 'title' for type, term in suggestions))
+
+    @patch('findingaids.fa.autocomplete.threading.Thread')
+    def test_rebuild(self, mockthread):
+        # no indexes yet - no suggestions while indexes are built in the background
+        self.assertEqual([], autocomplete.suggest('theater'))
+        self.assertEqual(1, mockthread.call_count)
+        mockthread.return_value.start.assert_called_once_with()
+        with patch.object(autocomplete, 'WATERMARK_CHECK_INTERVAL', new=0):
+            autocomplete.suggest('theater')
+        self.assertEqual(1, mockthread.call_count,
+            'only one rebuild should run at a time')
+
+        # background rebuild finished
+        autocomplete.reset()
+        autocomplete.update_indexes()
+        mockthread.reset_mock()
+        with patch('findingaids.fa.autocomplete.build_indexes') as mockbuild:
+            suggestions = autocomplete.suggest('theater')
+            self.assert_(('subject', u'Theater programs.') in suggestions)
+            CollectionWatermark.bump()
+            autocomplete.suggest('theater')
+            self.assertEqual(0, mockthread.call_count,
+                'collection version should not be checked again until the check interval has passed')
+            with patch.object(autocomplete, 'WATERMARK_CHECK_INTERVAL', new=0):
+                self.assertEqual(suggestions, autocomplete.suggest('theater'),
+                    'previous indexes should be used while the rebuild runs')
+            self.assertEqual(1, mockthread.call_count,
+                'indexes should be rebuilt when the collection changes')
+            self.assertEqual(0, mockbuild.call_count,
+                'indexes should not be built in the request')
@@ -0,0 +1,138 @@
+# file findingaids/fa/tests/foppool.py
+#
+#   Copyright 2012 Emory University Library
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import os
+import shutil
+import sys
+import tempfile
+
+from django.test import TestCase as DjangoTestCase
+from django.test.utils import override_settings
+
+from findingaids.fa import foppool
+from findingaids.fa.foppool import FopPool, FopError, WorkerError
+
+# minimal worker implementing the FopWorker protocol: copies the input
+# file to the output; input containing 'invalid' is an error, and
+# 'crash' or 'hang' simulate a worker failure
+TEST_WORKER = '''
+import sys, time
+print 'READY'
+sys.stdout.flush()
+for line in iter(sys.stdin.readline, ''):
+    line = line.rstrip('\\n')
+    if line == 'PING':
+        print 'OK'
+    elif line == 'QUIT':
+        break
+    elif line.startswith('RENDER '):
+        fo, pdf = line[len('RENDER '):].split('\\t')
+        content = open(fo).read()
+        if 'crash' in content:
+            sys.exit(1)
+        if 'hang' in content:
+            time.sleep(10)
+        if 'invalid' in content:
+            print 'ERROR invalid XSL-FO'
+        else:
+            open(pdf, 'w').write('pdf:' + content)
+            print 'OK'
+    sys.stdout.flush()
+'''
+
+
+class FopPoolTest(DjangoTestCase):
+    command = [sys.executable, '-c', TEST_WORKER]
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='findingaids-foppool-test-')
+        self.pool = FopPool(self.command, workers=1, timeout=2)
+
+    def tearDown(self):
+        self.pool.shutdown()
+        shutil.rmtree(self.tmpdir)
+
+    def fo_file(self, content):
+        path = os.path.join(self.tmpdir, 'test.fo')
+        with open(path, 'w') as fo:
+            fo.write(content)
+        return path
+
+    def render(self, content):
+        pdf_path = os.path.join(self.tmpdir, 'test.pdf')
+        self.pool.render(self.fo_file(content), pdf_path)
+        with open(pdf_path) as pdf:
+            return pdf.read()
+
+    def test_render(self):
+        self.assertEqual('pdf:one', self.render('one'))
+        self.assertEqual('pdf:two', self.render('two'))
+        # worker is started once and reused
+        self.assertEqual(1, self.pool.started)
+
+        # processing error does not replace the worker
+        self.assertRaises(FopError, self.render, 'invalid')
+        self.assertEqual('pdf:three', self.render('three'))
+        self.assertEqual(1, self.pool.started)
+
+    def test_restart(self):
+        self.render('one')
+        # worker failure is reported and the worker is replaced
+        self.assertRaises(WorkerError, self.render, 'crash')
+        self.assertEqual('pdf:two', self.render('two'))
+        self.assertEqual(2, self.pool.started)
+
+        # worker that does not respond within the timeout is replaced
+        self.assertRaises(WorkerError, self.render, 'hang')
+        self.assertEqual('pdf:three', self.render('three'))
+        self.assertEqual(3, self.pool.started)
+
+        # worker is restarted after max jobs
+        self.pool.max_jobs = 1
+        self.render('four')
+        self.assertEqual(4, self.pool.started)
+        self.assertEqual(1, self.pool.restarted)
+
+    def test_health_check(self):
+        self.render('one')
+        # idle worker that fails the health check is replaced
+        self.pool.idle_check = 0
+        worker = self.pool._idle.get()
+        self.assert_(worker.ping(), 'running worker should pass health check')
+        worker.proc.kill()
+        worker.proc.wait()
+        self.assertFalse(worker.ping())
+        self.pool._idle.put(worker)
+        self.assertEqual('pdf:two', self.render('two'))
+        self.assertEqual(2, self.pool.started)
+
+    def test_startup_failure(self):
+        pool = FopPool(['/nonexistent/fop-worker'], workers=1)
+        self.assertRaises(WorkerError, pool.render, self.fo_file('one'),
+                          os.path.join(self.tmpdir, 'test.pdf'))
+
+    def test_get_pool(self):
+        with override_settings(FINDINGAID_FOP_POOL={'COMMAND': None}):
+            self.assertFalse(foppool.enabled())
+        with override_settings(FINDINGAID_FOP_POOL={'COMMAND': self.command,
+                                                    'WORKERS': 3}):
+            self.assert_(foppool.enabled())
+            pool = foppool.get_pool()
+            self.assertEqual(3, pool._idle.qsize())
+            self.assert_(pool is foppool.get_pool())
+            foppool.shutdown()
+            self.assert_(pool is not foppool.get_pool())
+            foppool.shutdown()
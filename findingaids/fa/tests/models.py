@@ -24,10 +24,13 @@ from django.test.utils import override_settings
 
 from eulxml.xmlmap import load_xmlobject_from_file, load_xmlobject_from_string
 from eulxml.xmlmap.eadmap import EAD_NAMESPACE
+from eulexistdb.exceptions import DoesNotExist
 from eulexistdb.testutil import TestCase
 
 from findingaids.fa.models import FindingAid, LocalComponent, EadRepository, \
-    Series, Title
+    Series, Title, NavigationItem, Index, SeriesOrIndex, CatalogEntry, \
+    CollectionWatermark, BrowseTitle, HighlightSummary
+from findingaids.fa.utils import component_link_tree, navigation_link_tree
 # from findingaids.fa.utils import pages_to_show, ead_lastmodified, \
     # collection_lastmodified
 
@@ -197,6 +200,69 @@ class EadRepositoryTestCase(TestCase):
         self.assert_('Manuscript, Archives, and Rare Book Library' in repos)
 
 
+class SeriesOrIndexTestCase(TestCase):
+    exist_fixtures = {'files': [path.join(exist_fixture_path, 'raoul548.xml')]}
+
+    def test_get_typed(self):
+        qs = SeriesOrIndex.objects.also('ead__eadid', 'ead__title') \
+                                  .filter(ead__eadid='raoul548', id='raoul548_s1')
+        series = SeriesOrIndex.get_typed(qs)
+        self.assert_(isinstance(series, Series))
+        self.assertEqual('raoul548_s1', series.id)
+        self.assertEqual('Series 1: Letters and personal papers, 1865-1982',
+                         series.display_label())
+        # additional return fields
+        self.assertEqual('raoul548', series.ead.eadid.value)
+        self.assert_(series.queryTime() >= 0)
+
+        qs = SeriesOrIndex.objects.also('ead__eadid') \
+                                  .filter(ead__eadid='raoul548', id='raoul548_index1')
+        index = SeriesOrIndex.get_typed(qs)
+        self.assert_(isinstance(index, Index))
+        self.assertEqual('raoul548_index1', index.id)
+        self.assertEqual('index1', index.short_id)
+        self.assertEqual('raoul548', index.ead.eadid.value)
+
+        # without additional fields
+        index = SeriesOrIndex.get_typed(SeriesOrIndex.objects.filter(id='raoul548_index1'))
+        self.assert_(isinstance(index, Index))
+        self.assertEqual('Index of Selected Correspondents', unicode(index.head))
+
+        # c02 ids should not be found
+        qs = SeriesOrIndex.objects.filter(ead__eadid='raoul548', id='raoul548_s1.1')
+        self.assertRaises(DoesNotExist, SeriesOrIndex.get_typed, qs)
+        qs = SeriesOrIndex.objects.filter(ead__eadid='raoul548', id='bogus')
+        self.assertRaises(DoesNotExist, SeriesOrIndex.get_typed, qs)
+
+
+class HighlightSummaryTestCase(TestCase):
+    exist_fixtures = {'files': [path.join(exist_fixture_path, 'raoul548.xml')]}
+
+    def test_get(self):
+        summary = HighlightSummary.get('raoul548', 'mansion institute',
+                                       settings.EXISTDB_ROOT_COLLECTION)
+        # same counts as the highlighted full document
+        self.assertEqual({'raoul548_s4': 3, 'raoul548_index1': 2},
+                         summary.component_matches)
+        self.assert_(summary.queryTime() >= 0)
+
+        summary = HighlightSummary.get('raoul548', 'raoul georgia',
+                                       settings.EXISTDB_ROOT_COLLECTION)
+        self.assert_(summary.did_matches > 0)
+        self.assertEqual(51, summary.coll_desc_matches)
+        self.assertEqual(30, summary.controlaccess_matches)
+        self.assert_(summary.component_matches['raoul548_s1'] > 0)
+
+        # no matches
+        summary = HighlightSummary.get('raoul548', 'notinthistext',
+                                       settings.EXISTDB_ROOT_COLLECTION)
+        self.assertEqual(0, summary.did_matches)
+        self.assertEqual(0, summary.admin_info_matches)
+        self.assertEqual(0, summary.coll_desc_matches)
+        self.assertEqual(0, summary.controlaccess_matches)
+        self.assertEqual({}, summary.component_matches)
+
+
 class SeriesTestCase(DjangoTestCase):
 
     # plain file item with no semantic tags
@@ -285,3 +351,247 @@ class SeriesTestCase(DjangoTestCase):
             # fallback type is manuscript
             self.assertEqual('bibo:Manuscript', bailey.dsc.c[0].c[0].rdf_type,
                 'items in photograph series should default to image type')
+
+
+class NavigationItemTestCase(DjangoTestCase):
+
+    def setUp(self):
+        self.raoul = load_xmlobject_from_file(path.join(exist_fixture_path,
+                                              'raoul548.xml'), FindingAid)
+        self.leverette = load_xmlobject_from_file(path.join(exist_fixture_path,
+                                                  'leverette135.xml'), FindingAid)
+
+    def test_build(self):
+        items = NavigationItem.build(self.raoul)
+        # saved to the database in document order
+        stored = NavigationItem.for_document('raoul548')
+        self.assertEqual(len(items), len(stored))
+        self.assertEqual(range(len(stored)), [i.position for i in stored])
+        self.assertFalse(NavigationItem.for_document('raoul548', preview=True),
+                         'navigation for published document should not be found in preview mode')
+
+        # top-level series
+        series = [i for i in stored if i.level == 1]
+        self.assertEqual(4, len(series))
+        self.assertEqual('raoul548_s1', series[0].component_id)
+        self.assertEqual('s1', series[0].short_id)
+        self.assertEqual('', series[0].parent)
+        self.assertEqual(NavigationItem.SERIES, series[0].kind)
+        self.assertEqual('Series 1', series[0].unitid)
+        self.assertEqual(self.raoul.dsc.c[0].display_label(), series[0].label)
+        self.assert_('Letters and personal papers' in series[0].title)
+
+        # subseries
+        subseries = stored[1]
+        self.assertEqual(2, subseries.level)
+        self.assertEqual('raoul548_s1.1', subseries.component_id)
+        self.assertEqual('raoul548_s1', subseries.parent)
+        # sub-subseries
+        c03 = [i for i in stored if i.level == 3]
+        self.assert_(c03, 'sub-subseries should be included in navigation')
+        self.assertEqual('raoul548_4.1a', c03[0].component_id)
+
+        # index
+        indexes = [i for i in stored if i.is_index]
+        self.assertEqual(1, len(indexes))
+        self.assertEqual('raoul548_index1', indexes[0].component_id)
+        self.assertEqual('index1', indexes[0].short_id)
+        self.assertEqual(0, indexes[0].level)
+        self.assertEqual('Index of Selected Correspondents', indexes[0].title)
+        self.assertEqual(indexes[0], stored[-1], 'indexes should follow series')
+
+        # rebuilding should replace, not duplicate
+        NavigationItem.build(self.raoul)
+        self.assertEqual(len(items), NavigationItem.objects.filter(eadid='raoul548').count())
+
+        # preview navigation is stored separately
+        NavigationItem.build(self.raoul, preview=True)
+        self.assertEqual(len(items), len(NavigationItem.for_document('raoul548', preview=True)))
+        NavigationItem.remove('raoul548', preview=True)
+        self.assertFalse(NavigationItem.for_document('raoul548', preview=True))
+        self.assertEqual(len(items), len(NavigationItem.for_document('raoul548')))
+
+    def test_build_series_without_id(self):
+        # series without ids are skipped, along with their subseries, both in
+        # stored navigation and in series links generated from the document
+        subseries = self.raoul.dsc.c[3].c[0]
+        self.assertEqual('raoul548_4.1', subseries.id)
+        del subseries.node.attrib['id']
+        items = NavigationItem.build(self.raoul)
+        ids = [i.component_id for i in items]
+        self.assert_('raoul548_s4' in ids)
+        self.assertFalse([id for id in ids if id.startswith('raoul548_4.1')],
+                         'subseries without id and its sub-subseries should not be included')
+        self.assertEqual(component_link_tree(self.raoul.dsc),
+                         navigation_link_tree(NavigationItem.for_document('raoul548')))
+        # subseries links for a single series follow the same rules
+        series4 = [item for item in navigation_link_tree(items)
+                   if item['id'] == 'raoul548_s4'][0]
+        self.assertEqual(series4['children'], component_link_tree(self.raoul.dsc.c[3]))
+
+    def test_build_noseries(self):
+        # file-level c01s should not be included in navigation
+        self.assertEqual([], NavigationItem.build(self.leverette))
+        self.assertFalse(NavigationItem.for_document('leverette135'))
+
+    def test_from_component(self):
+        item = NavigationItem.from_component(self.raoul.dsc.c[1], 'raoul548',
+                                             position=3)
+        # not saved
+        self.assertEqual(None, item.pk)
+        self.assertEqual('raoul548_s2', item.component_id)
+        self.assertEqual(3, item.position)
+        self.assertEqual(0, item.match_count)
+
+
+class CatalogEntryTestCase(TestCase):
+    exist_fixtures = {'files': [path.join(exist_fixture_path, 'raoul548.xml'),
+                                path.join(exist_fixture_path, 'abbey244.xml')]}
+
+    def test_from_exist(self):
+        entries = CatalogEntry.from_exist()
+        self.assertEqual(2, len(entries))
+        self.assertEqual(None, entries[0].pk, 'catalog entries should not be saved')
+
+        entries = CatalogEntry.from_exist('raoul548')
+        self.assertEqual(1, len(entries))
+        entry = entries[0]
+        self.assertEqual('raoul548', entry.eadid)
+        self.assertEqual('raoul548.xml', entry.document_name)
+        self.assert_(settings.EXISTDB_ROOT_COLLECTION.replace('/db', '') in entry.collection_name)
+        self.assertEqual(40, len(entry.hash))
+        fa = FindingAid.objects.only('hash', 'last_modified', 'repository').get(eadid='raoul548')
+        self.assertEqual(fa.hash, entry.hash)
+        self.assertEqual(fa.last_modified, entry.last_modified)
+        self.assertEqual(fa.repository[0], entry.repository)
+        self.assertFalse(entry.preview)
+
+        self.assertEqual([], CatalogEntry.from_exist('raoul548', preview=True))
+
+    def test_update_remove(self):
+        self.assertFalse(CatalogEntry.available())
+        self.assertEqual(None, CatalogEntry.find('raoul548'))
+
+        CatalogEntry.update('raoul548')
+        # entries for individual documents do not make the catalog available
+        self.assertFalse(CatalogEntry.available())
+        CatalogEntry.mark_reconciled()
+        self.assert_(CatalogEntry.available())
+        self.assertFalse(CatalogEntry.available(preview=True))
+        entry = CatalogEntry.find('raoul548')
+        self.assertEqual('raoul548.xml', entry.document_name)
+        self.assertEqual(None, CatalogEntry.find('raoul548', preview=True))
+        # update replaces existing entries
+        CatalogEntry.update('raoul548')
+        self.assertEqual(1, CatalogEntry.objects.filter(eadid='raoul548').count())
+
+        CatalogEntry.update('abbey244')
+        modified = CatalogEntry.last_modified_by_name(['raoul548.xml', 'abbey244.xml',
+                                                       'bogus.xml'])
+        self.assertEqual(set(['raoul548.xml', 'abbey244.xml']), set(modified.keys()))
+        self.assertEqual(entry.last_modified, modified['raoul548.xml'])
+        self.assertEqual(max(modified.values()), CatalogEntry.most_recently_modified())
+
+        CatalogEntry.remove('raoul548')
+        self.assertEqual(None, CatalogEntry.find('raoul548'))
+        self.assertNotEqual(None, CatalogEntry.find('abbey244'))
+        self.assertEqual(None, CatalogEntry.most_recently_modified(preview=True))
+
+    def test_daos(self):
+        # catalog not available
+        self.assertEqual(None, CatalogEntry.has_daos('abbey244'))
+        self.assertEqual(None, CatalogEntry.dao_eadids())
+
+        CatalogEntry.update('raoul548')
+        CatalogEntry.update('abbey244')
+        # catalog not reconciled
+        self.assertEqual(None, CatalogEntry.has_daos('abbey244'))
+        self.assertEqual(None, CatalogEntry.dao_eadids())
+
+        CatalogEntry.mark_reconciled()
+        # abbey244 has a single internal dao
+        entry = CatalogEntry.find('abbey244')
+        self.assertEqual(1, entry.dao_count)
+        self.assertEqual(0, entry.public_dao_count)
+        self.assertFalse(CatalogEntry.has_daos('abbey244'))
+        self.assertTrue(CatalogEntry.has_daos('abbey244', internal=True))
+        self.assertFalse(CatalogEntry.has_daos('raoul548', internal=True))
+        self.assertEqual(None, CatalogEntry.has_daos('bogus'))
+
+        self.assertEqual(set(), CatalogEntry.dao_eadids())
+        self.assertEqual(set(['abbey244']), CatalogEntry.dao_eadids(internal=True))
+        self.assertEqual(None, CatalogEntry.dao_eadids(preview=True))
+
+
+class BrowseTitleTestCase(TestCase):
+    exist_fixtures = {'files': [path.join(exist_fixture_path, 'raoul548.xml'),
+                                path.join(exist_fixture_path, 'abbey244.xml')]}
+
+    def test_from_findingaid(self):
+        ead = load_xmlobject_from_file(path.join(exist_fixture_path, 'raoul548.xml'),
+                                       FindingAid)
+        title = BrowseTitle.from_findingaid(ead)
+        self.assertEqual(None, title.pk, 'browse title should not be saved')
+        self.assertEqual('raoul548', title.eadid)
+        self.assertEqual(unicode(ead.list_title), title.list_title)
+        self.assertEqual('raoul family.', title.sort_key)
+        self.assertEqual('R', title.first_letter)
+        self.assertEqual(unicode(ead.unittitle), title.unittitle)
+        self.assertEqual(unicode(ead.abstract), title.abstract)
+        self.assertEqual('; '.join(ead.physical_descriptions), title.physdesc)
+
+        # summary includes the fields needed for list display
+        fa = title.findingaid
+        self.assert_(isinstance(fa, FindingAid))
+        self.assertEqual('raoul548', fa.eadid.value)
+        self.assertEqual(unicode(ead.list_title), unicode(fa.list_title))
+        self.assertEqual(unicode(ead.unittitle), unicode(fa.unittitle))
+        self.assertEqual(unicode(ead.abstract), unicode(fa.abstract))
+        self.assertEqual(ead.physical_descriptions, fa.physical_descriptions)
+        self.assertEqual(ead.repository, fa.repository)
+
+    def test_build_rebuild_remove(self):
+        self.assertFalse(BrowseTitle.available())
+        ead = load_xmlobject_from_file(path.join(exist_fixture_path, 'abbey244.xml'),
+                                       FindingAid)
+        BrowseTitle.build(ead)
+        # titles for individual documents do not cover the whole collection
+        self.assertFalse(BrowseTitle.available())
+        # build replaces any existing title
+        BrowseTitle.build(ead)
+        self.assertEqual(1, BrowseTitle.objects.filter(eadid='abbey244').count())
+
+        titles = BrowseTitle.rebuild()
+        self.assert_(BrowseTitle.available())
+        self.assertEqual(2, len(titles))
+        self.assertEqual(['A', 'R'], BrowseTitle.letters())
+        self.assertEqual(['abbey244', 'raoul548'],
+                         list(BrowseTitle.objects.values_list('eadid', flat=True)))
+        # partial documents from eXist produce the same values as full documents
+        title = BrowseTitle.objects.get(eadid='abbey244')
+        expected = BrowseTitle.from_findingaid(ead)
+        for field in ['list_title', 'sort_key', 'unittitle', 'abstract', 'physdesc']:
+            self.assertEqual(getattr(expected, field), getattr(title, field))
+
+        BrowseTitle.remove('raoul548')
+        self.assertEqual(['A'], BrowseTitle.letters())
+
+
+class CollectionWatermarkTestCase(DjangoTestCase):
+
+    def test_bump(self):
+        # first bump with no stored watermark
+        watermark = CollectionWatermark.bump()
+        self.assertEqual(1, watermark.version)
+        self.assertNotEqual(None, watermark.modified)
+        watermark = CollectionWatermark.bump()
+        self.assertEqual(2, watermark.version)
+        self.assertEqual(watermark, CollectionWatermark.current())
+
+    def test_cache_key(self):
+        watermark = CollectionWatermark.bump()
+        key = watermark.cache_key('browse-title-letters')
+        self.assertEqual('browse-title-letters:%d' % watermark.version, key)
+        self.assertNotEqual(key, CollectionWatermark.bump().cache_key('browse-title-letters'),
+            'cache key should change when the collection watermark is bumped')
+
@@ -0,0 +1,136 @@
+# file findingaids/fa/tests/pagecache.py
+#
+#   Copyright 2012 Emory University Library
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+from django.test import TestCase as DjangoTestCase
+from django.test.client import RequestFactory
+from django.test.utils import override_settings
+
+from findingaids.fa import pagecache
+from findingaids.fa.pagecache import LRUCache, DjangoCache
+
+
+class LRUCacheTest(DjangoTestCase):
+
+    def test_get_set(self):
+        lru = LRUCache(max_size=100)
+        self.assertEqual(None, lru.get('a'))
+        lru.set('a', 'x' * 10, 'ead1')
+        self.assertEqual('x' * 10, lru.get('a'))
+        self.assertEqual(10, lru.stats()['size'])
+        # replacing a value updates size
+        lru.set('a', 'y' * 20, 'ead1')
+        self.assertEqual('y' * 20, lru.get('a'))
+        self.assertEqual(20, lru.stats()['size'])
+        self.assertEqual(1, lru.stats()['entries'])
+
+        # content larger than the cache is not cached
+        lru.set('b', 'z' * 101, 'ead1')
+        self.assertEqual(None, lru.get('b'))
+
+    def test_eviction(self):
+        lru = LRUCache(max_size=30)
+        lru.set('a', 'a' * 10, 'ead1')
+        lru.set('b', 'b' * 10, 'ead2')
+        lru.set('c', 'c' * 10, 'ead3')
+        # access a so b is least recently used
+        lru.get('a')
+        lru.set('d', 'd' * 10, 'ead4')
+        self.assertEqual(None, lru.get('b'), 'least recently used page should be evicted')
+        self.assertEqual('a' * 10, lru.get('a'))
+        self.assertEqual('c' * 10, lru.get('c'))
+        self.assertEqual('d' * 10, lru.get('d'))
+        self.assertEqual(30, lru.stats()['size'])
+        self.assertEqual(1, lru.stats()['evictions'])
+
+    def test_delete_group(self):
+        lru = LRUCache(max_size=100)
+        lru.set('a1', 'a', 'ead1')
+        lru.set('a2', 'aa', 'ead1')
+        lru.set('b1', 'b', 'ead2')
+        lru.delete_group('ead1')
+        self.assertEqual(None, lru.get('a1'))
+        self.assertEqual(None, lru.get('a2'))
+        self.assertEqual('b', lru.get('b1'))
+        self.assertEqual(1, lru.stats()['size'])
+        # deleting a group with nothing cached is not an error
+        lru.delete_group('ead3')
+
+
+class DjangoCacheTest(DjangoTestCase):
+
+    def test_get_set_delete_group(self):
+        djcache = DjangoCache()
+        djcache.set('a1', 'content', 'ead1')
+        djcache.set('b1', 'other content', 'ead2')
+        self.assertEqual('content', djcache.get('a1', 'ead1'))
+        djcache.delete_group('ead1')
+        self.assertEqual(None, djcache.get('a1', 'ead1'))
+        self.assertEqual('other content', djcache.get('b1', 'ead2'))
+        # new content after invalidation is available
+        djcache.set('a1', 'new content', 'ead1')
+        self.assertEqual('new content', djcache.get('a1', 'ead1'))
+        djcache.delete_group('ead1')
+        self.assertEqual(None, djcache.get('a1', 'ead1'))
+
+
+class PageCacheTest(DjangoTestCase):
+
+    def setUp(self):
+        pagecache.reset()
+
+    def tearDown(self):
+        pagecache.reset()
+
+    def test_page_key(self):
+        rqst = RequestFactory().get('/documents/abbey244/')
+        key = pagecache.page_key(rqst, 'abbey244', 'abc123')
+        self.assert_('abbey244' in key)
+        self.assert_('abc123' in key)
+        self.assertNotEqual(key, pagecache.page_key(rqst, 'abbey244', 'def456'),
+                            'different document versions should have different keys')
+        self.assertNotEqual(key, pagecache.page_key(rqst, 'abbey244', 'abc123', preview=True),
+                            'preview and public pages should have different keys')
+        highlight = RequestFactory().get('/documents/abbey244/',
+                                         {'keywords': u'belfast group'})
+        highlight_key = pagecache.page_key(highlight, 'abbey244', 'abc123')
+        self.assertNotEqual(key, highlight_key,
+                            'highlighted pages should have different keys')
+        # all url parameters are included, regardless of order
+        paged = RequestFactory().get('/documents/abbey244/?keywords=belfast+group&page=2')
+        self.assertNotEqual(highlight_key, pagecache.page_key(paged, 'abbey244', 'abc123'),
+                            'requests with other parameters should have different keys')
+        reordered = RequestFactory().get('/documents/abbey244/?page=2&keywords=belfast+group')
+        self.assertEqual(pagecache.page_key(paged, 'abbey244', 'abc123'),
+                         pagecache.page_key(reordered, 'abbey244', 'abc123'))
+
+    def test_get_set_page(self):
+        self.assertEqual(None, pagecache.get_page('key', 'abbey244'))
+        pagecache.set_page('key', 'abbey244', 'content')
+        self.assertEqual('content', pagecache.get_page('key', 'abbey244'))
+        stats = pagecache.stats()
+        self.assertEqual(1, stats['hits'])
+        self.assertEqual(1, stats['misses'])
+        self.assertEqual(1, stats['entries'])
+        pagecache.invalidate('abbey244')
+        self.assertEqual(None, pagecache.get_page('key', 'abbey244'))
+
+    @override_settings(FINDINGAID_PAGE_CACHE={
+        'BACKEND': 'findingaids.fa.pagecache.DjangoCache', 'OPTIONS': {'timeout': 60}})
+    def test_configured_backend(self):
+        pagecache.reset()
+        backend = pagecache.get_backend()
+        self.assert_(isinstance(backend, DjangoCache))
+        self.assertEqual(60, backend.timeout)
@@ -0,0 +1,107 @@
+# file findingaids/fa/tests/pdfqueue.py
+#
+#   Copyright 2012 Emory University Library
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import threading
+import time
+
+from django.test import TestCase as DjangoTestCase
+
+from findingaids.fa.pdfqueue import RenderQueue, QueueFull
+
+
+class RenderQueueTest(DjangoTestCase):
+
+    def run_threads(self, queue, renders):
+        # run a list of (key, func) renders in separate threads; returns a
+        # list of results or exceptions, in the same order
+        results = [None] * len(renders)
+
+        def run(i, key, func):
+            try:
+                results[i] = queue.render(key, func)
+            except Exception, e:
+                results[i] = e
+
+        threads = []
+        for i, (key, func) in enumerate(renders):
+            thread = threading.Thread(target=run, args=(i, key, func))
+            thread.start()
+            threads.append(thread)
+            # start renders in order
+            time.sleep(0.05)
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_render(self):
+        queue = RenderQueue()
+        self.assertEqual('pdf', queue.render('ead1', lambda: 'pdf'))
+        self.assertEqual({'running': 0, 'queued': 0}, queue.stats())
+        # errors are raised to the caller
+        self.assertRaises(ZeroDivisionError, queue.render, 'ead1', lambda: 1 / 0)
+        self.assertEqual({'running': 0, 'queued': 0}, queue.stats())
+
+    def test_single_flight(self):
+        queue = RenderQueue(max_renders=2)
+        calls = []
+
+        def slow_render():
+            calls.append(1)
+            time.sleep(0.3)
+            return 'pdf %d' % len(calls)
+
+        # concurrent renders of the same key share a single render
+        results = self.run_threads(queue, [('ead1', slow_render)] * 3)
+        self.assertEqual(['pdf 1'] * 3, results)
+        self.assertEqual(1, len(calls))
+
+        # errors are shared too
+        def failed_render():
+            calls.append(1)
+            time.sleep(0.3)
+            raise Exception('fop failed')
+
+        results = self.run_threads(queue, [('ead1', failed_render)] * 2)
+        self.assertEqual(['fop failed'] * 2, [str(r) for r in results])
+        self.assertEqual(2, len(calls))
+
+    def test_bounded(self):
+        queue = RenderQueue(max_renders=1, max_queue=1, timeout=5)
+        running = []
+
+        def slow_render(label):
+            def render():
+                running.append(label)
+                self.assert_(len(running) <= 1,
+                             'only one render should run at a time')
+                time.sleep(0.3)
+                running.remove(label)
+                return label
+            return render
+
+        # one render running, one queued, third is refused
+        results = self.run_threads(queue, [('ead%d' % i, slow_render(i))
+                                           for i in range(3)])
+        self.assertEqual([0, 1], results[:2])
+        self.assert_(isinstance(results[2], QueueFull))
+
+        # renders that cannot start within the timeout are refused
+        queue = RenderQueue(max_renders=1, max_queue=1, timeout=0.1)
+        results = self.run_threads(queue, [('ead%d' % i, slow_render(i))
+                                           for i in range(2)])
+        self.assertEqual(0, results[0])
+        self.assert_(isinstance(results[1], QueueFull))
+        self.assertEqual({'running': 0, 'queued': 0}, queue.stats())
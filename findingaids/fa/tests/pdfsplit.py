@@ -0,0 +1,184 @@
+# file findingaids/fa/tests/pdfsplit.py
+#
+#   Copyright 2012 Emory University Library
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import os
+
+from django.test import TestCase as DjangoTestCase
+from django.test.utils import override_settings
+from lxml import etree
+
+from eulxml.xmlmap import load_xmlobject_from_file
+
+from findingaids.fa import pdfsplit
+from findingaids.fa.models import FindingAid
+from findingaids.fa.pdfsplit import split_xhtml, merge_intermediate, \
+    PAGE_NUMBER_MARKER, LINK_PREFIX, IF_NAMESPACE, NAV_NAMESPACE
+
+exist_fixture_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+# minimal version of the structure generated by fa/full.html
+FULL_XHTML = '''<html>
+<body>
+<div id="header">title</div>
+<div class="fa">
+  <h1><a name="ead1">Papers</a></h1>
+  <div class="nextpage"><h2><a name="dsc">Series list</a></h2>
+    <ul><li><a href="#s1">Series 1</a></li><li><a href="#s2.1">Subseries 2.1</a></li></ul>
+  </div>
+  <div class="series-part">
+    <div class="nextpage"><h2 class="series"><a name="s1">Series 1</a></h2></div>
+  </div>
+  <div class="series-part">
+    <div class="nextpage"><h2 class="series"><a name="s2">Series 2</a></h2></div>
+    <div class="nextpage"><h3><a name="s2.1">Subseries 2.1</a></h3></div>
+  </div>
+  <hr/>
+  <div class="nextpage"><h2><a name="index1">Index</a></h2>
+    <p><a href="#s1">Series 1</a>, <a href="#s2">Series 2</a></p>
+  </div>
+</div>
+<div id="footer">footer</div>
+</body>
+</html>'''
+
+
+def if_document(pages, targets=[]):
+    # minimal FOP intermediate format document with the specified footer
+    # page numbers and links to the specified page indexes
+    nsmap = {None: IF_NAMESPACE, 'nav': NAV_NAMESPACE}
+    doc = etree.Element('{%s}document' % IF_NAMESPACE, nsmap=nsmap)
+    etree.SubElement(doc, '{%s}header' % IF_NAMESPACE)
+    sequence = etree.SubElement(doc, '{%s}page-sequence' % IF_NAMESPACE)
+    for i, number in enumerate(pages):
+        page = etree.SubElement(sequence, '{%s}page' % IF_NAMESPACE,
+                                index=str(i), name=str(number))
+        content = etree.SubElement(page, '{%s}content' % IF_NAMESPACE)
+        etree.SubElement(content, '{%s}font' % IF_NAMESPACE, size='10000')
+        text = etree.SubElement(content, '{%s}text' % IF_NAMESPACE,
+                                x='300000', y='770000', dx='0 10')
+        text.text = str(number)
+    trailer = etree.SubElement(doc, '{%s}trailer' % IF_NAMESPACE)
+    tree = etree.SubElement(trailer, '{%s}bookmark-tree' % NAV_NAMESPACE)
+    etree.SubElement(tree, '{%s}bookmark' % NAV_NAMESPACE, title='part')
+    for i in targets:
+        # link on the first page, with the action defined in the trailer
+        link = etree.SubElement(doc.find('.//{%s}page' % IF_NAMESPACE),
+                                '{%s}link' % NAV_NAMESPACE, rect='0 0 10 10')
+        etree.SubElement(link, '{%s}goto-xy' % NAV_NAMESPACE, idref='link%d' % i)
+        action = etree.SubElement(trailer, '{%s}goto-xy' % NAV_NAMESPACE,
+                                  id='link%d' % i, x='0', y='0')
+        action.set('page-index', str(i))
+    return etree.ElementTree(doc)
+
+
+class PdfSplitTest(DjangoTestCase):
+
+    def test_should_split(self):
+        ead = load_xmlobject_from_file(os.path.join(exist_fixture_path, 'raoul548.xml'),
+                                       FindingAid)
+        self.assert_(pdfsplit.component_count(ead) > 100)
+        with override_settings(FINDINGAID_PDF_SPLIT={'MIN_COMPONENTS': 100}):
+            self.assertTrue(pdfsplit.should_split(ead))
+        with override_settings(FINDINGAID_PDF_SPLIT={'MIN_COMPONENTS': 100000}):
+            self.assertFalse(pdfsplit.should_split(ead))
+        with override_settings(FINDINGAID_PDF_SPLIT={'MIN_COMPONENTS': None}):
+            self.assertFalse(pdfsplit.should_split(ead))
+
+    def test_split_xhtml(self):
+        parts = split_xhtml(etree.fromstring(FULL_XHTML))
+        self.assertEqual(3, len(parts))
+        # anchors linked from other parts are named destinations
+        self.assertEqual([{'part': 'front'},
+                          {'part': 'series', 'initial_page_number': PAGE_NUMBER_MARKER,
+                           'destinations': 's1'},
+                          {'part': 'series', 'initial_page_number': PAGE_NUMBER_MARKER,
+                           'destinations': 's2.1'}],
+                         [params for part, params in parts])
+
+        anchors = [part.xpath('//div[@class="fa"]//a/@name') for part, params in parts]
+        self.assertEqual(['ead1', 'dsc'], anchors[0])
+        self.assertEqual(['s1'], anchors[1])
+        # content after the last series is included in the last part
+        self.assertEqual(['s2', 's2.1', 'index1'], anchors[2])
+
+        for part, params in parts:
+            # header and footer in every part
+            self.assertEqual(['header', 'footer'], part.xpath('//div/@id'))
+        # no page break before the first series page of a part
+        self.assertEqual(None, parts[1][0].xpath('//h2[@class="series"]/..')[0].get('class'))
+        self.assertEqual(None, parts[2][0].xpath('//h2[@class="series"]/..')[0].get('class'))
+        self.assertEqual('nextpage', parts[2][0].xpath('//h3/..')[0].get('class'))
+
+        # documents without series are not split
+        xhtml = etree.fromstring('<html><body><div class="fa"><h1>Papers</h1></div></body></html>')
+        self.assertEqual([(xhtml, {})], split_xhtml(xhtml))
+
+    def test_merge_intermediate(self):
+        front = if_document([1, 2], targets=[1])
+        series1 = if_document([PAGE_NUMBER_MARKER, PAGE_NUMBER_MARKER + 1], targets=[1])
+        series2 = if_document([PAGE_NUMBER_MARKER], targets=[0])
+        # link from the front matter to a named destination in series 2
+        link = etree.SubElement(front.getroot().find('.//{%s}page' % IF_NAMESPACE),
+                                '{%s}link' % NAV_NAMESPACE, rect='0 0 10 10')
+        etree.SubElement(link, '{%s}goto-uri' % NAV_NAMESPACE, id='uri1',
+                         uri='%ss2.1' % LINK_PREFIX)
+        destination = etree.SubElement(series2.getroot().find('{%s}trailer' % IF_NAMESPACE),
+                                       '{%s}named-destination' % NAV_NAMESPACE, name='s2.1')
+        etree.SubElement(destination, '{%s}goto-xy' % NAV_NAMESPACE, id='dest1',
+                         x='5000', y='20000').set('page-index', '0')
+        merged = merge_intermediate([front, series1, series2],
+                                    ['Papers', 'Series 1', 'Series 2'])
+        ns = {'if': IF_NAMESPACE, 'nav': NAV_NAMESPACE}
+
+        pages = merged.xpath('//if:page', namespaces=ns)
+        self.assertEqual(['0', '1', '2', '3', '4'], [p.get('index') for p in pages])
+        self.assertEqual(['1', '2', '3', '4', '5'], [p.get('name') for p in pages])
+        self.assertEqual(3, len(merged.xpath('if:page-sequence', namespaces=ns)))
+        # footer page numbers replaced
+        texts = merged.xpath('//if:page//if:text', namespaces=ns)
+        self.assertEqual(['1', '2', '3', '4', '5'], [t.text for t in texts])
+        # replaced numbers are re-centered for the difference in width
+        self.assertEqual('315000', texts[2].get('x'))
+        self.assertEqual(None, texts[2].get('dx'))
+        self.assertEqual('0 10', texts[0].get('dx'))
+
+        # links adjusted for page positions in the merged document
+        self.assertEqual(['1', '3', '4'],
+                         merged.xpath('//if:trailer/nav:goto-xy/@page-index', namespaces=ns))
+        # action ids from each part are unique, and links still refer to them
+        ids = merged.xpath('//nav:*/@id', namespaces=ns)
+        self.assertEqual(len(ids), len(set(ids)))
+        self.assertEqual(['p0-link1', 'p1-link1', 'p2-link0'],
+                         merged.xpath('//if:trailer/nav:goto-xy/@id', namespaces=ns))
+        self.assertEqual(['p0-link1', 'p1-link1', 'p2-link0'],
+                         merged.xpath('//if:page/nav:link/nav:goto-xy/@idref', namespaces=ns))
+
+        # links to other parts resolved to the named destination
+        self.assertEqual([], merged.xpath('//nav:goto-uri', namespaces=ns))
+        action = merged.xpath('//nav:goto-xy[@id="p0-uri1"]', namespaces=ns)[0]
+        self.assertEqual(['4', '5000', '20000'],
+                         [action.get('page-index'), action.get('x'), action.get('y')])
+
+        # bookmarks for the document and each series
+        self.assertEqual(1, len(merged.xpath('//nav:bookmark-tree', namespaces=ns)))
+        bookmark = merged.xpath('//nav:bookmark-tree/nav:bookmark', namespaces=ns)
+        self.assertEqual(1, len(bookmark))
+        self.assertEqual('Papers', bookmark[0].get('title'))
+        self.assertEqual('0', bookmark[0].xpath('nav:goto-xy/@page-index', namespaces=ns)[0])
+        series = bookmark[0].xpath('nav:bookmark', namespaces=ns)
+        self.assertEqual(['Series 1', 'Series 2'], [b.get('title') for b in series])
+        self.assertEqual(['2', '4'], [b.xpath('nav:goto-xy/@page-index', namespaces=ns)[0]
+                                      for b in series])
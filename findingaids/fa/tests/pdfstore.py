@@ -0,0 +1,111 @@
+# file findingaids/fa/tests/pdfstore.py
+#
+#   Copyright 2012 Emory University Library
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import os
+import shutil
+import tempfile
+
+from django.test import TestCase as DjangoTestCase
+from django.test.utils import override_settings
+
+from findingaids.fa import pdfstore
+
+
+class PdfStoreTest(DjangoTestCase):
+
+    def setUp(self):
+        self.store_dir = tempfile.mkdtemp(prefix='findingaids-pdfstore-test-')
+        self.override = override_settings(FINDINGAID_PDF_STORE={
+            'DIR': self.store_dir, 'MAX_SIZE': 1000})
+        self.override.enable()
+
+    def tearDown(self):
+        self.override.disable()
+        shutil.rmtree(self.store_dir)
+
+    def test_disabled(self):
+        with override_settings(FINDINGAID_PDF_STORE={'DIR': None}):
+            self.assertFalse(pdfstore.enabled())
+            self.assertEqual(None, pdfstore.store('ead1', 'hash1', 'pdf'))
+            self.assertEqual(None, pdfstore.get('ead1', 'hash1'))
+
+    def test_store_get(self):
+        self.assert_(pdfstore.enabled())
+        self.assertEqual(None, pdfstore.get('ead1', 'hash1'))
+        path = pdfstore.store('ead1', 'hash1', 'x' * 10)
+        self.assertEqual(os.path.join(self.store_dir, 'ead1', 'hash1.pdf'), path)
+        self.assertEqual(path, pdfstore.get('ead1', 'hash1'))
+        with open(path) as pdf:
+            self.assertEqual('x' * 10, pdf.read())
+        # different version of the document is not stored
+        self.assertEqual(None, pdfstore.get('ead1', 'hash2'))
+
+        # storing a new version removes the old version
+        pdfstore.store('ead1', 'hash2', 'y' * 10)
+        self.assertEqual(None, pdfstore.get('ead1', 'hash1'))
+        self.assertNotEqual(None, pdfstore.get('ead1', 'hash2'))
+        self.assertEqual(['hash2.pdf'], os.listdir(os.path.join(self.store_dir, 'ead1')))
+
+        pdfstore.store('ead2', 'hash3', 'z' * 10)
+        pdfstore.remove('ead1')
+        self.assertEqual(None, pdfstore.get('ead1', 'hash2'))
+        self.assertFalse(os.path.exists(os.path.join(self.store_dir, 'ead1')))
+        self.assertNotEqual(None, pdfstore.get('ead2', 'hash3'))
+
+    def test_collect_garbage(self):
+        for i in range(3):
+            path = pdfstore.store('ead%d' % i, 'hash', 'x' * 40)
+            # set modification times explicitly, oldest first
+            os.utime(path, (1000 + i, 1000 + i))
+        # over the size budget; least recently served pdf is removed
+        self.assertEqual((1, 40), pdfstore.collect_garbage(max_size=100))
+        self.assertEqual(None, pdfstore.get('ead0', 'hash'))
+        self.assertFalse(os.path.exists(os.path.join(self.store_dir, 'ead0')))
+        self.assertEqual(2, len(pdfstore.stored_files()))
+        self.assertEqual((0, 0), pdfstore.collect_garbage(max_size=100))
+
+        # serving a pdf marks it as recently used; storing a pdf
+        # enforces the configured size budget
+        pdfstore.get('ead1', 'hash')
+        with override_settings(FINDINGAID_PDF_STORE={'DIR': self.store_dir,
+                                                     'MAX_SIZE': 100}):
+            pdfstore.store('ead3', 'hash', 'x' * 40)
+        self.assertEqual(None, pdfstore.get('ead2', 'hash'))
+        self.assertNotEqual(None, pdfstore.get('ead1', 'hash'))
+        self.assertNotEqual(None, pdfstore.get('ead3', 'hash'))
+
+        # temporary files are ignored
+        open(os.path.join(self.store_dir, 'ead1', '.tmp-partial.pdf'), 'w').close()
+        self.assertEqual(2, len(pdfstore.stored_files()))
+
+    def test_serve(self):
+        path = pdfstore.store('ead1', 'hash1', 'x' * 10)
+        response = pdfstore.serve(path, filename='ead1.pdf')
+        self.assertEqual('application/pdf', response['Content-Type'])
+        self.assertEqual('inline; filename=ead1.pdf', response['Content-Disposition'])
+        self.assertEqual('10', response['Content-Length'])
+        self.assertEqual('x' * 10, ''.join(response.streaming_content))
+
+        with override_settings(FINDINGAID_PDF_STORE={'DIR': self.store_dir,
+                                                     'SENDFILE': 'X-Sendfile'}):
+            response = pdfstore.serve(path)
+            self.assertEqual(path, response['X-Sendfile'])
+            self.assertEqual('', response.content)
+
+        with override_settings(FINDINGAID_PDF_STORE={'DIR': self.store_dir,
+                'SENDFILE': 'X-Accel-Redirect', 'SENDFILE_URL': '/pdf-store/'}):
+            response = pdfstore.serve(path)
+            self.assertEqual('/pdf-store/ead1/hash1.pdf', response['X-Accel-Redirect'])
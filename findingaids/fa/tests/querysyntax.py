@@ -0,0 +1,100 @@
+# file findingaids/fa/tests/querysyntax.py
+#
+#   Copyright 2012 Emory University Library
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+from django.test import TestCase as DjangoTestCase
+
+from findingaids.fa.forms import KeywordSearchForm
+from findingaids.fa.management.commands.response_times import \
+    Command as ResponseTimesCommand
+from findingaids.fa.querysyntax import parse_query, QuerySyntaxError
+
+
+class ParseQueryTest(DjangoTestCase):
+
+    # valid queries used in site tests and response time checks,
+    # with expected canonical form
+    valid_queries = [(q, q) for q in ResponseTimesCommand.test_searches] + [
+        ('raoul', 'raoul'),
+        ('family papers', 'family papers'),
+        (' family ', 'family'),
+        ('"Abbey Theatre organized in 1904"', '"Abbey Theatre organized in 1904"'),
+        ('Abb?y Theat*', 'Abb?y Theat*'),
+        ('Abbey or raoul', 'Abbey OR raoul'),
+        ('Emory not Theatre', 'Emory NOT Theatre'),
+        ('Bailey and Theatre', 'Bailey AND Theatre'),
+        ('(Emory or scripts) not (files and school)',
+         '(Emory OR scripts) NOT (files AND school)'),
+        ('"hickory hill"', '"hickory hill"'),
+        ('Scripts.', 'Scripts.'),
+        ('"University Archives"', '"University Archives"'),
+        # other lucene syntax
+        ('anderson ORwell', 'anderson ORwell'),
+        ('a-b c+d', 'a-b c+d'),
+        ('! a && b || c', 'NOT a AND b OR c'),
+        ('- a  +  b', '-a +b'),
+        ('title : ( a  b )^2', 'title:(a b)^2'),
+        ('roam~0.8 "x   y"~3 term^1.5', 'roam~0.8 "x y"~3 term^1.5'),
+        ('[a  TO b] {c TO d}', '[a TO b] {c TO d}'),
+        (r'\(a\) \"b', r'\(a\) \"b'),
+    ]
+
+    invalid_queries = [
+        '"georgia', 'Abbey"', '"incomplete phrase',  # unterminated phrase
+        'AND Abbey', 'Abbey AND', 'Abbey NOT', 'a OR OR b', 'NOT',  # operators
+        '(Abbey', 'Abbey)', '()', '(a))(',  # grouping
+        'a^', 'a^ 2', '~a', '(a)~2',  # boost & fuzzy
+        'a:', 'a: -b', ':a',  # fields
+        '[a TO b', 'a ]',  # ranges
+        'a\\',  # escape
+    ]
+
+    def test_valid(self):
+        for query, expected in self.valid_queries:
+            self.assertEqual(expected, parse_query(query),
+                'expected %r to be parsed as %r' % (query, expected))
+            # canonical form is unchanged by parsing again
+            self.assertEqual(expected, parse_query(expected))
+
+    def test_invalid(self):
+        for query in self.invalid_queries:
+            self.assertRaises(QuerySyntaxError, parse_query, query)
+
+    def test_blank(self):
+        self.assertEqual('', parse_query(''))
+        self.assertEqual('', parse_query('  '))
+
+    def test_fold_case(self):
+        self.assertEqual('abbey OR raoul', parse_query('Abbey or Raoul', fold_case=True))
+        self.assertEqual('"new york times" AND journalis*',
+                         parse_query('"New York  Times" and Journalis*', fold_case=True))
+        # field names are not case-folded
+        self.assertEqual('Title:abbey', parse_query('Title:ABBEY', fold_case=True))
+
+    def test_search_form(self):
+        form = KeywordSearchForm({'keywords': ' (Emory or scripts)  not files'})
+        self.assertTrue(form.is_valid())
+        self.assertEqual('(Emory OR scripts) NOT files', form.cleaned_data['keywords'])
+        self.assertFalse(form.has_query_error())
+
+        form = KeywordSearchForm({'keywords': '(Emory or scripts'})
+        self.assertFalse(form.is_valid())
+        self.assertTrue(form.has_query_error())
+        # no generic missing search terms error
+        self.assertFalse(form.non_field_errors())
+
+        form = KeywordSearchForm({'keywords': ''})
+        self.assertFalse(form.is_valid())
+        self.assertFalse(form.has_query_error())
@@ -0,0 +1,98 @@
+# file findingaids/fa/tests/searchcache.py
+#
+#   Copyright 2012 Emory University Library
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+from os import path
+from mock import patch
+
+from django.core.paginator import Paginator
+from django.test.utils import override_settings
+
+from eulexistdb.testutil import TestCase
+
+from findingaids.fa import searchcache
+from findingaids.fa.models import FindingAid, CollectionWatermark
+from findingaids.fa.searchcache import ResultSet
+
+exist_fixture_path = path.join(path.dirname(path.abspath(__file__)), 'fixtures')
+
+
+class SearchCacheTest(TestCase):
+    exist_fixtures = {'files': [path.join(exist_fixture_path, 'raoul548.xml'),
+                                path.join(exist_fixture_path, 'abbey244.xml')]}
+
+    def setUp(self):
+        searchcache.reset()
+
+    def tearDown(self):
+        searchcache.reset()
+
+    def test_result_set(self):
+        results = ResultSet.from_queryset(FindingAid.objects.order_by('eadid'))
+        self.assertEqual(2, len(results))
+        self.assertEqual([('abbey244', None), ('raoul548', None)], results.hits)
+        self.assertEqual(['abbey244', 'raoul548'], results.eadids)
+        # facet counts
+        self.assertEqual([('Manuscript, Archives, and Rare Book Library', 2)],
+                         results.repository_counts)
+        # abbey244 only has an internal dao
+        self.assertEqual(0, results.dao_count)
+
+        # can be paginated
+        paginator = Paginator(results, per_page=1)
+        self.assertEqual(2, paginator.count)
+        self.assertEqual([('raoul548', None)], list(paginator.page(2).object_list))
+
+        # dao counts are taken from the local catalog when available
+        with patch('findingaids.fa.searchcache.CatalogEntry.dao_eadids',
+                   return_value=set(['raoul548'])):
+            results = ResultSet.from_queryset(FindingAid.objects.order_by('eadid'))
+            self.assertEqual(1, results.dao_count)
+
+    def test_search_key(self):
+        key = searchcache.search_key(keywords='raoul  family', subject='', dao=False)
+        # normalized: whitespace, empty values, and parameter order are ignored
+        self.assertEqual(key, searchcache.search_key(dao=False, keywords=' raoul family'))
+        self.assertNotEqual(key, searchcache.search_key(keywords='raoul'))
+        self.assertNotEqual(searchcache.search_key(keywords='raoul', dao=True),
+                            searchcache.search_key(keywords='raoul', dao=True,
+                                                   internal_dao=True))
+        # key changes when the collection changes
+        CollectionWatermark.bump()
+        self.assertNotEqual(key, searchcache.search_key(keywords='raoul family'))
+
+    def test_get_results(self):
+        qs = FindingAid.objects.order_by('eadid')
+        with patch('findingaids.fa.searchcache.ResultSet.from_queryset',
+                   wraps=ResultSet.from_queryset) as mockresults:
+            results = searchcache.get_results('key1', qs)
+            self.assertEqual(2, len(results))
+            self.assertEqual(results, searchcache.get_results('key1', qs))
+            mockresults.assert_called_once_with(qs, score=False)
+
+            # empty results are not cached
+            empty_qs = FindingAid.objects.filter(eadid='bogus')
+            searchcache.get_results('key2', empty_qs)
+            searchcache.get_results('key2', empty_qs)
+            self.assertEqual(3, mockresults.call_count)
+
+    @override_settings(FINDINGAID_SEARCH_CACHE_SIZE=3)
+    def test_cache_size(self):
+        qs = FindingAid.objects.order_by('eadid')
+        searchcache.get_results('key1', qs)
+        searchcache.get_results('key2', qs)
+        # total hits over the configured size; least recently used is evicted
+        self.assertEqual(None, searchcache.get_cache().get('key1'))
+        self.assertNotEqual(None, searchcache.get_cache().get('key2'))
@@ -14,33 +14,47 @@
 #   See the License for the specific language governing permissions and
 #   limitations under the License.
 
-from datetime import datetime
+import base64
+from datetime import datetime, timedelta
+from dateutil import tz
+from gzip import GzipFile
 from os import path
 import re
+from StringIO import StringIO
 from time import sleep
 from lxml import etree
 from mock import patch
 import rdflib
 
 from django.conf import settings
-from django.core.paginator import Paginator
+from django.core.cache import cache
+from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
 from django.core.urlresolvers import reverse
 from django.http import Http404, HttpRequest
 from django.template import RequestContext, Template, Context, loader
 from django.test import TestCase as DjangoTestCase
+from django.test.utils import override_settings
+from django.utils.html import conditional_escape
 
 from eulexistdb.db import ExistDB
 from eulexistdb.testutil import TestCase
-from eulxml.xmlmap import XmlObject, load_xmlobject_from_string
+from eulxml.xmlmap import XmlObject, load_xmlobject_from_string, \
+    load_xmlobject_from_file
 from eulxml.xmlmap.eadmap import EAD_NAMESPACE
 
 from findingaids.fa.models import FindingAid, Deleted, Series, \
-    title_rdf_identifier
-from findingaids.fa.forms import boolean_to_upper, AdvancedSearchForm
-from findingaids.fa.templatetags.ead import format_ead, XLINK_NAMESPACE
+    CatalogEntry, CollectionWatermark, title_rdf_identifier
+from findingaids.fa.forms import AdvancedSearchForm
+from findingaids.fa.templatetags.ead import format_ead, format_ead_node, \
+    XLINK_NAMESPACE
+from findingaids.fa.management.commands.format_ead_times import \
+    recursive_format_ead_node
 from findingaids.fa.templatetags.ark_pid import ark_pid
 from findingaids.fa.utils import pages_to_show, ead_lastmodified, ead_etag, \
-    collection_lastmodified, exist_datetime_with_timezone, alpha_pagelabels
+    ead_validators, get_findingaid, collection_lastmodified, collection_etag, exist_datetime_with_timezone, alpha_pagelabels, \
+    exist_document_path, open_exist_document, read_chunks, gzip_chunks, \
+    accepts_gzip, field_values, cached_alpha_pagelabels, ExistPaginator, \
+    paginate_queryset
 
 
 ## unit tests for utility methods, custom template tags, etc
@@ -98,6 +112,36 @@ class UtilsTest(TestCase):
         self.assertEqual('Anna - Anne', labels[4])
         self.assertEqual('Az', labels[5])
 
+        # labels for all items specified in bulk - objects not accessed
+        self.assertEqual(labels, alpha_pagelabels(paginator, None, label_attribute='title',
+                                                  all_labels=titles))
+
+    def test_field_values(self):
+        qs = FindingAid.objects.order_by('list_title')
+        self.assertEqual(['abbey244'], field_values(qs, 'eadid', 10))
+
+    def test_cached_alpha_pagelabels(self):
+        cache.clear()
+        titles = ['Abigail', 'Abner', 'Adam', 'Allen', 'Amy']
+        paginator = Paginator(titles, per_page=2)
+        with patch('findingaids.fa.utils.field_values') as mockvalues:
+            mockvalues.return_value = titles
+            labels = cached_alpha_pagelabels(paginator, 'qs', 'title', 'browse:A')
+            mockvalues.assert_called_once_with('qs', 'title', 5)
+            self.assertEqual('Abi - Abn', labels[1])
+            # cached - not retrieved again
+            self.assertEqual(labels, cached_alpha_pagelabels(paginator, 'qs', 'title', 'browse:A'))
+            self.assertEqual(1, mockvalues.call_count)
+            # different key or pagination - not cached
+            cached_alpha_pagelabels(paginator, 'qs', 'title', 'browse:B')
+            self.assertEqual(2, mockvalues.call_count)
+            cached_alpha_pagelabels(Paginator(titles, per_page=3), 'qs', 'title', 'browse:A')
+            self.assertEqual(3, mockvalues.call_count)
+            # collection change - retrieved again
+            CollectionWatermark.bump()
+            cached_alpha_pagelabels(paginator, 'qs', 'title', 'browse:A')
+            self.assertEqual(4, mockvalues.call_count)
+
     def test_ead_lastmodified(self):
         modified = ead_lastmodified('rqst', 'abbey244')
         self.assert_(isinstance(modified, datetime),
@@ -129,6 +173,40 @@ class UtilsTest(TestCase):
         # invalid eadid
         self.assertRaises(Http404, ead_etag, 'rqst', 'bogusid')
 
+    def test_ead_validators(self):
+        rqst = HttpRequest()
+        with patch('findingaids.fa.utils.get_findingaid', wraps=get_findingaid) as mockget:
+            checksum, modified = ead_validators(rqst, 'abbey244')
+            self.assert_(re.match('[0-9a-f]{40}$', checksum))
+            self.assert_(isinstance(modified, datetime))
+            mockget.assert_called_once_with('abbey244', preview=False,
+                                            only=['hash', 'last_modified'])
+            # etag and last-modified for the same request should not query again
+            self.assertEqual(checksum, ead_etag(rqst, 'abbey244'))
+            self.assertEqual(modified, ead_lastmodified(rqst, 'abbey244'))
+            self.assertEqual(1, mockget.call_count)
+
+            # different request queries again
+            ead_etag(HttpRequest(), 'abbey244')
+            self.assertEqual(2, mockget.call_count)
+
+        # invalid eadid
+        self.assertRaises(Http404, ead_validators, HttpRequest(), 'bogusid')
+
+        # cataloged document, but catalog not reconciled - eXist is queried
+        entry = CatalogEntry.update('abbey244')[0]
+        with patch('findingaids.fa.utils.get_findingaid', wraps=get_findingaid) as mockget:
+            ead_validators(HttpRequest(), 'abbey244')
+            self.assertEqual(1, mockget.call_count)
+
+        # cataloged document - no eXist query
+        CatalogEntry.mark_reconciled()
+        with patch('findingaids.fa.utils.get_findingaid') as mockget:
+            checksum, modified = ead_validators(HttpRequest(), 'abbey244')
+            self.assertEqual(0, mockget.call_count)
+            self.assertEqual(entry.hash, checksum)
+            self.assertEqual(exist_datetime_with_timezone(entry.last_modified), modified)
+
     def test_collection_lastmodified(self):
         modified = collection_lastmodified('rqst')
         self.assert_(isinstance(modified, datetime),
@@ -143,6 +221,11 @@ class UtilsTest(TestCase):
         sleep(1)  # ensure deleted record is picked up as most recent
         Deleted(eadid='eadid', title='test deleted record', date=datetime.now()).save()
         record = Deleted.objects.get(eadid='eadid')     # retrieve datetime from DB
+        # stored watermark is not updated until bumped
+        self.assertEqual(exist_datetime_with_timezone(fa.last_modified),
+                         collection_lastmodified('rqst'))
+        # watermark initialized from deleted records when not yet stored
+        CollectionWatermark.objects.all().delete()
         modified = collection_lastmodified('rqst')
         # NOTE: THIS TEST DEPENDS ON THE LOCAL MACHINE TIME BEING SET CORRECTLY
         self.assertEqual(exist_datetime_with_timezone(record.date), modified,
@@ -152,16 +235,150 @@ class UtilsTest(TestCase):
         # - temporarily change collection so no documents will be found
         with patch.object(settings, 'EXISTDB_ROOT_COLLECTION', new='/db/missing'):
             # no exist data, but deleted record - should not cause any errors
+            CollectionWatermark.objects.all().delete()
             modified = collection_lastmodified('rqst')
             self.assertEqual(exist_datetime_with_timezone(record.date), modified,
                 'collection last-modified should return most recently deleted document when no data is in eXist')
             # no exist data, no deleted records
             record = Deleted.objects.get(eadid='eadid')     # retrieve datetime from DB
             record.delete()
+            CollectionWatermark.objects.all().delete()
             modified = collection_lastmodified('rqst')
             self.assertEqual(None, modified,
                 'collection last-modified should return None when no data is in eXist or deleted')
 
+        # bumping the watermark updates last-modified to the current time
+        watermark = CollectionWatermark.bump()
+        self.assertEqual(exist_datetime_with_timezone(watermark.modified),
+                         collection_lastmodified('rqst'))
+
+        # watermark time is stored as eXist server time, so last-modified is
+        # correct when the eXist timezone differs from the local timezone
+        for offset in [-10, 9]:
+            with override_settings(EXISTDB_SERVER_TIMEZONE=tz.tzoffset(None, offset * 3600)):
+                CollectionWatermark.bump()
+                modified = collection_lastmodified('rqst')
+                self.assert_(abs(datetime.now(tz.tzutc()) - modified) < timedelta(minutes=1),
+                    'watermark last-modified should be the current time for eXist timezone offset %d' % offset)
+
+    def test_collection_etag(self):
+        etag = collection_etag('rqst')
+        watermark = CollectionWatermark.bump()
+        self.assertNotEqual(etag, collection_etag('rqst'),
+            'collection etag should change when the collection watermark is bumped')
+        self.assertEqual('collection-%d' % watermark.version, collection_etag('rqst'))
+
+
+    def test_exist_document_path(self):
+        fa = FindingAid.objects.only('document_name', 'collection_name') \
+                               .get(eadid='abbey244')
+        path = exist_document_path('abbey244')
+        self.assertEqual('%s/%s' % (fa.collection_name.rstrip('/'), fa.document_name),
+                         path)
+        self.assertRaises(Http404, exist_document_path, 'bogusid')
+
+        # cataloged document - no eXist query
+        CatalogEntry.update('abbey244')
+        CatalogEntry.mark_reconciled()
+        with patch('findingaids.fa.utils.get_findingaid') as mockget:
+            self.assertEqual(path, exist_document_path('abbey244'))
+            self.assertEqual(0, mockget.call_count)
+
+    @patch('findingaids.fa.utils.urllib2')
+    def test_open_exist_document(self, mockurllib2):
+        with override_settings(EXISTDB_SERVER_URL='http://exist.example.com:8080/exist/',
+                               EXISTDB_SERVER_USER='user', EXISTDB_SERVER_PASSWORD='pass',
+                               EXISTDB_TIMEOUT=10):
+            open_exist_document('/db/fa/abbey244.xml')
+            args, kwargs = mockurllib2.Request.call_args
+            self.assertEqual('http://exist.example.com:8080/exist/rest/db/fa/abbey244.xml?_indent=no',
+                             args[0])
+            mockurllib2.Request.return_value.add_header.assert_called_with(
+                'Authorization', 'Basic %s' % base64.b64encode('user:pass'))
+            mockurllib2.urlopen.assert_called_with(mockurllib2.Request.return_value,
+                                                   timeout=10)
+
+            open_exist_document('/db/fa/abbey244.xml', indent=True)
+            args, kwargs = mockurllib2.Request.call_args
+            self.assert_(args[0].endswith('?_indent=yes'))
+
+    def test_read_chunks(self):
+        stream = StringIO('a' * 10)
+        self.assertEqual(['aaaa', 'aaaa', 'aa'], list(read_chunks(stream, 4)))
+        self.assert_(stream.closed, 'stream should be closed after reading')
+
+    def test_gzip_chunks(self):
+        chunks = ['<ead>', 'content ' * 100, '</ead>']
+        gzipped = ''.join(gzip_chunks(chunks))
+        self.assertEqual(''.join(chunks), GzipFile(fileobj=StringIO(gzipped)).read())
+
+        rqst = HttpRequest()
+        self.assertFalse(accepts_gzip(rqst))
+        rqst.META['HTTP_ACCEPT_ENCODING'] = 'gzip,deflate'
+        self.assertTrue(accepts_gzip(rqst))
+
+
+class ExistPaginatorTest(TestCase):
+    exist_fixtures = {'directory': exist_fixture_path}
+
+    eadids = ['abbey244', 'adams465', 'bailey807', 'leverette135',
+              'pittsfreeman1036', 'pomerantz890', 'raoul548']
+
+    def test_page(self):
+        qs = FindingAid.objects.order_by('eadid').only('eadid')
+        paginator = ExistPaginator(qs, per_page=3)
+        page = paginator.page(1)
+        self.assertEqual(1, paginator.query_count,
+                         'count and first page should be retrieved with one query')
+        self.assertEqual(7, paginator.count)
+        self.assertEqual(3, paginator.num_pages)
+        self.assertEqual(self.eadids[:3], [fa.eadid.value for fa in page.object_list])
+        self.assertEqual(1, paginator.query_count)
+        # same page is not retrieved again
+        paginator.page(1)
+        self.assertEqual(1, paginator.query_count)
+
+        page = paginator.page(3)
+        self.assertEqual(self.eadids[6:], [fa.eadid.value for fa in page.object_list])
+        self.assertEqual(7, page.end_index())
+        self.assertRaises(EmptyPage, paginator.page, 4)
+        self.assertRaises(EmptyPage, paginator.page, 0)
+        self.assertRaises(PageNotAnInteger, paginator.page, 'two')
+
+        # orphans are included on the last page
+        paginator = ExistPaginator(qs, per_page=3, orphans=1)
+        page = paginator.page(2)
+        self.assertEqual(2, paginator.num_pages)
+        self.assertEqual(self.eadids[3:], [fa.eadid.value for fa in page.object_list])
+
+    def test_max_count(self):
+        qs = FindingAid.objects.order_by('eadid').only('eadid')
+        paginator = ExistPaginator(qs, per_page=2, max_count=5)
+        page = paginator.page(3)
+        self.assertEqual(7, paginator.total_count)
+        self.assertEqual(5, paginator.count)
+        self.assertEqual(3, paginator.num_pages)
+        self.assertEqual(self.eadids[4:5], [fa.eadid.value for fa in page.object_list])
+        self.assertRaises(EmptyPage, paginator.page, 4)
+        # max count larger than number of results
+        paginator = ExistPaginator(qs, per_page=2, max_count=10)
+        paginator.page(1)
+        self.assertEqual(7, paginator.count)
+        self.assertEqual(7, paginator.total_count)
+
+    def test_paginate_queryset(self):
+        rqst = HttpRequest()
+        rqst.GET['page'] = '2'
+        page, paginator = paginate_queryset(rqst, FindingAid.objects.order_by('eadid').only('eadid'),
+                                            per_page=5)
+        self.assert_(isinstance(paginator, ExistPaginator))
+        self.assertEqual(self.eadids[5:], [fa.eadid.value for fa in page.object_list])
+        # non-eXist object lists use the default django paginator
+        page, paginator = paginate_queryset(rqst, self.eadids, per_page=5)
+        self.assertFalse(isinstance(paginator, ExistPaginator))
+        self.assertEqual(self.eadids[5:], page.object_list)
+        page, paginator = paginate_queryset(rqst, self.eadids, per_page=5, max_count=6)
+        self.assertEqual(self.eadids[5:6], page.object_list)
 
 
 class FormatEadTestCase(DjangoTestCase):
@@ -260,6 +477,27 @@ school desegregation case files</abstract>""" % EAD_NAMESPACE
         self.assert_('<a>Irish Literary Miscellany</a>'
             in fmt, 'formatter should not fail when extref has no href')
 
+    def test_nesting(self):
+        # deeply nested content (near the parser depth limit) renders correctly
+        depth = 250
+        self.content.node = etree.fromstring('<p xmlns="%s">%s%s</p>' % \
+            (EAD_NAMESPACE, '<emph>a' * depth, '</emph>' * depth))
+        fmt = format_ead(self.content)
+        self.assertEqual('<em>a' * depth + '</em>' * depth, fmt)
+
+    def test_matches_recursive(self):
+        # output should be identical to the original recursive renderer
+        for fixture in ['raoul548.xml', 'abbey244.xml', 'leverette135.xml']:
+            ead = load_xmlobject_from_file(path.join(exist_fixture_path, fixture),
+                                           FindingAid)
+            for rdfa in [False, True]:
+                for node in [ead.archdesc.node] + ead.dsc.node.xpath('.//*'):
+                    self.assertEqual(
+                        recursive_format_ead_node(node, conditional_escape, rdfa),
+                        format_ead_node(node, conditional_escape, rdfa),
+                        'iterative renderer output should match recursive renderer for %s in %s (rdfa=%s)' \
+                        % (node.tag, fixture, rdfa))
+
 class RdfaTemplateTest(DjangoTestCase):
     # test RDFa output for file-level items
 
@@ -557,16 +795,6 @@ class ArkPidTestCase(DjangoTestCase):
         self.assertEqual('17kjg', ark_pid('http://pid.emory.edu/ark:/25593/17kjg'))
         self.assertEqual(None, ark_pid('http://example.com/not/an/ark'))
 
-class BooleanToUpperTest(TestCase):
-    def test_boolean_to_upper(self):
-        #should capitalize and or not when they are separate words and not parts of other words
-        input = "not cookies and ice cream or oreos they make anderson sick and he eats nothing except hot dogs and hamburgers"
-        expected = "NOT cookies AND ice cream OR oreos they make anderson sick AND he eats nothing except hot dogs AND hamburgers"
-
-        result = boolean_to_upper(input)
-        self.assertEqual(result, expected)
-
-
 class AdvancedSearchFormTest(TestCase):
     # load fixtures so we have repo choices
     exist_fixtures = {'directory': exist_fixture_path}
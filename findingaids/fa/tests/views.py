@@ -14,12 +14,18 @@
 #   See the License for the specific language governing permissions and
 #   limitations under the License.
 
+from gzip import GzipFile
+import json
 from os import path
+import shutil
+from StringIO import StringIO
+import tempfile
 from types import ListType
 from lxml import etree
 from mock import patch
 import unittest
-from urllib import quote as urlquote
+from urllib import quote as urlquote, urlencode
+from urllib2 import URLError
 
 from django.conf import settings
 from django.core.cache import cache
@@ -31,9 +37,14 @@ from eulexistdb.testutil import TestCase
 from eulxml.xmlmap import load_xmlobject_from_file, \
     load_xmlobject_from_string
 
-from findingaids.fa.models import FindingAid, Series, Series2, Series3, \
-    Deleted
-from findingaids.fa.views import _series_url, _subseries_links, _series_anchor
+from findingaids.fa import autocomplete, pagecache, pdfqueue, pdfstore, searchcache
+from findingaids.fa.pdfqueue import QueueFull
+from findingaids.fa.models import FindingAid, BrowseTitle, Series, Series2, Series3, \
+    Deleted, NavigationItem, CatalogEntry, CatalogStatus
+from findingaids.fa.pdfstore import full_findingaid_xslfo, store_findingaid_pdf
+from findingaids.fa.views import _subseries_links, _subtree, _match_counts
+from findingaids.fa.utils import paginate_queryset, ead_etag, render_xhtml, \
+    series_url, series_anchor, document_link_tree, format_links
 
 ## unit tests for views and template logic
 
@@ -49,6 +60,10 @@ class FaViewsTest(TestCase):
 
     def setUp(self):
         self.db = ExistDB()
+        # don't serve pages, page labels, or search results cached by other tests
+        pagecache.reset()
+        searchcache.reset()
+        cache.clear()
 
     def tearDown(self):
         # clean up any documents that were created by individual tests
@@ -92,13 +107,14 @@ class FaViewsTest(TestCase):
 
         a_titles = reverse('fa:titles-by-letter', kwargs={'letter': 'A'})
         response = self.client.get(a_titles)
-        session = self.client.session
         expected = 200
-        last_search = session.get("last_search", None)  # browse query info stored in the session
+        last_search = response.context['last_search']  # browse query info for return link
         self.assertTrue(last_search)
         self.assertEqual(
             "%s?page=1" % (reverse('fa:titles-by-letter', kwargs={'letter': 'A'})),
-            last_search['url'], "session url should match title-by-letter with page number")
+            last_search['url'], "last search url should match title-by-letter with page number")
+        self.assertFalse('last_search' in self.client.session,
+                         'browse results should not be stored in the session')
 
         self.assertEqual(response.status_code, expected,
                          'Expected %s but returned %s for %s'
@@ -178,6 +194,52 @@ class FaViewsTest(TestCase):
             r'''Pitts v. Freeman</[-A-Za-z]+> school''', response.content,
             msg_prefix='title within unittitle should be formatted on list view')
 
+    def test_titles_by_letter_browse_titles(self):
+        # use locally stored browse titles instead of eXist
+        BrowseTitle.rebuild()
+        with patch('findingaids.fa.views.FindingAid') as mockfa:
+            response = self.client.get(reverse('fa:titles-by-letter',
+                                       kwargs={'letter': 'A'}))
+            self.assertEqual(0, mockfa.objects.filter.call_count,
+                             'eXist should not be queried when browse titles are available')
+        self.assertContains(
+            response,
+            'href="%s' % reverse('fa:findingaid', kwargs={'id': 'abbey244'}),
+            msg_prefix='browse by titles for A should link to Abbey finding aid')
+        self.assertContains(
+            response, '<p class="abstract">Collection of play scripts',
+            msg_prefix='browse by titles for A should include Abbey finding aid abstract')
+        self.assertContains(
+            response, '2 finding aids found',
+            msg_prefix='browse by titles for A should return 2 finding aids')
+        self.assertContains(
+            response, 'Ab - Ad',
+            msg_prefix='browse pagination uses first letters of titles instead of numbers')
+
+        response = self.client.get(reverse('fa:titles-by-letter',
+                                   kwargs={'letter': 'P'}))
+        self.assertPattern(
+            r'''Pitts v. Freeman</[-A-Za-z]+> school''', response.content,
+            msg_prefix='title within unittitle should be formatted on list view')
+        self.assertPattern(r'''Repository: Manuscript,\s+Archives,\s+and\s+Rare\s+Book\s+Library/Pitts Theology Library''',
+                           response.content,
+                           msg_prefix='short-record view should include multiple holding repositories')
+
+    def test_titles_by_letter_partial_browse_titles(self):
+        # a document published before browse titles have been generated
+        # for the whole collection should not limit browse to that document
+        BrowseTitle.build(FindingAid.objects.get(eadid='abbey244'))
+        response = self.client.get(reverse('fa:titles-by-letter',
+                                   kwargs={'letter': 'P'}))
+        self.assertPattern(
+            r'''Pitts v. Freeman</[-A-Za-z]+> school''', response.content,
+            msg_prefix='browse should list documents from eXist until browse titles are generated')
+        response = self.client.get(reverse('fa:titles-by-letter',
+                                   kwargs={'letter': 'A'}))
+        self.assertContains(
+            response, '3 finding aids found',
+            msg_prefix='browse by titles for A should return 3 finding aids from eXist')
+
     def test_titles_xml(self):
         xml_titles = reverse('fa:all-xml')
         response = self.client.get(xml_titles)
@@ -973,17 +1035,45 @@ class FaViewsTest(TestCase):
 
 # **** tests for helper functions for creating series url, list of series/subseries for display in templates
 
-    def test__series_url(self):
+    def test_view_cached(self):
+        fa_url = reverse('fa:findingaid', kwargs={'id': 'abbey244'})
+        response = self.client.get(fa_url)
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(1, pagecache.stats()['misses'])
+
+        # second request should be served from the cache, without
+        # retrieving the document from eXist
+        with patch('findingaids.fa.views.get_findingaid') as mockget:
+            cached_response = self.client.get(fa_url)
+            self.assertFalse(mockget.called,
+                'document should not be retrieved when page is cached')
+        self.assertEqual(200, cached_response.status_code)
+        self.assertEqual(response.content, cached_response.content)
+        self.assertEqual(1, pagecache.stats()['hits'])
+
+        # logged-in users should not get cached pages
+        self.client.login(username='testadmin', password='secret')
+        response = self.client.get(fa_url)
+        self.assert_(response.context is not None,
+            'page should be rendered for logged-in users')
+        self.client.logout()
+
+        # invalidating removes cached pages
+        pagecache.invalidate('abbey244')
+        self.client.get(fa_url)
+        self.assertEqual(2, pagecache.stats()['misses'])
+
+    def test_series_url(self):
         self.assertEqual(reverse('fa:series-or-index', kwargs={'id': 'docid', 'series_id': 's1'}),
-                         _series_url('docid', 's1'))
+                         series_url('docid', 's1'))
         self.assertEqual(reverse('fa:series2',
                                  kwargs={'id': 'docid', 'series_id': 's1',
                                          'series2_id': 's1.2'}),
-                         _series_url('docid', 's1', 's1.2'))
+                         series_url('docid', 's1', 's1.2'))
         self.assertEqual(
             reverse('fa:series3', kwargs={'id': 'docid', 'series_id': 's3',
                                           'series2_id': 's3.5', 'series3_id': 's3.5a'}),
-            _series_url('docid', 's3', 's3.5', 's3.5a'))
+            series_url('docid', 's3', 's3.5', 's3.5a'))
 
     def test__subseries_links__dsc(self):
         # subseries links for a top-level series that has subseries
@@ -1106,7 +1196,7 @@ class FaViewsTest(TestCase):
     def test__subseries_links_anchors(self):
         # subseries links  - generate same-page anchors instead of full urls
         fa = FindingAid.objects.get(eadid='raoul548')
-        links = _subseries_links(fa.dsc, url_ids=[fa.eadid], url_callback=_series_anchor)
+        links = _subseries_links(fa.dsc, url_ids=[fa.eadid], url_callback=series_anchor)
 
         self.assert_("Series 1: Letters and personal papers" in links[0])
         self.assert_("href='#s1'" in links[0])
@@ -1115,6 +1205,81 @@ class FaViewsTest(TestCase):
         self.assert_("href='#s1.1'" in links[1][0])
         self.assert_("rel='subsection dcterms:hasPart'" in links[1][0])
 
+    def test_document_link_tree(self):
+        fa = FindingAid.objects.get(eadid='raoul548')
+        cache.delete('series-links:raoul548:abc123:published')
+        # no stored navigation and no document - no tree
+        self.assertEqual(None, document_link_tree('raoul548', 'abc123'))
+
+        tree = document_link_tree('raoul548', 'abc123', ead=fa)
+        self.assertEqual('raoul548_s1', tree[0]['id'])
+        self.assertEqual('s1', tree[0]['short_id'])
+        self.assertEqual('Series 1: Letters and personal papers, 1865-1982',
+                         tree[0]['label'])
+        self.assertEqual('section', tree[0]['rel'])
+        self.assertEqual(2, tree[0]['children'][0]['level'])
+        self.assertEqual('subsection', tree[0]['children'][0]['rel'])
+        # formatted links should match links generated from the document
+        self.assertEqual(_subseries_links(fa.dsc, url_ids=[fa.eadid]),
+                         format_links(tree, ['raoul548']))
+        self.assertEqual(_subseries_links(fa.dsc, url_ids=[fa.eadid], preview=True,
+                                          url_params='?keywords=search+me'),
+                         format_links(tree, ['raoul548'], preview=True,
+                                      url_params='?keywords=search+me'))
+        self.assertEqual(_subseries_links(fa.dsc, url_ids=[fa.eadid],
+                                          url_callback=series_anchor),
+                         format_links(tree, ['raoul548'], url_callback=series_anchor))
+
+        # cached by eadid and hash; document not needed
+        self.assertEqual(tree, document_link_tree('raoul548', 'abc123'))
+        # preview mode is cached separately
+        self.assertEqual(None, document_link_tree('raoul548', 'abc123', preview=True))
+        cache.delete('series-links:raoul548:abc123:published')
+
+        # tree from stored navigation should match tree from the document
+        navigation = NavigationItem.build(fa)
+        self.assertEqual(tree, document_link_tree('raoul548', 'abc123'))
+        NavigationItem.remove('raoul548')
+        cache.delete('series-links:raoul548:abc123:published')
+
+        # subseries links from the tree should match links from the series
+        children, url_ids = _subtree(tree, 'raoul548_4.1', ['raoul548'])
+        self.assertEqual(['raoul548', 's4', '4.1'], url_ids)
+        series = Series2.objects.also('ead__eadid', 'series__id').get(id='raoul548_4.1')
+        self.assertEqual(_subseries_links(series), format_links(children, url_ids))
+        self.assertEqual(None, _subtree(tree, 'bogus', ['raoul548']))
+
+        # match counts
+        links = format_links(tree, ['raoul548'],
+                             match_counts={'raoul548_s1': 2, 'raoul548_s1.1': 1})
+        self.assert_("<span class='exist-match'>2 matches</span>" in links[0])
+        self.assert_("<span class='exist-match'>1 match</span>" in links[1][0])
+
+    def test__match_counts(self):
+        node = etree.fromstring('''<c01 xmlns="urn:isbn:1-931666-22-9" id="s1"
+            xmlns:exist="http://exist.sourceforge.net/NS/exist">
+            <did><unittitle><exist:match>Letters</exist:match></unittitle></did>
+            <c02 id="s1.1"><did><unittitle><exist:match>Letters</exist:match>
+            to <exist:match>family</exist:match></unittitle></did></c02>
+            <c02><exist:match>no id</exist:match></c02></c01>''')
+        self.assertEqual({'s1': 4, 's1.1': 2}, _match_counts(node))
+
+    def test_view_series__stored_navigation(self):
+        fa = FindingAid.objects.get(eadid='bailey807')
+        NavigationItem.build(fa)
+        series_url = reverse('fa:series-or-index', kwargs={'id': 'bailey807',
+                             'series_id': 'series1'})
+        response = self.client.get(series_url)
+        # series & index navigation should not be retrieved from eXist
+        self.assertEqual(1, len(response.context['querytime']),
+            'only the requested series should be retrieved from eXist when navigation is stored')
+        self.assertEqual(9, len(response.context['all_series']))
+        self.assertPattern(
+            '<li>.*<a href="%s".*rel="next">.*Series 2:.*Writings by Bailey family.*</a>.*</li>' %
+            reverse('fa:series-or-index', kwargs={'id': 'bailey807', 'series_id': 'series2'}),
+            response.content, "series nav - link to series 2")
+        NavigationItem.remove('bailey807')
+
     # skip the printable test if XSLFO is not configured (i.e., if FOP cannot be installed)
     @unittest.skipIf(not settings.XSLFO_PROCESSOR, 'XSL-FO processor not set')
     def test_printable_fa(self):
@@ -1178,6 +1343,82 @@ class FaViewsTest(TestCase):
         # - there is no official XSL-FO schema or DTD; available unofficial
         # schemas do not include fo:bookmark (which is part of XSL-FO v1.1)
 
+    @patch('findingaids.fa.pdfsplit.render_pdf')
+    def test_printable_pdf_store(self, mockgenerate):
+        mockgenerate.return_value = 'generated pdf'
+        store_dir = tempfile.mkdtemp(prefix='findingaids-pdfstore-test-')
+        pdf_url = reverse('fa:printable', kwargs={'id': 'raoul548'})
+        try:
+            with override_settings(FINDINGAID_PDF_STORE={'DIR': store_dir}):
+                # not yet stored - generated and stored
+                response = self.client.get(pdf_url)
+                self.assertEqual('application/pdf', response['Content-Type'])
+                self.assertEqual('inline; filename=raoul548.pdf',
+                                 response['Content-Disposition'])
+                self.assertEqual('generated pdf', ''.join(response.streaming_content))
+                self.assertEqual(1, mockgenerate.call_count)
+                self.assertEqual(1, len(pdfstore.stored_files()))
+
+                # stored - served without generating the pdf again
+                response = self.client.get(pdf_url)
+                self.assertEqual('generated pdf', ''.join(response.streaming_content))
+                self.assertEqual(1, mockgenerate.call_count)
+
+                # store_findingaid_pdf does not regenerate the current version
+                self.assertEqual(pdfstore.stored_files()[0][2],
+                                 store_findingaid_pdf('raoul548'))
+                self.assertEqual(1, mockgenerate.call_count)
+        finally:
+            shutil.rmtree(store_dir)
+
+    def testfull_findingaid_xslfo(self):
+        hash = ead_etag(None, 'raoul548')
+        with patch('findingaids.fa.pdfstore.render_xhtml', wraps=render_xhtml) as mockxslfo:
+            xslfo = full_findingaid_xslfo('raoul548', hash)
+            self.assertEqual(1, mockxslfo.call_count)
+            # cached by document version; template and xslt are not run again
+            cached_xslfo = full_findingaid_xslfo('raoul548', hash)
+            self.assertEqual(1, mockxslfo.call_count)
+            self.assertEqual(etree.tostring(xslfo), etree.tostring(cached_xslfo))
+
+            # xsl-fo view uses the cached version
+            response = self.client.get(reverse('fa:xslfo', kwargs={'id': 'raoul548'}))
+            self.assertEqual(etree.tostring(xslfo), response.content)
+            self.assertEqual(1, mockxslfo.call_count)
+
+            # different document versions are cached separately
+            full_findingaid_xslfo('raoul548', 'other-hash')
+            self.assertEqual(2, mockxslfo.call_count)
+
+        # small documents are not split into parts
+        parts = full_findingaid_xslfo('raoul548', hash, parts=True)
+        self.assertEqual(1, len(parts))
+        self.assertEqual(etree.tostring(xslfo), etree.tostring(parts[0]))
+
+        # large documents are split by series
+        with override_settings(FINDINGAID_PDF_SPLIT={'MIN_COMPONENTS': 100}):
+            parts = full_findingaid_xslfo('raoul548', 'split-hash', parts=True)
+        # front matter and 4 series
+        self.assertEqual(5, len(parts))
+        self.assert_(all(isinstance(part, etree._ElementTree) for part in parts))
+
+    @patch('findingaids.fa.views.pdfqueue.render')
+    def test_printable_pdf_busy(self, mockrender):
+        mockrender.side_effect = QueueFull
+        pdf_url = reverse('fa:printable', kwargs={'id': 'raoul548'})
+        response = self.client.get(pdf_url)
+        self.assertEqual(503, response.status_code,
+                         'printable PDF should return 503 when the render queue is full')
+        self.assertEqual(str(pdfqueue.get_config()['RETRY_AFTER']),
+                         response['Retry-After'])
+        self.assertContains(response, 'PDF Temporarily Unavailable', status_code=503)
+        self.assertContains(response, reverse('fa:findingaid', kwargs={'id': 'raoul548'}),
+                            status_code=503)
+        # render is shared by eadid, document version, and preview mode
+        key = mockrender.call_args[0][0]
+        self.assertEqual('raoul548', key[0])
+        self.assertEqual(False, key[2])
+
     def test_eadxml(self):
         nonexistent_ead = reverse('fa:eadxml', kwargs={'id': 'nonexistent'})
         response = self.client.get(nonexistent_ead)
@@ -1194,15 +1435,57 @@ class FaViewsTest(TestCase):
         self.assertEqual(response['Content-Type'], expected,
                          "Expected '%s' but returned '%s' for %s mimetype" %
                          (expected, response['Content-Type'], xml_url))
-        self.assertContains(response, 'identifier="ark:/25593/1fx')
+        self.assert_(response.streaming, 'EAD xml response should be streamed')
+        self.assert_('Accept-Encoding' in response['Vary'],
+                     'response should vary on Accept-Encoding')
+        content = ''.join(response.streaming_content)
+        self.assert_('identifier="ark:/25593/1fx' in content)
 
         # load httpresponse body into an XmlObject to compare with findingaid doc
-        ead = load_xmlobject_from_string(response.content)
+        ead = load_xmlobject_from_string(content)
         abbey = FindingAid.objects.get(eadid='abbey244')
         self.assertEqual(
             ead.serialize(), abbey.serialize(),
             "response content should be the full, valid XML content of the requested EAD document")
 
+        # pretty-printing is only done when requested
+        with patch('findingaids.fa.views.open_exist_document') as mockopen:
+            mockopen.return_value = StringIO(abbey.serialize())
+            self.client.get(xml_url)
+            args, kwargs = mockopen.call_args
+            self.assertFalse(kwargs['indent'])
+            mockopen.return_value = StringIO(abbey.serialize())
+            self.client.get(xml_url, {'pretty': 1})
+            args, kwargs = mockopen.call_args
+            self.assertTrue(kwargs['indent'])
+
+        # gzip compression when accepted by the client
+        etag = response['ETag']
+        response = self.client.get(xml_url, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual('gzip', response['Content-Encoding'])
+        gzipped = GzipFile(fileobj=StringIO(''.join(response.streaming_content)))
+        self.assertEqual(content, gzipped.read(),
+            'gzipped response should have the same content as uncompressed response')
+        # encoded response has a distinct etag
+        gzip_etag = response['ETag']
+        self.assertEqual('"%s-gzip"' % etag.strip('"'), gzip_etag)
+        self.assert_('Accept-Encoding' in response['Vary'])
+        response = self.client.get(xml_url, HTTP_ACCEPT_ENCODING='gzip',
+                                   HTTP_IF_NONE_MATCH=gzip_etag)
+        self.assertEqual(304, response.status_code)
+        response = self.client.get(xml_url, HTTP_IF_NONE_MATCH=gzip_etag)
+        self.assertEqual(200, response.status_code,
+            'gzip etag should not match the unencoded response')
+
+        # if the document can't be streamed from eXist, fall back to loading it
+        with patch('findingaids.fa.views.open_exist_document') as mockopen:
+            mockopen.side_effect = URLError('connection refused')
+            response = self.client.get(xml_url)
+            self.assertEqual(200, response.status_code)
+            ead = load_xmlobject_from_string(''.join(response.streaming_content))
+            self.assertEqual(ead.serialize(), abbey.serialize(),
+                "full EAD content should be returned when streaming from eXist fails")
+
     def test_content_negotiation(self):
         url = reverse('fa:findingaid', kwargs={'id': 'raoul548'})
 
@@ -1218,59 +1501,84 @@ class FaViewsTest(TestCase):
         response = self.client.get(url, HTTP_ACCEPT="text/xml")
         self.assertEqual(response['Content-Type'], "application/xml", "Should return xml")
 
+    def test_suggest(self):
+        autocomplete.reset()
+        autocomplete.update_indexes()
+        suggest_url = reverse('fa:suggest')
+        response = self.client.get(suggest_url, {'term': 'theat'})
+        self.assertEqual('application/json', response['Content-Type'])
+        data = json.loads(response.content)
+        self.assert_({'label': 'Theater programs.', 'category': 'subject',
+                      'value': '"Theater programs."'} in data,
+                     'controlled access heading should be suggested')
+        self.assert_('Abbey Theatre.' in
+                     [s['label'] for s in data if s['category'] == 'title'],
+                     'list title should be suggested for word match')
+        # restrict by type
+        response = self.client.get(suggest_url, {'term': 'theat', 'type': 'subject'})
+        data = json.loads(response.content)
+        self.assert_(data)
+        self.assert_(all(s['category'] == 'subject' for s in data))
+        # no term
+        response = self.client.get(suggest_url)
+        self.assertEqual([], json.loads(response.content))
+        autocomplete.reset()
+
+        # suggestions are attached to the keyword and subject fields
+        response = self.client.get(reverse('fa:search'))
+        self.assertContains(response, "$('#id_keywords').autocomplete(")
+        self.assertContains(response, "$('#id_subject').autocomplete(")
+        self.assertContains(response, "type: 'subject'")
+
     def test_return_to_search_or_browse(self):
-        #No session variables set so Cache-Control should not be set
         url = reverse('fa:findingaid', kwargs={'id': 'raoul548'})
         response = self.client.get(url)
-        session = self.client.session
-        last_search = session.get("last_search", None)
-        self.assertFalse(last_search)
-        self.assertFalse(response.get('Cache-Control', None),
-                         "Cache-Control should not be set since there are no session variables set")
-        self.assertNotContains(response, 'Return to Browse',
-                               msg_prefix="No return to browse link should appear since there are no session variables set")
-
-        #With last_search set in search
-        #Calling search view first to set session info to simulate a user searching
+        # return link is populated by javascript from browser session storage
+        self.assertContains(response, '<div id="last-search" class="sidebar-search" style="display:none">',
+            msg_prefix='document page should include placeholder for return to results link')
+        self.assertContains(response, "sessionStorage.getItem('last_search_url')")
+        # anonymous document pages can be cached by shared caches
+        self.assert_('public' in response['Cache-Control'],
+            'document page for anonymous user should be publicly cacheable')
+        vary = [h.strip() for h in response['Vary'].split(',')]
+        self.assert_('Accept' in vary,
+            'document page should vary on Accept (html and xml at the same url)')
+        self.assert_('Cookie' in vary,
+            'document page should vary on Cookie (content for logged in users)')
+
+        # search results page stores return link in the browser
         search_url = reverse('fa:search')
-        self.client.get(search_url, {'keywords': 'raoul'})
+        response = self.client.get(search_url, {'keywords': 'raoul'})
+        self.assertContains(response,
+            "sessionStorage.setItem('last_search_url', '%s?keywords\\u003Draoul\\u0026page\\u003D1')" % search_url,
+            msg_prefix='search results should save return to search link')
+        self.assertContains(response,
+            "sessionStorage.setItem('last_search_txt', 'Return to Search Results')")
+        self.assertFalse('last_search' in self.client.session,
+                         'search should not be stored in the session')
 
-        url = reverse('fa:findingaid', kwargs={'id': 'raoul548'})
+        # document page is unchanged
         response = self.client.get(url)
-        session = self.client.session
-        last_search = session.get("last_search", None)
-        self.assertTrue(last_search)
-        self.assertEqual(last_search['txt'], "Return to Search Results", 'test to make sure the search view set the session')
-
-        self.assertTrue(
-            response['Cache-Control'],
-            "Cache-Control should be set since there are session variables set")
-        self.assertEqual(
-            response['Cache-Control'], "private",
-            "value should be private")
-        self.assertContains(
-            response, '<a href="%s?keywords=raoul&amp;page=1">Return to Search Results</a>'
-            % (reverse('fa:search')), msg_prefix="retun to search link should exist")
+        self.assert_('public' in response['Cache-Control'],
+            'document page should still be publicly cacheable after a search')
 
-        # With last_search set in browse
-        # Calling title-by-letter view first to set session info to simulate a user
+        # browse results page stores return link in the browser
         letter = "R"
         browse_url = reverse('fa:titles-by-letter', kwargs={'letter': letter})
-        self.client.get(browse_url)
-
-        url = reverse('fa:findingaid', kwargs={'id': 'raoul548'})
-        response = self.client.get(url)
-        session = self.client.session
-        last_search = session.get("last_search", None)
-        self.assertTrue(last_search)
-        self.assertEqual(last_search['txt'], "Return to Browse Results", 'test to make sure the browse view set the session')
+        response = self.client.get(browse_url)
+        self.assertContains(response,
+            "sessionStorage.setItem('last_search_url', '%s?page\\u003D1')" % browse_url,
+            msg_prefix='browse results should save return to browse link')
+        self.assertContains(response,
+            "sessionStorage.setItem('last_search_txt', 'Return to Browse Results')")
+        self.assertFalse('last_search' in self.client.session,
+                         'browse should not be stored in the session')
 
-        self.assertTrue(response['Cache-Control'], "Cache-Control should be set since there are session variables set")
-        self.assertEqual(response['Cache-Control'], "private", "value should be private")
-        self.assertContains(
-            response, '<a href="%s?page=1">Return to Browse Results</a>'
-            % (reverse('fa:titles-by-letter', kwargs={'letter': letter})),
-            msg_prefix="retun to browse link should exist")
+        # series pages are also cacheable
+        series_url = reverse('fa:series-or-index', kwargs={'id': 'raoul548', 'series_id': 'index1'})
+        response = self.client.get(series_url)
+        self.assert_('public' in response['Cache-Control'],
+            'series page for anonymous user should be publicly cacheable')
 
     def test_short_ids(self):
         # urls for series/index should use short-form ids (tested above, throughout)
@@ -1341,15 +1649,20 @@ class FullTextFaViewsTest(TestCase):
     exist_fixtures = {'index': exist_index_path,
                       'directory': exist_fixture_path}
 
+    def setUp(self):
+        # don't serve pages, page labels, or search results cached by other tests
+        pagecache.reset()
+        searchcache.reset()
+        cache.clear()
+
     def test_search(self):
         search_url = reverse('fa:search')
         response = self.client.get(search_url, {'keywords': 'raoul'})
-        session = self.client.session
         expected = 200
         self.assertEqual(response.status_code, expected,
                          'Expected %s but returned %s for %s' %
                          (expected, response.status_code, search_url))
-        last_search = session.get("last_search", None)
+        last_search = response.context['last_search']
         self.assertTrue(last_search)
         self.assertEqual("%s?keywords=raoul&page=1" % (search_url), last_search['url'])
 
@@ -1429,6 +1742,51 @@ class FullTextFaViewsTest(TestCase):
         self.assertContains(response, abbey_url,
             msg_prefix='search for digital resources should include abbey (internal dao only)')
 
+    def test_search_result_cache(self):
+        search_url = reverse('fa:search')
+        with patch('findingaids.fa.searchcache.ResultSet.from_queryset',
+                   wraps=searchcache.ResultSet.from_queryset) as mockresults:
+            response = self.client.get(search_url, {'keywords': 'family'})
+            self.assertEqual(1, mockresults.call_count)
+            count = response.context['findingaids'].paginator.count
+            # same search with different whitespace uses cached results
+            response = self.client.get(search_url, {'keywords': ' family ', 'page': 1})
+            self.assertEqual(1, mockresults.call_count,
+                'search should not be re-run when paging through results')
+            self.assertEqual(count, response.context['findingaids'].paginator.count)
+            # a different search is not cached
+            self.client.get(search_url, {'keywords': 'raoul'})
+            self.assertEqual(2, mockresults.call_count)
+
+        # results include relevance scores and display fields
+        response = self.client.get(search_url, {'keywords': 'raoul'})
+        fa = response.context['findingaids'].object_list[0]
+        self.assertEqual('raoul548', fa.eadid.value)
+        self.assert_(isinstance(fa.fulltext_score, float))
+        self.assert_(unicode(fa.list_title))
+
+    def test_search_facets(self):
+        search_url = reverse('fa:search')
+        response = self.client.get(search_url, {'keywords': 'collection'})
+        facets = response.context['facets']
+        repos = dict((repo, count) for repo, count, params in facets['repositories'])
+        self.assertEqual(1, repos['University Archives'])
+        self.assertEqual(1, repos['Pitts Theology Library'])
+        # only leverette135 has public daos
+        self.assertEqual(1, facets['dao'][0])
+        self.assertContains(response, 'University Archives</a> (1)')
+        repo, count, params = facets['repositories'][0]
+        self.assert_('keywords=collection' in params)
+        self.assert_(urlencode({'repository': '"%s"' % repo}) in params)
+
+        # following a facet link narrows the search; facet no longer shown
+        response = self.client.get('%s?%s' % (search_url, params))
+        self.assertEqual(count, response.context['findingaids'].paginator.count)
+        self.assert_('repositories' not in response.context['facets'])
+        response = self.client.get('%s?%s' % (search_url, facets['dao'][1]))
+        self.assertEqual(1, response.context['findingaids'].paginator.count)
+        self.assert_('dao' not in response.context['facets'])
+
     def test_search__exact_phrase(self):
         search_url = reverse('fa:search')
         # search term missing close quote - query syntax error
@@ -1443,6 +1801,11 @@ class FullTextFaViewsTest(TestCase):
         self.assertEqual(expected, got,
                          'Expected %s but returned %s for %s with invalid exact phrase search' %
                          (expected, got, search_url))
+        # syntax errors are caught before the search is sent to eXist
+        with patch('findingaids.fa.views.searchcache.get_results') as mockresults:
+            response = self.client.get(search_url, {'keywords': '"georgia'})
+            self.assertEqual(400, response.status_code)
+            self.assertFalse(mockresults.called)
 
         # exact phrase
         response = self.client.get(search_url,
@@ -1468,9 +1831,8 @@ class FullTextFaViewsTest(TestCase):
     def test_subject_search(self):
         search_url = reverse('fa:search')
         response = self.client.get(search_url, {'subject': 'Scripts.'})
-        session = self.client.session
 
-        last_search = session.get("last_search", None)
+        last_search = response.context['last_search']
         self.assertTrue(last_search)
         self.assertEqual("%s?page=1&subject=Scripts." % (search_url), last_search['url'])
 
@@ -1496,9 +1858,8 @@ class FullTextFaViewsTest(TestCase):
         # FIXME: this depends on repository choices cache matching test data...
         response = self.client.get(search_url, {'keywords': 'papers',
                                    'repository': '"University Archives"'})
-        session = self.client.session
 
-        last_search = session.get("last_search", None)
+        last_search = response.context['last_search']
         self.assertTrue(last_search)
         self.assertEqual(
             search_url + "?keywords=papers&page=1&repository=%22University+Archives%22",
@@ -1763,6 +2124,32 @@ class FullTextFaViewsTest(TestCase):
             response, 'Index of Selected Correspondents',
             msg_prefix="index without search terms is still returned normally")
 
+    def test_view_highlighted_series__match_counts(self):
+        fa = FindingAid.objects.get(eadid='raoul548')
+        NavigationItem.build(fa)
+        series_url = reverse('fa:series-or-index',
+                             kwargs={'id': 'raoul548', 'series_id': 's4'})
+        response = self.client.get(series_url, {'keywords': 'mansion institute'})
+        # requested series and highlight summary only
+        self.assertEqual(2, len(response.context['querytime']))
+        match_counts = dict((item.component_id, item.match_count) for item in
+                            response.context['all_series'] + response.context['all_indexes'])
+        self.assertEqual(3, match_counts['raoul548_s4'])
+        self.assertEqual(2, match_counts['raoul548_index1'])
+        self.assertEqual(0, match_counts['raoul548_s1'])
+        self.assertContains(response, '3 matches',
+            msg_prefix='series navigation includes match count')
+
+        # match counts are cached for the document and keywords
+        index_url = reverse('fa:series-or-index',
+                            kwargs={'id': 'raoul548', 'series_id': 'index1'})
+        response = self.client.get(index_url, {'keywords': 'mansion institute'})
+        self.assertEqual(1, len(response.context['querytime']),
+            'highlight summary should not be retrieved from eXist when cached')
+        self.assertEqual(2, dict((item.component_id, item.match_count)
+            for item in response.context['all_indexes'])['raoul548_index1'])
+        NavigationItem.remove('raoul548')
+
     @override_settings(REQUEST_MATERIALS_URL='http://example.com',
         REQUEST_MATERIALS_REPOS = ['Manuscript, Archives, and Rare Book Library'])
     def test_document_search(self):
@@ -1780,6 +2167,9 @@ class FullTextFaViewsTest(TestCase):
         self.assertContains(
             response, "22 matches found",
             msg_prefix='search for "correspondence" in raoul548 matches 44 items')
+        self.assertContains(
+            response, '<span class="exist-match">',
+            msg_prefix='matched keywords are highlighted in search results')
         # box/folder/contents headings should display once for each series
         self.assertContains(
             response, "Box", 4,
@@ -1856,6 +2246,21 @@ class FullTextFaViewsTest(TestCase):
         self.assertTrue(response.context['ead'].requestable(),
             'Finding aid should be requestable from document search page')
 
+        # total matches and current page of results retrieved together
+        self.assertEqual(22, response.context['total_matches'])
+        self.assertEqual(22, len(response.context['files'].object_list))
+        self.assertNotContains(response, 'Only the first',
+            msg_prefix='no limit message when all matches are shown')
+
+        # number of matches displayed is limited by configuration
+        with override_settings(FINDINGAID_DOCUMENT_SEARCH_MAX_HITS=15):
+            response = self.client.get(search_url, {'keywords': 'correspondence'})
+        self.assertContains(response, "22 matches found",
+            msg_prefix='total number of matches is reported when results are limited')
+        self.assertContains(response, "Only the first 15 matches are shown",
+            msg_prefix='user is notified when results are limited')
+        self.assertEqual(15, len(response.context['files'].object_list))
+
         # no matches
         response = self.client.get(search_url, {'keywords': 'bogus'})
         self.assertContains(
@@ -1931,6 +2336,61 @@ class FullTextFaViewsTest(TestCase):
         self.assertContains(response, 'Resource available online',
             msg_prefix='document with only internal daos returns matches for user with access')
 
+    def test_dao_search__catalog(self):
+        # dao filters use dao counts from the local catalog when available
+        for eadid in ['abbey244', 'leverette135', 'raoul548']:
+            CatalogEntry.update(eadid)
+        CatalogEntry.mark_reconciled()
+        search_url = reverse('fa:search')
+        leverette_url = reverse('fa:findingaid', kwargs={'id': 'leverette135'})
+        abbey_url = reverse('fa:findingaid', kwargs={'id': 'abbey244'})
+        response = self.client.get(search_url, {'dao': 'on'})
+        self.assertContains(response, leverette_url,
+            msg_prefix='search for digital resources should include Leverette')
+        self.assertNotContains(response, abbey_url,
+            msg_prefix='search for digital resources should not include abbey (internal dao only)')
+
+        # single-document search for a document without public daos
+        abbey_search_url = reverse('fa:singledoc-search', kwargs={'id': 'abbey244'})
+        with patch('findingaids.fa.views.paginate_queryset',
+                   wraps=paginate_queryset) as mockpaginate:
+            response = self.client.get(abbey_search_url, {'dao': 'on'})
+            # eXist is not searched
+            self.assertEqual([], mockpaginate.call_args[0][1])
+        self.assertContains(response, 'No matches found',
+            msg_prefix='document with only internal daos returns no matches for guest user')
+
+        self.client.login(username='marbl', password='marbl')
+        response = self.client.get(search_url, {'dao': 'on'})
+        self.assertContains(response, abbey_url,
+            msg_prefix='search for digital resources should include abbey (internal dao only)')
+        response = self.client.get(abbey_search_url, {'dao': 'on'})
+        self.assertContains(response, 'Resource available online',
+            msg_prefix='document with only internal daos returns matches for user with access')
+        CatalogEntry.objects.all().delete()
+        CatalogStatus.objects.all().delete()
+
+    def test_dao_search__partial_catalog(self):
+        # documents loaded before the catalog is reconciled should not
+        # limit dao filters to cataloged documents
+        CatalogEntry.update('abbey244')
+        search_url = reverse('fa:search')
+        leverette_url = reverse('fa:findingaid', kwargs={'id': 'leverette135'})
+        abbey_url = reverse('fa:findingaid', kwargs={'id': 'abbey244'})
+        response = self.client.get(search_url, {'dao': 'on'})
+        self.assertContains(response, leverette_url,
+            msg_prefix='search for digital resources should include uncataloged Leverette')
+        self.assertNotContains(response, abbey_url,
+            msg_prefix='search for digital resources should not include abbey (internal dao only)')
+
+        self.client.login(username='marbl', password='marbl')
+        response = self.client.get(search_url, {'dao': 'on'})
+        self.assertContains(response, abbey_url,
+            msg_prefix='search for digital resources should include cataloged abbey (internal dao only)')
+        self.assertContains(response, leverette_url,
+            msg_prefix='search for digital resources should include uncataloged Leverette')
+        CatalogEntry.objects.all().delete()
+
 
     def test_findingaid_match_count(self):
         # finding aid match_count field can only be tested via eXist return
@@ -73,5 +73,6 @@ urlpatterns = patterns(
     '',
     (r'^titles/', include(title_urlpatterns)),
     (r'^documents/', include(findingaid_urlpatterns)),
+    url(r'^search/suggest/$', fa_views.suggest, name='suggest'),
     url(r'^search/', fa_views.search, name='search')
 )
@@ -14,27 +14,42 @@
 #   See the License for the specific language governing permissions and
 #   limitations under the License.
 
+import base64
 from datetime import datetime
 from functools import wraps
+import glob
+import hashlib
 import logging
 from lxml import etree
 import os
 import re
 import subprocess
 import tempfile
+from urllib import quote, urlencode
+import urllib2
+import zlib
 
 from django import http
 from django.conf import settings
-from django.core.paginator import Paginator, InvalidPage, EmptyPage
+from django.core.cache import cache
+from django.core.urlresolvers import reverse
+from django.core.paginator import Paginator, Page, InvalidPage, EmptyPage, \
+    PageNotAnInteger
 from django.template import Context
 from django.template.loader import get_template
 from django.shortcuts import get_object_or_404
 
 from django.template import RequestContext
 
+from eulexistdb.db import ExistDB
 from eulexistdb.exceptions import DoesNotExist  # ReturnedMultiple needed also ?
+from eulexistdb.query import QuerySet
+from eulxml.xmlmap.eadmap import EAD_NAMESPACE
 
-from findingaids.fa.models import FindingAid, Deleted
+from findingaids import __version__
+from findingaids.fa import foppool
+from findingaids.fa.models import FindingAid, Deleted, CatalogEntry, \
+    CollectionWatermark, NavigationItem
 
 logger = logging.getLogger(__name__)
 
@@ -44,6 +59,24 @@ xhtml_xslfo_xslt = os.path.join(os.path.dirname(os.path.abspath(__file__)),
 XHTML_TO_XSLFO = etree.XSLT(etree.parse(xhtml_xslfo_xslt))
 
 
+def _xslfo_version():
+    # checksum of the application version, the stylesheet, and the templates
+    # and template tags used to render the full finding aid for the PDF
+    fa_dir = os.path.dirname(os.path.abspath(__file__))
+    sources = [xhtml_xslfo_xslt, os.path.join(fa_dir, 'templates', 'fa', 'full.html')] + \
+        sorted(glob.glob(os.path.join(fa_dir, 'templates', 'fa', 'snippets', '*.html'))) + \
+        sorted(glob.glob(os.path.join(fa_dir, 'templatetags', '*.py')))
+    checksum = hashlib.md5(__version__)
+    for filename in sources:
+        with open(filename) as source:
+            checksum.update(source.read())
+    return checksum.hexdigest()[:12]
+
+# version identifier for generated XSL-FO, for caching; changes when the
+# application version, the stylesheet, or the templates change
+XSLFO_VERSION = _xslfo_version()
+
+
 def render_to_pdf(template_src, context_dict, filename=None):
     """Generate and return a PDF response.
 
@@ -59,8 +92,45 @@ def render_to_pdf(template_src, context_dict, filename=None):
             and, if a filename was specified, a content-disposition header to
             prompt the browser to download the response as the filename specified
     """
+    return pdf_response(generate_pdf(template_src, context_dict), filename)
+
+
+def pdf_response(content, filename=None):
+    """Generate a PDF response for PDF content.
+
+    :param content: PDF content, as a string or an iterable (e.g., a file
+        wrapper for streaming a PDF file)
+    :param filename: optional filename, to specify to the browser in the response
+    :returns: :class:`django.http.HttpResponse`
+    """
+    response = http.HttpResponse(content, mimetype='application/pdf')
+    if filename:
+        response['Content-Disposition'] = "inline; filename=%s" % filename
+    return response
+
+
+def generate_pdf(template_src, context_dict):
+    """Generate a PDF from a template and template arguments, as for
+    :meth:`render_to_pdf`.
+
+    :param template_src: name of the template to render
+    :param context_dict: dictionary to pass to the template for rendering
+    :returns: PDF content as a string
+    :raises: Exception if the XSL-FO processor fails to generate the PDF
+    """
+    return xslfo_to_pdf(html_to_xslfo(template_src, context_dict))
+
+
+def xslfo_to_pdf(xslfo):
+    """Generate a PDF from XSL-FO with the configured XSL-FO processor,
+    using the worker pool if one is configured (see
+    :mod:`findingaids.fa.foppool`).
 
-    xslfo = html_to_xslfo(template_src, context_dict)
+    :param xslfo: XSL-FO as an :class:`lxml.etree.ElementTree`, e.g. as
+        returned by :meth:`html_to_xslfo`
+    :returns: PDF content as a string
+    :raises: Exception if the XSL-FO processor fails to generate the PDF
+    """
     tmpdir = tempfile.mkdtemp('findingaids-fop')
     # write xsl-fo to a temporary named file that we can pass to xsl-fo processor
     xslfo_file = tempfile.NamedTemporaryFile(prefix='findingaids-xslfo-', dir=tmpdir)
@@ -78,17 +148,8 @@ log4j.appender.CONSOLE.layout=org.apache.log4j.PatternLayout
 log4j.appender.CONSOLE.layout.ConversionPattern=%-5p %3x - %m%n
         ''')
     try:
-        # NOTE: for now, just sending errors to stdout
-        cmd_parts = [settings.XSLFO_PROCESSOR, xslfo_file.name, pdf_file.name]
-        logger.debug("Calling XSL-FO processor: %s" % ' '.join(cmd_parts))
-        rval = subprocess.call(cmd_parts, cwd=tmpdir)
-        if rval is 0:       # success!
-            response = http.HttpResponse(pdf_file.read(), mimetype='application/pdf')
-            if filename:
-                response['Content-Disposition'] = "inline; filename=%s" % filename
-            return response
-    except OSError, e:
-        logger.error("Apache Fop execution failed: %s" % e)
+        if run_xslfo_processor(xslfo_file.name, pdf_file.name, cwd=tmpdir):
+            return pdf_file.read()
     finally:
         # clean up tmp files
         os.unlink(log4j_prop)
@@ -107,23 +168,67 @@ log4j.appender.CONSOLE.layout.ConversionPattern=%-5p %3x - %m%n
     raise Exception("There was an error generating the PDF")
 
 
-def html_to_xslfo(template_src, context_dict):
-    """Takes a template and template arguments, renders the template to get html,
-    and then converts from html to XSL-FO.  Any template used with this function
-    should produce well-formed xhtml so it can be parsed as xml.
+def run_xslfo_processor(input_path, output_path, mode='pdf', cwd=None):
+    """Run the configured XSL-FO processor (Apache FOP) on a file, with the
+    worker pool if one is configured (see :mod:`findingaids.fa.foppool`), or
+    else by running the **XSLFO_PROCESSOR** command.
+
+    :param input_path: path to the input file
+    :param output_path: path where the output should be written
+    :param mode: one of 'pdf' (XSL-FO to PDF), 'if' (XSL-FO to the FOP
+        intermediate format), or 'ifin' (intermediate format to PDF)
+    :param cwd: working directory for the XSL-FO processor command
+    :returns: True if the processor succeeded
+    """
+    try:
+        if foppool.enabled():
+            # render with a persistent worker instead of starting a new JVM
+            logger.debug("Submitting %s to processor pool (%s)" % (input_path, mode))
+            foppool.render(input_path, output_path, mode)
+            return True
+        # NOTE: for now, just sending errors to stdout
+        if mode == 'if':
+            cmd_parts = [settings.XSLFO_PROCESSOR, '-fo', input_path,
+                         '-if', 'application/pdf', output_path]
+        elif mode == 'ifin':
+            cmd_parts = [settings.XSLFO_PROCESSOR, '-ifin', input_path,
+                         '-pdf', output_path]
+        else:
+            cmd_parts = [settings.XSLFO_PROCESSOR, input_path, output_path]
+        logger.debug("Calling XSL-FO processor: %s" % ' '.join(cmd_parts))
+        return subprocess.call(cmd_parts, cwd=cwd) == 0
+    except foppool.FopError, e:
+        logger.error("XSL-FO processor pool failed: %s" % e)
+    except OSError, e:
+        logger.error("Apache Fop execution failed: %s" % e)
+    return False
+
+
+def render_xhtml(template_src, context_dict):
+    """Render a template that produces well-formed xhtml and parse the result.
 
     :param template_src: name of the template to render
     :param context_dict: dictionary to pass to the template for rendering
-    :returns: result of generated html, converted to XSL-FO, as an instance of
-                :class:`lxml.etree.ElementTree`
+    :returns: :class:`lxml.etree._Element`
     """
     template = get_template(template_src)
-    xhtml = etree.fromstring(template.render(Context(context_dict)))
+    return etree.fromstring(template.render(Context(context_dict)))
+
+
+def xhtml_to_xslfo(xhtml, **params):
+    """Convert xhtml to XSL-FO with the site stylesheet.
+
+    :param xhtml: parsed xhtml, e.g. as returned by :meth:`render_xhtml`
+    :param params: any additional parameters to pass to the stylesheet
+        (e.g., the part of a split PDF; see :mod:`findingaids.fa.pdfsplit`)
+    :returns: :class:`lxml.etree.ElementTree`
+    """
     xsl_params = {
         'STATIC_ROOT': settings.STATIC_ROOT,
         'STATIC_URL': settings.STATIC_URL,
         'link_color': '#2e5299',   # match CSS for site
     }
+    xsl_params.update(params)
     if not xsl_params['STATIC_ROOT'].endswith('/'):
         xsl_params['STATIC_ROOT'] += '/'
     # string values need to be quoted to pass as xsl params
@@ -132,6 +237,19 @@ def html_to_xslfo(template_src, context_dict):
     return XHTML_TO_XSLFO(xhtml, **xsl_params)
 
 
+def html_to_xslfo(template_src, context_dict):
+    """Takes a template and template arguments, renders the template to get html,
+    and then converts from html to XSL-FO.  Any template used with this function
+    should produce well-formed xhtml so it can be parsed as xml.
+
+    :param template_src: name of the template to render
+    :param context_dict: dictionary to pass to the template for rendering
+    :returns: result of generated html, converted to XSL-FO, as an instance of
+                :class:`lxml.etree.ElementTree`
+    """
+    return xhtml_to_xslfo(render_xhtml(template_src, context_dict))
+
+
 def pages_to_show(paginator, page, page_labels={}):
     """Generate a dictionary of pages to show around the current page. Show
     3 numbers on either side of the specified page, or more if close to end or
@@ -160,7 +278,7 @@ def pages_to_show(paginator, page, page_labels={}):
 
     return show_pages
 
-def alpha_pagelabels(paginator, objects, label_attribute):
+def alpha_pagelabels(paginator, objects, label_attribute, all_labels=None):
     """Generate abbreviated, alphabetical page labels for pagination items.
     Label format should be something like 'Ab - Ad', 'Ard - Art'.
 
@@ -168,26 +286,36 @@ def alpha_pagelabels(paginator, objects, label_attribute):
     :param objects: the complete list of objects paginated by the paginator
     :param label_attribute: attribute on the object to use to generate
         page labels
+    :param all_labels: optional list of the label values for all of the
+        objects, in order (e.g., as returned by :meth:`field_values`); if
+        specified, labels are taken from this list instead of from
+        the individual objects
     :returns: dictionary appropriate for use with :meth:`pages_to_show`, keyed
         on page numbers
     """
     page_labels = {}
     labels = []
 
+    def get_label(index):
+        if all_labels is not None:
+            return unicode(all_labels[index])
+        return unicode(getattr(objects[index], label_attribute))
+
     if paginator.count <= 1:
         # if there is not enough content to paginate, bail out
         return page_labels
 
     # get all labels for start and end objects on each page
     for i in range(paginator.num_pages):
-        page = paginator.page(i+1)  # page is 1-based
+        # page boundaries only; don't retrieve page contents
+        page = Page([], i+1, paginator)  # page is 1-based
         # get objects at start & end of each page (index is also 1-based)
-        labels.append(unicode(getattr(objects[page.start_index()-1], label_attribute)))
+        labels.append(get_label(page.start_index()-1))
         # don't go beyond the end of the actual number of objects
         end_index = min(page.end_index()-1, paginator.count)
         # add end label only if not the same as first (e.g., page of a single item)
         if page.start_index() - 1 != end_index:
-            labels.append(unicode(getattr(objects[end_index], label_attribute)))
+            labels.append(get_label(end_index))
 
     # abbreviate labels so they are as short as possible but distinct from
     # preceding and following labels
@@ -223,6 +351,67 @@ def alpha_pagelabels(paginator, objects, label_attribute):
 
     return page_labels
 
+
+def fetch_results(qs, how_many=None):
+    """Retrieve items from an eXist :class:`~eulexistdb.query.QuerySet` in
+    order with a single query, rather than retrieving each item separately
+    as when iterating over the queryset.
+
+    :param qs: queryset, restricted to the fields needed with ``only``
+    :param how_many: maximum number of items to retrieve; if not specified,
+        all items are retrieved
+    :returns: list of items, initialized as the queryset return type
+    """
+    xquery = qs.query.getQuery()
+    result = ExistDB().query(xquery, how_many=how_many or 1000)
+    if how_many is None and result.hits > result.count:
+        # more results than retrieved in the first chunk; get them all
+        result = ExistDB().query(xquery, how_many=result.hits)
+    return [qs.return_type(node) for node in result.results]
+
+
+def field_values(qs, field, how_many):
+    """Retrieve the value of a single field for every item in an eXist
+    :class:`~eulexistdb.query.QuerySet`, in order, with a single query that
+    returns only that field, rather than retrieving each item separately.
+
+    :param qs: queryset; should not already be restricted with ``only``
+    :param field: name of the field to return
+    :param how_many: number of values to retrieve (e.g., the total count
+        for the queryset)
+    :returns: list of field values
+    """
+    return [getattr(item, field) for item in fetch_results(qs.only(field), how_many)]
+
+
+def cached_alpha_pagelabels(paginator, qs, label_attribute, key):
+    """Generate alphabetical page labels as :meth:`alpha_pagelabels`,
+    retrieving the labels for all items in a single query (see
+    :meth:`field_values`).  Page labels are cached based on the key and
+    pagination settings, and are refreshed when the collection watermark
+    changes (see :class:`~findingaids.fa.models.CollectionWatermark`), so
+    this should only be used for queries against the public collection.
+
+    :param paginator: a django paginator for the queryset
+    :param qs: eXist queryset, without any ``only`` fields
+    :param label_attribute: name of the field to use for page labels
+    :param key: string identifying the query, e.g. browse letter or
+        search terms
+    """
+    cache_key = CollectionWatermark.current().cache_key('alpha-pagelabels:%s' %
+        hashlib.md5((u'%s:%s:%d:%d' % (key, label_attribute, paginator.per_page,
+                                       paginator.orphans)).encode('utf-8')).hexdigest())
+    page_labels = cache.get(cache_key)
+    if page_labels is None:
+        all_labels = []
+        if paginator.count > 1:
+            all_labels = field_values(qs, label_attribute, paginator.count)
+        page_labels = alpha_pagelabels(paginator, qs, label_attribute,
+                                       all_labels=all_labels)
+        cache.set(cache_key, page_labels)  # use configured cache timeout
+    return page_labels
+
+
 def get_findingaid(eadid=None, preview=False, only=None, also=None, order_by=None,
         filter=None):
     """Retrieve a  :class:`~findingaids.fa.models.FindingAid` (or
@@ -265,59 +454,269 @@ def get_findingaid(eadid=None, preview=False, only=None, also=None, order_by=Non
     return fa
 
 
+def exist_document_path(eadid, preview=False):
+    """Get the full path in eXist (collection and document name) for the
+    stored EAD document with the specified eadid.  Uses the local catalog
+    (see :class:`~findingaids.fa.models.CatalogEntry`) when the catalog is
+    available and the document is cataloged; otherwise, retrieves the path
+    from eXist.  Raises a
+    :class:`django.http.Http404` if the document is not found.
+
+    :param eadid: eadid
+    :param preview: document is in the preview collection; defaults to False
+    :rtype: string
+    """
+    doc = None
+    if CatalogEntry.available(preview):
+        doc = CatalogEntry.find(eadid, preview)
+    if doc is None:
+        doc = get_findingaid(eadid, preview=preview,
+                             only=['document_name', 'collection_name'])
+    return '%s/%s' % (doc.collection_name.rstrip('/'), doc.document_name)
+
+
+def open_exist_document(path, indent=False):
+    """Open the stored content of an eXist document for reading, using the
+    eXist REST interface, so that large documents can be read in chunks
+    instead of being loaded into memory all at once.  Uses the configured
+    eXist url, credentials, and timeout.  Raises :class:`urllib2.URLError`
+    if the document could not be retrieved.
+
+    :param path: full path to the document in eXist, e.g. as returned by
+        :meth:`exist_document_path`
+    :param indent: request indented output from eXist; defaults to False
+    :returns: file-like object
+    """
+    url = '%s/rest%s?%s' % (settings.EXISTDB_SERVER_URL.rstrip('/'),
+                            quote(path.encode('utf-8')),
+                            urlencode({'_indent': 'yes' if indent else 'no'}))
+    request = urllib2.Request(url)
+    username = getattr(settings, 'EXISTDB_SERVER_USER', None)
+    if username:
+        credentials = '%s:%s' % (username,
+                                 getattr(settings, 'EXISTDB_SERVER_PASSWORD', ''))
+        request.add_header('Authorization',
+                           'Basic %s' % base64.b64encode(credentials))
+    opts = {}
+    if getattr(settings, 'EXISTDB_TIMEOUT', None):
+        opts['timeout'] = settings.EXISTDB_TIMEOUT
+    return urllib2.urlopen(request, **opts)
+
+
+def read_chunks(stream, chunk_size=64 * 1024):
+    """Generator that reads and yields the content of a file-like object in
+    chunks, closing it when all content has been read.
+
+    :param stream: file-like object
+    :param chunk_size: maximum size of each chunk, in bytes
+    """
+    try:
+        while True:
+            chunk = stream.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        stream.close()
+
+
+# same check used by django's GZipMiddleware
+accepts_gzip_re = re.compile(r'\bgzip\b')
+
+
+def accepts_gzip(request):
+    """Check if the client accepts gzip-encoded responses, based on the
+    request Accept-Encoding header."""
+    return bool(accepts_gzip_re.search(request.META.get('HTTP_ACCEPT_ENCODING', '')))
+
+
+def gzip_chunks(chunks):
+    """Generator that gzip-compresses a sequence of strings as they are
+    consumed, for use with streaming responses.
+
+    :param chunks: iterable of strings
+    """
+    # wbits offset of 16 generates gzip header and trailer
+    compressor = zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def ead_validators(request, id, preview=False):
+    """Get the values used for conditional processing of views based on a
+    single EAD document: the SHA-1 checksum and last modification time.
+    Values are taken from the local catalog (see
+    :class:`~findingaids.fa.models.CatalogEntry`) when the catalog is
+    available and the document is cataloged, and are otherwise retrieved
+    from eXist together in a single query.  Values are stored on the request, so that conditional view
+    processing and the view itself only look them up once per request.
+
+    :param id: eadid
+    :param preview: load document from preview collection; defaults to False
+    :returns: tuple of hash (string) and last modified
+        (:class:`datetime.datetime`)
+    """
+    validators = getattr(request, '_ead_validators', None)
+    if validators is None:
+        validators = {}
+        try:
+            request._ead_validators = validators
+        except AttributeError:
+            # not a request object; values will not be reused
+            pass
+
+    key = (id, bool(preview))
+    if key not in validators:
+        entry = None
+        if CatalogEntry.available(preview):
+            entry = CatalogEntry.find(id, preview)
+        if entry is not None:
+            validators[key] = (entry.hash,
+                               exist_datetime_with_timezone(entry.last_modified))
+        else:
+            fa = get_findingaid(id, preview=preview, only=['hash', 'last_modified'])
+            validators[key] = (fa.hash, exist_datetime_with_timezone(fa.last_modified))
+    return validators[key]
+
+
 def ead_lastmodified(request, id, preview=False, *args, **kwargs):
     """Get the last modification time for a finding aid in eXist by eadid.
     Used to generate last-modified header for views based on a single EAD document.
+    See :meth:`ead_validators`.
 
     :param id: eadid
     :param preview: load document from preview collection; defaults to False
     :rtype: :class:`datetime.datetime`
     """
-    # get document name last modified by eadid
-    fa = get_findingaid(id, preview=preview, only=['last_modified'])
-    return exist_datetime_with_timezone(fa.last_modified)
+    return ead_validators(request, id, preview)[1]
 
 
 def ead_etag(request, id, preview=False, *args, **kwargs):
     """Generate an Etag for an ead (specified by eadid) by requesting a SHA-1
     checksum of the entire EAD xml document from eXist.
+    See :meth:`ead_validators`.
 
     :param id: eadid
     :param preview: requested document is in the preview collection; defaults to False
     :rtype: string
     """
-    fa = get_findingaid(id, preview=preview, only=['hash'])
-    return fa.hash
+    return ead_validators(request, id, preview)[0]
+
+def eadxml_etag(request, id, preview=False, *args, **kwargs):
+    """Generate an Etag for the EAD XML response for a document: the same as
+    :meth:`ead_etag`, with a ``-gzip`` suffix when the response will be
+    gzip-encoded (see :meth:`accepts_gzip`), so that caches do not treat the
+    encoded and unencoded responses as the same entity.
+
+    :param id: eadid
+    :param preview: requested document is in the preview collection; defaults to False
+    :rtype: string
+    """
+    etag = ead_etag(request, id, preview)
+    if etag and accepts_gzip(request):
+        etag = '%s-gzip' % etag
+    return etag
 
 def collection_lastmodified(request, *args, **kwargs):
     """Get the last modification time for the entire finding aid collection.
     Used to generate last-modified header for views that are based on the entire
     collection (e.g., :meth:`~findingaids.fa.views.titles_by_letter` browse view,
-    :meth:`findingaids.fa.views.search` search view).
+    :meth:`findingaids.fa.views.search` search view).  Based on the
+    :class:`~findingaids.fa.models.CollectionWatermark`, which is updated
+    whenever a document is published or deleted.
 
     If no documents are found in eXist and there are no deleted records, no
     value is returned and django will not send a Last-Modified header.
     """
-    fa_last = None
-    # most recently modified document in the eXist collection
-    fa = FindingAid.objects.order_by('-last_modified').only('last_modified')
-    if fa .count():
-        fa_last = fa[0].last_modified
-    # most recently deleted document from sql DB
-    deleted = Deleted.objects.order_by('-date').all()
-    if deleted.exists():
-        deleted_last = deleted[0].date
-        # get most recent of the two
-        if fa_last is None or deleted_last > fa_last:
-            fa_last = deleted_last
+    fa_last = CollectionWatermark.current().modified
     if fa_last is not None:
         # NOTE: potentially using configured exist TZ for non-eXist date...
         return exist_datetime_with_timezone(fa_last)
 
+
+def collection_etag(request, *args, **kwargs):
+    """Generate an Etag for views based on the entire finding aid collection,
+    from the version number of the
+    :class:`~findingaids.fa.models.CollectionWatermark`.
+
+    :rtype: string
+    """
+    return 'collection-%d' % CollectionWatermark.current().version
+
 # object pagination - adapted directly from django paginator documentation
-def paginate_queryset(request, qs, per_page=10, orphans=0):    # 0 is django default
+class ExistPaginator(Paginator):
+    """Paginator for eXist :class:`~eulexistdb.query.QuerySet` results.
+    Retrieves the total number of results and the items for the requested
+    page with a single XQuery, instead of the separate count query and
+    per-item retrieval done when a queryset is used with the default
+    django :class:`~django.core.paginator.Paginator`.  The total count is
+    not available until a page has been requested.
+
+    Queryset items are initialized from the constructed return, so the
+    queryset should be restricted to the fields needed with ``only``.
+
+    If ``max_count`` is specified, only that many results are paginated;
+    the full number of results is available as :attr:`total_count`.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.max_count = kwargs.pop('max_count', None)
+        super(ExistPaginator, self).__init__(*args, **kwargs)
+        self._windows = {}
+        #: number of eXist queries run by this paginator
+        self.query_count = 0
+        #: total number of results, including any beyond max_count
+        self.total_count = None
+
+    def _fetch(self, number):
+        # retrieve results for a page, with enough extra items to include
+        # orphans if this turns out to be the last page
+        start = (number - 1) * self.per_page
+        options = {}
+        if self.object_list._highlight_matches:
+            # same keyword highlighting as queryset retrieval
+            options['highlight-matches'] = 'elements'
+        result = self.object_list._db.query(self.object_list.query.getQuery(),
+                                            start=start + 1,
+                                            how_many=self.per_page + self.orphans,
+                                            **options)
+        self.query_count += 1
+        self.total_count = result.hits
+        self._count = result.hits
+        if self.max_count is not None:
+            self._count = min(self._count, self.max_count)
+        self._windows[number] = [self.object_list.return_type(node)
+                                 for node in result.results]
+
+    def page(self, number):
+        try:
+            number = int(number)
+        except (TypeError, ValueError):
+            raise PageNotAnInteger('That page number is not an integer')
+        if number < 1:
+            raise EmptyPage('That page number is less than 1')
+        if number not in self._windows:
+            self._fetch(number)
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        top = bottom + self.per_page
+        if top + self.orphans >= self.count:
+            top = self.count
+        return Page(self._windows[number][:top - bottom], number, self)
+
+
+def paginate_queryset(request, qs, per_page=10, orphans=0, max_count=None):    # 0 is django default
     # FIXME: should num-per-page be configurable via local settings?
-    paginator = Paginator(qs, per_page, orphans=orphans)
+    if isinstance(qs, QuerySet):
+        # retrieve count and current page from eXist in a single query
+        paginator = ExistPaginator(qs, per_page, orphans=orphans, max_count=max_count)
+    else:
+        if max_count is not None:
+            qs = qs[:max_count]
+        paginator = Paginator(qs, per_page, orphans=orphans)
     # Make sure page request is an int. If not, deliver first page.
     try:
         page = int(request.GET.get('page', '1'))
@@ -331,6 +730,10 @@ def paginate_queryset(request, qs, per_page=10, orphans=0):    # 0 is django def
     except EmptyPage:       # ??
         paginated_qs = paginator.page(paginator.num_pages)
 
+    if isinstance(paginator, ExistPaginator):
+        logger.debug('Retrieved page %d of %d results with %d eXist quer%s' %
+                     (paginated_qs.number, paginator.count, paginator.query_count,
+                      'y' if paginator.query_count == 1 else 'ies'))
     return paginated_qs, paginator
 
 def ead_gone_or_404(view_method):
@@ -374,3 +777,199 @@ def exist_datetime_with_timezone(dt):
                     dt.second, dt.microsecond, tz)
 
 
+# series link trees, used by the document views and for the full finding aid
+
+# namespaced component tag names, with corresponding series level
+C_LEVELS = {
+    '{%s}c01' % EAD_NAMESPACE: 1,
+    '{%s}c02' % EAD_NAMESPACE: 2,
+    '{%s}c03' % EAD_NAMESPACE: 3,
+}
+
+
+def series_url(eadid, series_id, *ids, **extra_opts):
+    """
+    Generate a series or subseries url when given an eadid and list of series ids.
+    Requires at least ead document id and top-level series id.  Number of additional
+    series ids provided determines type of series url generated.
+
+    Default url callback for :meth:`format_links`.
+    """
+    # common args for generating all urls
+    args = {'id': eadid, 'series_id': series_id}
+
+    if len(ids) == 0:       # no additional args
+        view_name = 'series-or-index'
+    if len(ids) >= 1:       # add subseries id arg if one specified (used for sub and sub-subseries)
+        args['series2_id'] = ids[0]
+        view_name = 'series2'
+    if len(ids) == 2:       # add sub-subseries id arg if specified
+        args['series3_id'] = ids[1]
+        view_name = 'series3'
+
+    if 'preview' in extra_opts and extra_opts['preview'] is True:
+        view_namespace = 'fa-admin:preview'
+    else:
+        view_namespace = 'fa'
+
+    return reverse('%s:%s' % (view_namespace, view_name), kwargs=args)
+
+
+def series_anchor(*ids, **extra_opts):
+    """Generate a same-page id-based anchor link for a series.
+
+    Used as url callback for :meth:`format_links` for generating a single-page
+    version of the full finding aid (see :meth:`full_findingaid_args`).
+    """
+    # only actually use the last of all ids passed in
+    return "#%s" % ids[-1]
+
+
+def _link_tree_item(component_id, short_id, label, level, children):
+    # single entry in a series link tree; see document_link_tree
+    return {'id': component_id, 'short_id': short_id, 'label': label,
+            'level': level, 'rel': 'section' if level == 1 else 'subsection',
+            'children': children}
+
+
+def component_link_tree(series):
+    """Build a series link tree (see :meth:`document_link_tree`) for the
+    subseries of a :class:`~findingaids.fa.models.Series` or all series
+    in the dsc of a document, by walking the EAD xml.  Series are selected
+    with the same rules as stored navigation (see
+    :meth:`~findingaids.fa.models.NavigationItem.series_tree`).
+    """
+    if not ((hasattr(series, 'hasSubseries') and series.hasSubseries()) or
+            (hasattr(series, 'hasSeries') and series.hasSeries())):
+        return []
+
+    def items_for(tree):
+        return [_link_tree_item(component.id, component.short_id,
+                                component.display_label(), level,
+                                items_for(subseries))
+                for component, level, subseries in tree]
+
+    # the dsc is level 0; subseries are one level below their series
+    level = C_LEVELS.get(series.node.tag, 0) + 1
+    return items_for(NavigationItem.series_tree(series.c, level))
+
+
+def navigation_link_tree(navigation):
+    """Build a series link tree (see :meth:`document_link_tree`) from stored
+    :class:`~findingaids.fa.models.NavigationItem` objects for a document.
+    """
+    # group series by parent id (top-level series have no parent)
+    children = {}
+    for item in navigation:
+        if not item.is_index:
+            children.setdefault(item.parent, []).append(item)
+
+    def items_for(parent):
+        return [_link_tree_item(item.component_id, item.short_id, item.label,
+                                item.level, items_for(item.component_id))
+                for item in children.get(parent, [])]
+
+    return items_for('')
+
+
+def document_link_tree(eadid, hash, preview=False, ead=None):
+    """Get the series link tree for a document: a nested list of
+    dictionaries with component id, short id, display label, level, RDFa
+    rel, and a list of children for every series and subseries, with no
+    urls or keyword-specific information, so it can be formatted as links
+    for any view with :meth:`format_links`.
+
+    The tree is generated from stored navigation if available, or else from
+    the dsc of the document, if passed in, and is cached by eadid, document
+    hash, and preview mode.
+
+    :param eadid: eadid for the document
+    :param hash: eXist SHA-1 hash of the current version of the document
+    :param preview: boolean indicating preview mode
+    :param ead: optional :class:`~findingaids.fa.models.FindingAid` for the
+        full document, used when no navigation is stored
+    :returns: list, or None if no navigation is stored and no document
+        is passed in
+    """
+    cache_key = 'series-links:%s:%s:%s' % (eadid, hash,
+                                            'preview' if preview else 'published')
+    tree = cache.get(cache_key) if hash else None
+    if tree is None:
+        navigation = NavigationItem.for_document(eadid, preview)
+        if navigation:
+            tree = navigation_link_tree(navigation)
+        elif ead is not None:
+            tree = component_link_tree(ead.dsc)
+        else:
+            return None
+        if hash:
+            cache.set(cache_key, tree)   # use configured default cache timeout
+    return tree
+
+
+def format_links(tree, url_ids, url_callback=series_url, preview=False,
+                 url_params='', match_counts=None):
+    """Format a series link tree (see :meth:`document_link_tree`) as a
+    nested list of links to series and subseries, for display in templates.
+    Note that the list elements include ``<a href="...">`` tags, so the output
+    should not be escaped in the template where it is rendered.
+
+    :param tree: list of series link tree items
+    :param url_ids: list of ids for generating urls (i.e., the eadid and any
+        parent series short ids)
+    :param url_callback: method to use for generating the series url
+    :param preview: boolean; when True, links will be generated for preview urls.
+    :param url_params: optional string to add to the end of urls (e.g., for search
+            term highlighting)
+    :param match_counts: optional dictionary of component id to number of
+        keyword matches, to be displayed with the links
+    """
+    links = []
+    for item in tree:
+        # get match count for each series / subseries and append it to the link if > 0
+        count = match_counts.get(item['id'], 0) if match_counts else 0
+        if count > 0:
+            plural = "es" if count > 1 else ""
+            match_count = "<span class='exist-match'>%s match%s</span>" % (count, plural)
+        else:
+            match_count = ""
+
+        current_url_ids = url_ids + [item['short_id']]
+        rel = item['rel']
+        # don't include preview/keyword arg urls in RDFa rel
+        if not url_params and not preview:
+            rel += ' dcterms:hasPart'
+
+        text = "<a href='%(url)s%(url_params)s' rel='%(rel)s'>%(linktext)s</a> %(match_count)s" % \
+            {'url': url_callback(preview=preview, *current_url_ids),
+             'url_params': url_params,
+             'rel': rel,
+             'linktext': item['label'], 'match_count': match_count}
+        links.append(text)
+        if item['children']:
+            links.append(format_links(item['children'], current_url_ids,
+                                      url_callback=url_callback, preview=preview,
+                                      url_params=url_params,
+                                      match_counts=match_counts))
+    return links
+
+
+def full_findingaid_args(fa, hash, mode, preview=False, request=None):
+    """Template arguments for displaying the full contents of a finding aid
+    with the **fa/full.html** template.
+
+    :param fa: :class:`~findingaids.fa.models.FindingAid` for the full document
+    :param hash: eXist SHA-1 hash of the document
+    :param mode: display mode (see :meth:`findingaids.fa.views.full_findingaid`)
+    :param preview: boolean indicating preview mode
+    :param request: current request, if any
+    """
+    link_tree = document_link_tree(fa.eadid.value, hash, preview, ead=fa)
+    series = format_links(link_tree, [fa.eadid.value],
+                          url_callback=series_anchor, preview=preview)
+    return {'ead': fa, 'series': series,
+            'mode': mode, 'preview': preview, 'request': request,
+            # normally supplied by context processor
+            'DEFAULT_DAO_LINK_TEXT': getattr(settings, 'DEFAULT_DAO_LINK_TEXT',
+                                             '[Resource available online]')
+            }
@@ -14,29 +14,45 @@
 #   See the License for the specific language governing permissions and
 #   limitations under the License.
 
+import hashlib
+import json
 import logging
 from lxml import etree
 from urllib import urlencode
+import urllib2
 
-from django.http import HttpResponse, Http404, HttpResponsePermanentRedirect
+from django.http import HttpResponse, Http404, HttpResponsePermanentRedirect, \
+    StreamingHttpResponse
 from django.conf import settings
 from django.contrib import messages
+from django.core.cache import cache
 from django.core.urlresolvers import reverse
 from django.shortcuts import render_to_response
 from django.template import RequestContext
+from django.utils.cache import patch_vary_headers, patch_cache_control
 from django.views.decorators.http import condition
 
 from eulcommon.djangoextras.http import content_negotiation
 from eulexistdb.db import ExistDBException, ExistDBTimeout
 from eulexistdb.exceptions import DoesNotExist  # ReturnedMultiple needed also ?
+from eulxml.xmlmap import load_xmlobject_from_string
 from eulxml.xmlmap.eadmap import EAD_NAMESPACE
 
 from findingaids.fa.models import FindingAid, Series, Series2, Series3, \
-    FileComponent, title_letters, Index, shortform_id
-from findingaids.fa.forms import KeywordSearchForm, AdvancedSearchForm
-from findingaids.fa.utils import render_to_pdf, get_findingaid, pages_to_show, \
-    ead_lastmodified, ead_etag, paginate_queryset, ead_gone_or_404, \
-    collection_lastmodified, alpha_pagelabels, html_to_xslfo
+    FileComponent, title_letters, Index, shortform_id, NavigationItem, \
+    SeriesOrIndex, BrowseTitle, HighlightSummary, CatalogEntry
+from findingaids.fa.forms import KeywordSearchForm, AdvancedSearchForm, \
+    QUERY_ERROR_MESSAGE
+from findingaids.fa import autocomplete, pagecache, pdfqueue, pdfsplit, pdfstore, \
+    searchcache
+from findingaids.fa.querysyntax import parse_query
+from findingaids.fa.utils import pdf_response, \
+    get_findingaid, pages_to_show, \
+    ead_lastmodified, ead_etag, eadxml_etag, ead_validators, paginate_queryset, ead_gone_or_404, \
+    collection_lastmodified, collection_etag, alpha_pagelabels, cached_alpha_pagelabels, \
+    fetch_results, exist_document_path, open_exist_document, \
+    read_chunks, accepts_gzip, gzip_chunks, C_LEVELS, series_url, component_link_tree, \
+    document_link_tree, format_links, full_findingaid_args
 
 logger = logging.getLogger(__name__)
 
@@ -49,6 +65,15 @@ fa_listfields = ['eadid', 'list_title', 'archdesc__did']
 # and FindingAid.abstract
 
 
+series_ead_fields = ['ead__eadid', 'ead__title', 'ead__unittitle',
+                     'ead__archdesc__origination',
+                     'ead__archdesc__controlaccess__head', 'ead__dsc__head',
+                     'ead__origination_name',
+                     'ead__repository',  # needed to determine if requestable
+                     'ead__collection_id']
+"List of finding aid fields that should be returned with a series or index."
+
+
 RDFA_NAMESPACES = {
     'schema': 'http://schema.org/',
     'dcmitype': 'http://purl.org/dc/dcmitype/',
@@ -56,6 +81,8 @@ RDFA_NAMESPACES = {
     'bibo': 'http://purl.org/ontology/bibo/',
 }
 
+EXIST_MATCH = '{http://exist.sourceforge.net/NS/exist}match'
+
 
 def site_index(request):
     "Site home page.  Currently includes browse letter links."
@@ -70,33 +97,45 @@ def browse_titles(request):
                               context_instance=RequestContext(request))
 
 
-@condition(last_modified_func=collection_lastmodified)
+@condition(etag_func=collection_etag, last_modified_func=collection_lastmodified)
 def titles_by_letter(request, letter):
     """Paginated list of finding aids by first letter in list title.
     Includes list of browse first-letters as in :meth:`browse_titles`.
+    Uses the local browse titles (see :class:`~findingaids.fa.models.BrowseTitle`)
+    when available, so that eXist is not queried.
     """
 
-    # set last browse letter and page in session
+    # last browse letter and page, saved in browser session storage
+    # by the results page for a link back from document pages
     page = request.REQUEST.get('page', 1)
     last_search = "%s?page=%s" % (reverse("fa:titles-by-letter", kwargs={'letter': letter}), page)
     last_search = {"url": last_search, "txt": "Return to Browse Results"}
-    request.session['last_search'] = last_search
-    request.session.set_expiry(0)  # set to expire when browser closes
 
-    # using ~ to do case-insensitive ordering
-    fa = FindingAid.objects.filter(list_title__startswith=letter).order_by('~list_title').only(*fa_listfields)
-    fa_subset, paginator = paginate_queryset(request, fa, per_page=10, orphans=5)
-    page_labels = alpha_pagelabels(paginator, fa, label_attribute='list_title')
+    if BrowseTitle.available():
+        # use locally stored browse titles instead of querying eXist
+        titles = BrowseTitle.objects.filter(first_letter=letter)
+        fa_subset, paginator = paginate_queryset(request, titles, per_page=10, orphans=5)
+        page_labels = alpha_pagelabels(paginator, titles, 'list_title',
+            all_labels=list(titles.values_list('list_title', flat=True)))
+        fa_subset.object_list = [t.findingaid for t in fa_subset.object_list]
+    else:
+        # using ~ to do case-insensitive ordering
+        browse_fa = FindingAid.objects.filter(list_title__startswith=letter).order_by('~list_title')
+        fa = browse_fa.only(*fa_listfields)
+        fa_subset, paginator = paginate_queryset(request, fa, per_page=10, orphans=5)
+        # retrieve all titles for page labels in a single query
+        page_labels = cached_alpha_pagelabels(paginator, browse_fa, 'list_title',
+                                              key='browse:%s' % letter)
     # No longer restricting the number of page labels shown using pages_to_show (like we do for numeric pages).
     # That doesn't make sense here, since the alpha range labels should ideally allow anyone to jump directly
     # to the section they want based on the labels.
 
     response_context = {
         'findingaids': fa_subset,
-        'querytime': [fa.queryTime()],
         'letters': title_letters(),
         'current_letter': letter,
         'show_pages': page_labels,
+        'last_search': last_search,
     }
     if page_labels:
         response_context['title_range'] = page_labels[fa_subset.number]
@@ -110,7 +149,7 @@ def titles_by_letter(request, letter):
                               context_instance=RequestContext(request))
 
 
-@condition(last_modified_func=collection_lastmodified)
+@condition(etag_func=collection_etag, last_modified_func=collection_lastmodified)
 def xml_titles(request):
     """List all findingaids in the database and link to the EAD xml,
     as a simple way to make content available for harvesting.
@@ -128,16 +167,37 @@ def xml_titles(request):
 
 
 @ead_gone_or_404
-@condition(etag_func=ead_etag, last_modified_func=ead_lastmodified)
+@condition(etag_func=eadxml_etag, last_modified_func=ead_lastmodified)
 def eadxml(request, id, preview=False):
-    """Display the full EAD XML content of a finding aid.
+    """Display the full EAD XML content of a finding aid.  The stored
+    document is streamed from eXist in chunks rather than loaded into memory,
+    and is gzip-compressed if the client accepts it (with a distinct ETag,
+    see :meth:`~findingaids.fa.utils.eadxml_etag`).  XML is indented only
+    if requested with a **pretty** url parameter (e.g., ``?pretty=1``).
 
     :param id: eadid for the document to be displayed
     :param preview: boolean indicating preview mode, defaults to False
     """
-    fa = get_findingaid(id, preview=preview)
-    xml_ead = fa.serialize(pretty=True)
-    return HttpResponse(xml_ead, mimetype='application/xml')
+    pretty = request.GET.get('pretty', None)
+    pretty = pretty is not None and pretty.lower() not in ['0', 'false', 'no']
+    path = exist_document_path(id, preview=preview)
+    try:
+        content = read_chunks(open_exist_document(path, indent=pretty))
+    except urllib2.URLError, e:
+        # if the document can't be streamed, load and serialize it as before
+        logger.warn('Error streaming %s from eXist: %s' % (path, e))
+        fa = get_findingaid(id, preview=preview)
+        content = [fa.serialize(pretty=pretty)]
+
+    gzip = accepts_gzip(request)
+    if gzip:
+        content = gzip_chunks(content)
+    response = StreamingHttpResponse(content, content_type='application/xml')
+    if gzip:
+        response['Content-Encoding'] = 'gzip'
+    # also served from the main document url by content negotiation
+    patch_vary_headers(response, ['Accept', 'Accept-Encoding'])
+    return response
 
 
 @ead_gone_or_404
@@ -157,10 +217,35 @@ def findingaid(request, id, preview=False):
     else:
         url_params = ''
         filter = {}
+
+    # rendered page depends only on the version of the document and the
+    # url parameters, unless there is user or session-specific content
+    # NOTE: hash and last modified are stored on the request by conditional
+    # view processing, so this does not query eXist again
+    hash, last_modified = ead_validators(request, id, preview)
+    cache_key = None
+    if pagecache.cacheable(request):
+        cache_key = pagecache.page_key(request, id, hash, preview)
+        content = pagecache.get_page(cache_key, id)
+        if content is not None:
+            response = HttpResponse(content)
+            _patch_document_headers(request, response, vary=['Accept'])
+            return response
+
     fa = get_findingaid(id, preview=preview, filter=filter)
-    last_modified = ead_lastmodified(request, id, preview)
-    series = _subseries_links(fa.dsc, url_ids=[fa.eadid], preview=preview,
-                              url_params=url_params)
+    navigation = NavigationItem.for_document(fa.eadid.value, preview)
+    if navigation:
+        # use navigation stored when the document was loaded
+        all_indexes = [n for n in navigation if n.is_index]
+    else:
+        all_indexes = [NavigationItem.from_component(index, fa.eadid.value,
+                                                     preview=preview)
+                       for index in fa.archdesc.index]
+    # highlighted links require keyword match counts from the document
+    link_tree = document_link_tree(fa.eadid.value, hash, preview, ead=fa)
+    match_counts = _match_counts(fa.node) if filter else None
+    series = format_links(link_tree, [fa.eadid.value], preview=preview,
+                          url_params=url_params, match_counts=match_counts)
 
     extra_ns = RDFA_NAMESPACES.copy()
     # add any non-default namespaces from the EAD document
@@ -169,11 +254,10 @@ def findingaid(request, id, preview=False):
     context = {
         'ead': fa,
         'series': series,
-        'all_indexes': fa.archdesc.index,
+        'all_indexes': all_indexes,
         'preview': preview,
         'url_params': url_params,
         'docsearch_form': KeywordSearchForm(),
-        'last_search': request.session.get('last_search', None),
         'feedback_opts': _get_feedback_options(request, id),
         'extra_ns': extra_ns,
         'last_modified': last_modified,
@@ -181,46 +265,93 @@ def findingaid(request, id, preview=False):
 
     # provide series list without keyword params to use in RDFa uris
     if url_params and not preview:
-        context['series_noparam'] = _subseries_links(fa.dsc, url_ids=[fa.eadid])
+        context['series_noparam'] = format_links(link_tree, [fa.eadid.value])
 
     response = render_to_response('fa/findingaid.html', context,
         context_instance=RequestContext(request, current_app='preview'))
-    # Set Cache-Control to private when there is a last_search
-    if "last_search" in request.session:
-        response['Cache-Control'] = 'private'
-
+    if cache_key is not None:
+        pagecache.set_page(cache_key, id, response.content)
+    _patch_document_headers(request, response, vary=['Accept'])
     return response
 
 
+def _patch_document_headers(request, response, vary=[]):
+    '''Set caching headers for a single-document page.  Pages can be stored
+    by shared caches unless they include user-specific content (see
+    :meth:`findingaids.fa.pagecache.cacheable`).  The link back to the
+    last search or browse results is added by javascript from browser
+    session storage, so it does not affect caching.
+
+    :param vary: list of additional request headers that the response
+        depends on
+    '''
+    if pagecache.cacheable(request):
+        patch_cache_control(response, public=True)
+    else:
+        patch_cache_control(response, private=True)
+    # logged in users see additional content
+    patch_vary_headers(response, ['Cookie'] + vary)
+
+
 @ead_gone_or_404
 @condition(etag_func=ead_etag, last_modified_func=ead_lastmodified)
 def full_findingaid(request, id, mode, preview=False):
     """View the full contents of a single finding aid as PDF or plain html.
 
+    Published PDFs are served from the PDF store when available (see
+    :mod:`findingaids.fa.pdfstore`); otherwise the PDF is generated, and
+    stored for subsequent requests.  PDF generation goes through the
+    render queue (see :mod:`findingaids.fa.pdfqueue`), so concurrent
+    requests for the same document share a single render; if the queue is
+    full, responds with a 503 and a Retry-After header.  PDFs and the
+    XSL-FO view use cached XSL-FO when available (see
+    :meth:`findingaids.fa.pdfstore.full_findingaid_xslfo`).
+
     :param id: eadid for the document to be displayed
     :param mode: one of 'html' or 'pdf' - note that the html mode is not publicly
             linked anywhere, and is intended mostly for development and testing
             of the PDF display
     :param preview: boolean indicating preview mode, defaults to False
     """
-    fa = get_findingaid(id, preview=preview)
-    series = _subseries_links(fa.dsc, url_ids=[fa.eadid], url_callback=_series_anchor, preview=preview)
-
-    template = 'fa/full.html'
-    template_args = {'ead': fa, 'series': series,
-                     'mode': mode, 'preview': preview, 'request': request,
-                     # normally supplied by context processor
-                     'DEFAULT_DAO_LINK_TEXT': getattr(settings, 'DEFAULT_DAO_LINK_TEXT',
-                                                      '[Resource available online]')
-                     }
-    if mode == 'html':
-        return render_to_response(template, template_args)
-    elif mode == 'pdf':
-        return render_to_pdf(template, template_args, filename='%s.pdf' % fa.eadid.value)
-    elif mode == 'xsl-fo':
-        xslfo = html_to_xslfo(template, template_args)
+    hash = ead_etag(request, id, preview)
+    if mode == 'pdf':
+        filename = '%s.pdf' % id
+        use_store = not preview and pdfstore.enabled()
+        if use_store:
+            pdf_path = pdfstore.get(id, hash)
+            if pdf_path is not None:
+                return pdfstore.serve(pdf_path, filename=filename)
+
+        def render():
+            # load the document and generate XSL-FO (unless cached) only
+            # once for all requests sharing the render
+            xslfo = pdfstore.full_findingaid_xslfo(id, hash, preview, request, parts=True)
+            pdf = pdfsplit.render_pdf(xslfo)
+            pdf_path = pdfstore.store(id, hash, pdf) if use_store else None
+            return pdf, pdf_path
+
+        try:
+            pdf, pdf_path = pdfqueue.render((id, hash, preview), render)
+        except pdfqueue.QueueFull, e:
+            logger.warn('Not generating PDF for %s: %s' % (id, e))
+            response = render_to_response('fa/pdf_busy.html',
+                                          {'eadid': id, 'preview': preview},
+                                          context_instance=RequestContext(request))
+            response.status_code = 503
+            response['Retry-After'] = pdfqueue.get_config()['RETRY_AFTER']
+            return response
+        if pdf_path is not None:
+            return pdfstore.serve(pdf_path, filename=filename)
+        return pdf_response(pdf, filename=filename)
+
+    if mode == 'xsl-fo':
+        xslfo = pdfstore.full_findingaid_xslfo(id, hash, preview, request)
         return HttpResponse(etree.tostring(xslfo), mimetype='application/xml')
 
+    fa = get_findingaid(id, preview=preview)
+    return render_to_response('fa/full.html', full_findingaid_args(fa, hash, mode,
+                                                                  preview, request))
+
 
 @condition(etag_func=ead_etag, last_modified_func=ead_lastmodified)
 def series_or_index(request, id, series_id, series2_id=None,
@@ -285,75 +416,49 @@ def _view_series(request, eadid, *series_ids, **kwargs):
 
         logger.info('''Redirecting from long-form series/index %s url to short-form url. %s'''
                     % (request.path, referrer))
-        return HttpResponsePermanentRedirect(_series_url(eadid, *redirect_ids))
-
-    # build initial series and index filters and field lists
-    filter_list = {'ead__eadid': eadid}
-    series_fields = ['id', 'level', 'did__unitid', 'did__unittitle']
-    index_fields = ['id', 'head']
-
-    # info needed to construct navigation links within this ead
-    # - summary info for all top-level series in this finding aid
-    all_series = Series.objects.filter(**filter_list).using(collection)
-    # - summary info for any indexes
-    all_indexes = Index.objects.filter(**filter_list).using(collection)
+        return HttpResponsePermanentRedirect(series_url(eadid, *redirect_ids))
 
     if 'keywords' in request.GET:
         search_terms = request.GET['keywords']
         url_params = '?' + urlencode({'keywords': search_terms.encode('utf-8')})
         #filter further based on highlighting
         filter = {'highlight': search_terms}
-        # add highlighting & match counts to series & index lists for navigation links
-        all_series = all_series.filter(**filter)
-        all_indexes = all_indexes.filter(**filter)
-        series_fields.append('match_count')
-        index_fields.append('match_count')
-
     else:
         url_params = ''
         filter = {}
     # get the item to be displayed (series, subseries, index)
     result = _get_series_or_index(eadid, *series_ids, filter=filter, use_collection=collection)
 
+    # use partial ead retrieved with main item for top-level display
+    ead = result.ead
+    query_times = [result.queryTime()]
+
     if 'keywords' in request.GET:
-        # when full-text highlighting is enabled, ead must be retrieved separately
-        # in order to retrieve match counts for main page ToC items
-
-        # fields needed for top-level display (some redundancy with list in _get_series_or_index)
-        return_fields = ['eadid', 'title', 'archdesc__controlaccess__head',
-                         'archdesc__origination',
-                         'dsc__head', 'archdesc__did']
-        fa = FindingAid.objects.filter(eadid=eadid).filter(**filter).using(collection)
-        # using raw xpaths for exist-specific logic to expand and count matches
-        ead = fa.only(*return_fields) \
-                .only_raw(coll_desc_matches=FindingAid.coll_desc_matches_xpath,
-                          admin_info_matches=FindingAid.admin_info_matches_xpath,
-                          archdesc__controlaccess__match_count=FindingAid.controlaccess_matches_xpath) \
-                .using(collection).get()
+        # when full-text highlighting is enabled, match counts for main page
+        # ToC items and all series and indexes are retrieved together
+        highlight_summary = _highlight_summary(eadid, search_terms,
+            ead_etag(request, eadid, preview_mode), collection)
+        if hasattr(highlight_summary, 'queryTime'):
+            query_times.append(highlight_summary.queryTime())
+        nav_match_counts = highlight_summary.component_matches
     else:
-        # when no highlighting, get ead retrieved with main item
-        fa = FindingAid.objects.filter(eadid=eadid).using(collection)
-        # when no highlighting, use partial ead retrieved with main item
-        ead = result.ead
+        highlight_summary = None
+        nav_match_counts = None
 
-    # info needed to construct navigation links within this ead
-    # - summary info for all top-level series in this finding aid
-    all_series = all_series.only(*series_fields).all()
-    # - summary info for any indexes
-    all_indexes = all_indexes.only(*index_fields).all()
+    # info needed to construct navigation links within this ead:
+    # summary info for all top-level series and any indexes
+    all_series, all_indexes, nav_query_times = _navigation(eadid, preview_mode,
+        collection, nav_match_counts)
+    query_times.extend(nav_query_times)
 
     #find index of requested object so next and prev can be determined
     index = 0
     for i, s in enumerate(all_series):
-        if(s.id == result.id):
+        if(s.component_id == result.id):
             index = i
     prev = index - 1
     next = index + 1
 
-    query_times = [result.queryTime(), all_series.queryTime(), all_indexes.queryTime()]
-    if hasattr(ead, 'queryTime'):
-        query_times.append(ead.queryTime())
-
     extra_ns = RDFA_NAMESPACES.copy()
     # add any non-default namespaces from the EAD document
     extra_ns.update(dict((prefix, ns) for prefix, ns in ead.node.nsmap.iteritems()
@@ -361,15 +466,15 @@ def _view_series(request, eadid, *series_ids, **kwargs):
 
     render_opts = {
         'ead': ead,
+        'highlight_summary': highlight_summary,
         'all_series': all_series,
         'all_indexes': all_indexes,
         'querytime': query_times,
         'prev': prev,
         'next': next,
         'url_params': url_params,
-        'canonical_url': _series_url(eadid, *[shortform_id(id) for id in series_ids]),
+        'canonical_url': series_url(eadid, *[shortform_id(id) for id in series_ids]),
         'docsearch_form': KeywordSearchForm(),
-        'last_search': request.session.get('last_search', None),
         'feedback_opts': _get_feedback_options(request, eadid),
         'extra_ns': extra_ns,
         'last_modified': ead_lastmodified(request, eadid, preview_mode)
@@ -381,21 +486,32 @@ def _view_series(request, eadid, *series_ids, **kwargs):
         render_opts['index'] = result
     else:
         render_opts['series'] = result
-        render_opts['subseries'] = _subseries_links(result, preview=preview_mode, url_params=url_params)
+        # use the cached link tree for the document when available
+        link_tree = document_link_tree(eadid, ead_etag(request, eadid, preview_mode),
+                                        preview_mode)
+        subtree = None
+        if link_tree is not None:
+            subtree = _subtree(link_tree, result.id, [eadid])
+        if subtree is not None:
+            children, url_ids = subtree
+            match_counts = _match_counts(result.node) if filter else None
+            render_opts['subseries'] = format_links(children, url_ids,
+                preview=preview_mode, url_params=url_params, match_counts=match_counts)
+        else:
+            render_opts['subseries'] = _subseries_links(result, preview=preview_mode,
+                                                        url_params=url_params)
 
         # provide series list without keyword params to use in RDFa uris
         if url_params and not preview_mode:
-            render_opts['subseries_noparam'] = _subseries_links(result)
-
+            if subtree is not None:
+                render_opts['subseries_noparam'] = format_links(children, url_ids)
+            else:
+                render_opts['subseries_noparam'] = _subseries_links(result)
 
     response = render_to_response('fa/series_or_index.html',
                                   render_opts,
                                   context_instance=RequestContext(request))
-
-    #Cache-Control to private when there is a last_search
-    if "last_search" in request.session:
-        response['Cache-Control'] = 'private'
-
+    _patch_document_headers(request, response)
     return response
 
 
@@ -407,12 +523,7 @@ def _get_series_or_index(eadid, *series_ids, **kwargs):
             the number of ids determines series level to be retrieved
     """
     # additional fields to be returned
-    return_fields = ['ead__eadid', 'ead__title', 'ead__unittitle',
-                     'ead__archdesc__origination',
-                     'ead__archdesc__controlaccess__head', 'ead__dsc__head',
-                     'ead__origination_name',
-                     'ead__repository',  # needed to determine if requestable
-                     'ead__collection_id']
+    return_fields = series_ead_fields[:]
     # common search parameters - last series id should be requested series, of whatever type
     search_fields = {'ead__eadid': eadid, 'id': series_ids[-1]}
 
@@ -425,24 +536,15 @@ def _get_series_or_index(eadid, *series_ids, **kwargs):
 
     try:
         if len(series_ids) == 1:
-            # if there is only on id, either a series or index is requested
-            try:
-                # try to find a series first (more common)
-                queryset = Series.objects.also(*return_fields).filter(**search_fields)
-                if filter:
-                    queryset = queryset.filter(**filter)
-                if use_collection is not None:
-                    queryset = queryset.using(use_collection)
-                record = queryset.get()
-            except DoesNotExist:
-                # if series is not found, look for an index
-                queryset = Index.objects.also(*return_fields).filter(**search_fields)
-                if filter:
-                    queryset = queryset.filter(**filter)
-                if use_collection is not None:
-                    queryset = queryset.using(use_collection)
-                record = queryset.get()
-            return record
+            # if there is only one id, either a series or index is requested;
+            # find whichever it is with a single query
+            queryset = SeriesOrIndex.objects.also(*return_fields).filter(**search_fields)
+            if filter:
+                queryset = queryset.filter(**filter)
+            if use_collection is not None:
+                queryset = queryset.using(use_collection)
+            return SeriesOrIndex.get_typed(queryset,
+                                           highlight=bool(filter and 'highlight' in filter))
 
         elif len(series_ids) == 2:
             # returning a subseries (c02); include id and did from parent c01 for breadcrumbs
@@ -473,12 +575,97 @@ def _get_series_or_index(eadid, *series_ids, **kwargs):
     return record
 
 
+def _navigation(eadid, preview=False, collection=None, match_counts=None):
+    """Top-level series and index navigation for a single finding aid, as
+    lists of :class:`~findingaids.fa.models.NavigationItem`.
+
+    Uses the navigation stored when the document was loaded, if available;
+    otherwise, series and index summary information is retrieved from eXist.
+    If keyword match counts are specified, they are set on the navigation
+    items.
+
+    :param eadid: eadid for the document
+    :param preview: boolean indicating preview mode
+    :param collection: eXist collection to query, if eXist must be queried
+    :param match_counts: optional dictionary of series and index ids to
+        number of keyword matches (see
+        :attr:`~findingaids.fa.models.HighlightSummary.component_matches`)
+    :returns: tuple of list of c01 series, list of indexes, and list of
+        query times for any eXist queries made
+    """
+    navigation = NavigationItem.for_document(eadid, preview)
+    query_times = []
+    if navigation:
+        all_series = [n for n in navigation
+                      if n.kind == NavigationItem.SERIES and n.level == 1]
+        all_indexes = [n for n in navigation if n.is_index]
+    else:
+        series = Series.objects.filter(ead__eadid=eadid) \
+                       .only('id', 'level', 'did__unitid', 'did__unittitle')
+        indexes = Index.objects.filter(ead__eadid=eadid).only('id', 'head')
+        if collection is not None:
+            series = series.using(collection)
+            indexes = indexes.using(collection)
+        all_series = [NavigationItem.from_component(s, eadid, position=i,
+                                                    preview=preview)
+                      for i, s in enumerate(series)]
+        all_indexes = [NavigationItem.from_component(idx, eadid,
+                                                     position=len(all_series) + i,
+                                                     preview=preview)
+                       for i, idx in enumerate(indexes)]
+        query_times = [series.queryTime(), indexes.queryTime()]
+
+    if match_counts is not None:
+        for item in all_series + all_indexes:
+            item.match_count = match_counts.get(item.component_id, 0)
+
+    return all_series, all_indexes, query_times
+
+
+def _highlight_summary(eadid, keywords, hash, collection):
+    """Get keyword match counts for the table of contents and top-level
+    series and indexes of a single finding aid, as a
+    :class:`~findingaids.fa.models.HighlightSummary`.  Counts are cached
+    by eadid, document hash, and keywords.
+
+    :param eadid: eadid for the document
+    :param keywords: full-text search terms
+    :param hash: eXist SHA-1 hash of the current version of the document
+    :param collection: eXist collection to query, if counts are not cached
+    """
+    cache_key = 'highlight-summary:%s:%s:%s' % (eadid, hash,
+        hashlib.md5(keywords.encode('utf-8')).hexdigest())
+    summary = cache.get(cache_key) if hash else None
+    if summary is not None:
+        return load_xmlobject_from_string(summary, HighlightSummary)
+    summary = HighlightSummary.get(eadid, keywords, collection)
+    if hash:
+        cache.set(cache_key, summary.serialize())   # use configured default cache timeout
+    return summary
+
+
 def _get_feedback_options(request, id):
     'Generate single-finding aid feedback options as a url parameter.'
     return urlencode({'eadid': id, 'url': request.build_absolute_uri()})
 
 
-@condition(last_modified_func=collection_lastmodified)
+def suggest(request):
+    """Search term suggestions for autocompletion, as JSON in the format
+    expected by jQuery UI autocomplete.  Suggestions are controlled access
+    headings and list titles starting with the **term** url parameter (or
+    with a word starting with it); use the optional **type** parameter to
+    restrict to ``subject`` or ``title`` suggestions.  Values are formatted
+    as exact phrase searches."""
+    types = ['subject', 'title']
+    if request.GET.get('type', None) in types:
+        types = [request.GET['type']]
+    suggestions = [{'label': term, 'category': type,
+                    'value': u'"%s"' % term.replace('"', '\\"')}
+                   for type, term in autocomplete.suggest(request.GET.get('term', ''), types)]
+    return HttpResponse(json.dumps(suggestions), content_type='application/json')
+
+
+@condition(etag_func=collection_etag, last_modified_func=collection_lastmodified)
 def search(request):
     "Simple keyword search - runs exist full-text terms query on all terms included."
 
@@ -496,9 +683,6 @@ def search(request):
         # initialize findingaid queryset - filters will be added based on search terms
         findingaids = FindingAid.objects
 
-        # local copy of return fields (fulltext-score may be added-- don't modify master copy!)
-        return_fields = fa_listfields[:]
-
         try:
             if subject:
                 # if a subject was specified, filter on subject
@@ -511,7 +695,6 @@ def search(request):
                 findingaids = findingaids.filter(repository__fulltext_terms=repository).order_by('list_title')
             if keywords:
                 # if keywords were specified, do a fulltext search
-                return_fields.append('fulltext_score')
                 findingaids = findingaids.filter(
                     # first do a full-text search to restrict to relevant documents
                     fulltext_terms=keywords
@@ -525,34 +708,64 @@ def search(request):
 
             # optional filter: restrict to items with digital archival objects
             if dao:
-                findingaids = findingaids.filter(daos__exists=True)
-
                 # if user does not have permission to view internal daos,
                 # restrict to public daos only
-                if not request.user.has_perm('fa_admin.can_view_internal_dao'):
-                    findingaids = findingaids.filter(public_dao_count__gte=1)
-
-                # NOTE: using >= filter to force a where clause because this works
-                # when what seems to be the same filter on the xpath does not
-                # (possibly an indexing issue?)
-
-            findingaids = findingaids.only(*return_fields)
-            result_subset, paginator = paginate_queryset(request, findingaids,
+                internal_dao = request.user.has_perm('fa_admin.can_view_internal_dao')
+                # use dao counts from the local catalog once it has been
+                # reconciled; otherwise, filter on daos in eXist
+                dao_eadids = CatalogEntry.dao_eadids(internal=internal_dao)
+                if dao_eadids is not None:
+                    findingaids = findingaids.filter(eadid__in=sorted(dao_eadids))
+                else:
+                    findingaids = findingaids.filter(daos__exists=True)
+                    if not internal_dao:
+                        findingaids = findingaids.filter(public_dao_count__gte=1)
+
+                    # NOTE: using >= filter to force a where clause because this works
+                    # when what seems to be the same filter on the xpath does not
+                    # (possibly an indexing issue?)
+
+            # ordered eadids and scores for all results are cached, so that
+            # paging through results doesn't re-run the search in eXist
+            # - full-text queries are case-folded, since the index is not
+            #   case-sensitive
+            # - dao results depend on user permissions
+            search_key = searchcache.search_key(
+                keywords=parse_query(keywords, fold_case=True),
+                subject=parse_query(subject, fold_case=True),
+                repository=repository, dao=dao,
+                internal_dao=dao and request.user.has_perm('fa_admin.can_view_internal_dao'))
+            results = searchcache.get_results(search_key, findingaids,
+                                              score=bool(keywords))
+            result_subset, paginator = paginate_queryset(request, results,
                                                          per_page=10, orphans=5)
+            # retrieve display fields for the current page only
+            page_hits = result_subset.object_list
+            page_fa = {}
+            if page_hits:
+                page_qs = FindingAid.objects.filter(eadid__in=[eadid for eadid, score in page_hits]) \
+                                            .only(*fa_listfields)
+                page_fa = dict((fa.eadid.value, fa)
+                               for fa in fetch_results(page_qs, len(page_hits)))
+            result_subset.object_list = []
+            for eadid, score in page_hits:
+                if eadid in page_fa:
+                    page_fa[eadid].fulltext_score = score
+                    result_subset.object_list.append(page_fa[eadid])
+
             # when searching by subject only, use alpha pagination
             if subject and not keywords:
-                page_labels = alpha_pagelabels(paginator, findingaids,
-                                               label_attribute='list_title')
+                page_labels = cached_alpha_pagelabels(paginator, findingaids,
+                                                      'list_title', key=search_key)
             else:
                 page_labels = {}
             show_pages = pages_to_show(paginator, result_subset.number, page_labels)
-            query_times = findingaids.queryTime()
 
             # select non-empty form values for use in template
             search_params = dict((key, value) for key, value in form.cleaned_data.iteritems()
                                  if value)
 
-            # set query and last page in session and set it to expire on browser close
+            # set query and last page for the link back to search results
             for key, val in search_params.iteritems():
                 if key == 'dao':
                     search_params[key] = val
@@ -564,12 +777,21 @@ def search(request):
                 del(last_search['page'])
             url_params = urlencode(last_search)
 
+            # facets for narrowing the current search, with counts
+            # calculated from the full result set
+            facets = {}
+            if not repository and len(results.repository_counts) > 1:
+                facets['repositories'] = [
+                    (repo, count, urlencode(dict(last_search,
+                                                 repository='"%s"' % repo.encode('utf-8'))))
+                    for repo, count in results.repository_counts]
+            if not dao and 0 < results.dao_count < len(results):
+                facets['dao'] = (results.dao_count, urlencode(dict(last_search, dao='on')))
+
             # store the current page (even if not specified in URL) for saved search
             last_search['page'] = page
             last_search = "%s?%s" % (reverse("fa:search"), urlencode(last_search))
             last_search = {"url": last_search, "txt": "Return to Search Results"}
-            request.session["last_search"] = last_search
-            request.session.set_expiry(0)  # set to expire when browser closes
 
             # ONLY keywords - not page or subject - should be included in
             # document url for search term highlighting
@@ -583,8 +805,9 @@ def search(request):
                 'search_params': search_params,    # actual search terms, for display
                 'url_params': url_params,   # url opts for pagination
                 'highlight_params': highlight_params,  # keyword highlighting
-                'querytime': [query_times],
-                'show_pages': show_pages
+                'show_pages': show_pages,
+                'facets': facets,
+                'last_search': last_search,
             }
             if page_labels:     # if there are page labels to show, add to context
                 # other page labels handled by show_pages, but first & last are special
@@ -601,12 +824,15 @@ def search(request):
             # FIXME: could/should this be a custom eXist exception class?
             query_error = True
             if 'Cannot parse' in e.message():
-                messages.error(request,
-                               'Your search query could not be parsed.  ' +
-                               'Please revise your search and try again.')
+                messages.error(request, QUERY_ERROR_MESSAGE)
             else:
                 # generic error message for any other exception
                 messages.error(request, 'There was an error processing your search.')
+    elif form.has_query_error():
+        # full-text query syntax errors are caught by form validation,
+        # without sending the query to eXist
+        query_error = True
+        messages.error(request, QUERY_ERROR_MESSAGE)
     elif 'keywords' not in request.GET and 'subject' not in request.GET:
         # if form was not valid and nothing was submitted, re-initialize
         # don't tell the user that fields are required if they haven't submitted anything!
@@ -623,7 +849,9 @@ def search(request):
 
 
 def document_search(request, id):
-    "Keyword search on file-level items in a single Finding Aid."
+    """Keyword search on file-level items in a single Finding Aid.  Results
+    are paginated, and only the first **FINDINGAID_DOCUMENT_SEARCH_MAX_HITS**
+    matches can be displayed; the total number of matches is reported."""
 
     form = KeywordSearchForm(request.GET)
     query_error = False
@@ -649,29 +877,49 @@ def document_search(request, id):
             if search_terms:
                 files = files.filter(fulltext_terms=search_terms)
 
+            files = files.also('parent__id', 'parent__did',
+                               'series1__id', 'series1__did', 'series2__id', 'series2__did')
+
             # restrict to publicly-accessible dao items, if set
             if form.cleaned_data['dao']:
-                files = files.filter(did__dao_list__exists=True)
                 # if user can view internal daos, no additional filter is needed
                 # otherwise, restrict to publicly-accessible dao content
-                if not request.user.has_perm('fa_admin.can_view_internal_dao'):
-                    files = files.filter(public_dao_count__gte=1)
-
-            files = files.also('parent__id', 'parent__did',
-                               'series1__id', 'series1__did', 'series2__id', 'series2__did')
+                internal_dao = request.user.has_perm('fa_admin.can_view_internal_dao')
+                if CatalogEntry.has_daos(id, internal=internal_dao) is False:
+                    # catalog shows no accessible daos in this document,
+                    # so no items can match; don't search eXist
+                    files = []
+                else:
+                    files = files.filter(did__dao_list__exists=True)
+                    if not internal_dao:
+                        files = files.filter(public_dao_count__gte=1)
+
+            # retrieve total matches and current page of items in a single
+            # query; results are in document order, so items in the same
+            # series are displayed together
+            files_subset, paginator = paginate_queryset(request, files,
+                per_page=50, orphans=10,
+                max_count=getattr(settings, 'FINDINGAID_DOCUMENT_SEARCH_MAX_HITS', 500))
+            show_pages = pages_to_show(paginator, files_subset.number)
 
             # if there is a keyword search term, pass on for highlighting
             url_params = ''
+            page_params = {}
             if search_terms:
                 url_params = '?' + urlencode({'keywords': search_terms.encode('utf-8')})
+                page_params['keywords'] = search_terms.encode('utf-8')
+            if form.cleaned_data['dao']:
+                page_params['dao'] = 'on'
 
             return render_to_response('fa/document_search.html', {
-                'files': files,
+                'files': files_subset,
+                'total_matches': getattr(paginator, 'total_count', paginator.count),
                 'ead': ead,
-                'querytime': [files.queryTime(), ead.queryTime()],
                 'keywords': search_terms,
                 'dao': form.cleaned_data['dao'],
                 'url_params': url_params,
+                'page_params': urlencode(page_params),  # url opts for pagination
+                'show_pages': show_pages,
                 'docsearch_form': KeywordSearchForm(),
             }, context_instance=RequestContext(request))
         except ExistDBTimeout, e:
@@ -685,12 +933,13 @@ def document_search(request, id):
             # NOTE: some duplicate logic from error handling in main keyword search
             query_error = True
             if 'Cannot parse' in e.message():
-                messages.error(request,
-                               'Your search query could not be parsed.  ' +
-                               'Please revise your search and try again.')
+                messages.error(request, QUERY_ERROR_MESSAGE)
             else:
                 # generic error message for any other exception
                 messages.error(request, 'There was an error processing your search.')
+    elif form.has_query_error():
+        query_error = True
+        messages.error(request, QUERY_ERROR_MESSAGE)
     else:
         # invalid form
         messages.error(request, 'Please enter a search term.')
@@ -706,49 +955,13 @@ def document_search(request, id):
     return response
 
 
-def _series_url(eadid, series_id, *ids, **extra_opts):
-    """
-    Generate a series or subseries url when given an eadid and list of series ids.
-    Requires at least ead document id and top-level series id.  Number of additional
-    series ids provided determines type of series url generated.
-
-    Default url callback for :meth:`_subseries_links`.
-    """
-    # common args for generating all urls
-    args = {'id': eadid, 'series_id': series_id}
-
-    if len(ids) == 0:       # no additional args
-        view_name = 'series-or-index'
-    if len(ids) >= 1:       # add subseries id arg if one specified (used for sub and sub-subseries)
-        args['series2_id'] = ids[0]
-        view_name = 'series2'
-    if len(ids) == 2:       # add sub-subseries id arg if specified
-        args['series3_id'] = ids[1]
-        view_name = 'series3'
-
-    if 'preview' in extra_opts and extra_opts['preview'] is True:
-        view_namespace = 'fa-admin:preview'
-    else:
-        view_namespace = 'fa'
-
-    return reverse('%s:%s' % (view_namespace, view_name), kwargs=args)
-
-
-def _series_anchor(*ids, **extra_opts):
-    """Generate a same-page id-based anchor link for a series.
-
-    Used as url callback for :meth:`_subseries_links` for generating a single-page
-    version of the full finding aid (see :meth:`full_fa`).
-    """
-    # only actually use the last of all ids passed in
-    return "#%s" % ids[-1]
-
-
-def _subseries_links(series, url_ids=None, url_callback=_series_url, preview=False,
+def _subseries_links(series, url_ids=None, url_callback=series_url, preview=False,
                      url_params=''):
     """
-    Recursive function to build a nested list of links to series and subseries
-    to simplify template display logic for complicated series.  Note that the list
+    Build a nested list of links to series and subseries by walking the EAD
+    xml, to simplify template display logic for complicated series.  Views
+    that display a whole document should use the cached link tree from
+    :meth:`~findingaids.fa.utils.document_link_tree` instead.  Note that the list
     elements include ``<a href="...">`` tags, so the output of should not be
     escaped in the template where it is rendered.
 
@@ -798,36 +1011,41 @@ def _subseries_links(series, url_ids=None, url_callback=_series_url, preview=Fal
         if series.node.tag in [C01, C02, C03]:
             url_ids.append(series.short_id)
 
-    links = []
-    if (hasattr(series, 'hasSubseries') and series.hasSubseries()) or \
-       (hasattr(series, 'hasSeries') and series.hasSeries()):
-        for component in series.c:
-            # get match count for each series / subseries and append it to the link if > 0
-            if component.match_count > 0:
-                plural = "es" if component.match_count > 1 else ""
-                match_count = "<span class='exist-match'>%s match%s</span>" % (component.match_count, plural)
-            else:
-                match_count = ""
-
-            current_url_ids = url_ids + [component.short_id]
-            #set c01 rel attrib to 'section' c02 and c03 to 'subsection'
-            if (component.node.tag == C01):
-                rel = 'section'
-            elif (component.node.tag in [C02, C03]):
-                rel = 'subsection'
-
-            # don't include preview/keyword arg urls in RDFa rel
-            if not url_params and not preview:
-                rel += ' dcterms:hasPart'
-
-            text = "<a href='%(url)s%(url_params)s' rel='%(rel)s'>%(linktext)s</a> %(match_count)s" % \
-                {'url': url_callback(preview=preview, *current_url_ids),
-                 'url_params': url_params,
-                 'rel': rel,
-                 'linktext':  component.display_label(), 'match_count': match_count}
-            links.append(text)
-            if component.hasSubseries():
-                links.append(_subseries_links(component, url_ids=current_url_ids,
-                                              url_callback=url_callback,
-                                              preview=preview, url_params=url_params))
-    return links
+    tree = component_link_tree(series)
+    if not tree:
+        return []
+    return format_links(tree, url_ids, url_callback=url_callback,
+                        preview=preview, url_params=url_params,
+                        match_counts=_match_counts(series.node))
+
+
+def _subtree(tree, component_id, url_ids):
+    """Find the children of a series within a series link tree.
+
+    :returns: tuple of the list of child items and the list of url ids for
+        the series (url_ids extended with the short ids of the series and
+        its parents), or None if the series is not in the tree
+    """
+    for item in tree:
+        item_ids = url_ids + [item['short_id']]
+        if item['id'] == component_id:
+            return item['children'], item_ids
+        found = _subtree(item['children'], component_id, item_ids)
+        if found is not None:
+            return found
+    return None
+
+
+def _match_counts(node):
+    """Count keyword matches (highlighted by eXist) within each series and
+    subseries in a portion of an EAD document.
+
+    :param node: lxml node
+    :returns: dictionary of component id to number of matches
+    """
+    counts = {}
+    for match in node.iter(EXIST_MATCH):
+        for ancestor in match.iterancestors():
+            if ancestor.tag in C_LEVELS and ancestor.get('id'):
+                counts[ancestor.get('id')] = counts.get(ancestor.get('id'), 0) + 1
+    return counts
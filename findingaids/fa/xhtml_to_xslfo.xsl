@@ -1,6 +1,7 @@
 <?xml version="1.0" encoding="utf-8"?>
 <xsl:stylesheet xmlns:xsl="http://www.w3.org/1999/XSL/Transform"
   xmlns:fo="http://www.w3.org/1999/XSL/Format"
+  xmlns:fox="http://xmlgraphics.apache.org/fop/extensions"
   version="1.0">
 
   <xsl:output method="xml"/>
@@ -8,6 +9,19 @@
   <xsl:param name="STATIC_ROOT" />
   <xsl:param name="STATIC_URL" />
   <xsl:param name="link_color" value="blue" />
+  <!-- when rendering a large finding aid in parts (see findingaids.fa.pdfsplit):
+       'front' for the front matter, or 'series' for a series; series parts
+       use the basic page master only and start at the specified page number.
+       Bookmarks for parts are generated when the parts are merged. -->
+  <xsl:param name="part" select="'all'"/>
+  <xsl:param name="initial_page_number" select="'auto'"/>
+  <!-- space-separated names of anchors in this part that are linked from
+       other parts; declared as named destinations so links can be resolved
+       when the parts are merged -->
+  <xsl:param name="destinations" select="''"/>
+
+  <!-- anchors in the document, for checking internal link targets -->
+  <xsl:key name="anchors" match="a[@name]" use="@name"/>
 
   <xsl:variable name="disclaimer">
   MARBL provides copies of its finding aids for use only in research
@@ -66,12 +80,25 @@
 
       </fo:layout-master-set>
 
+      <xsl:if test="normalize-space($destinations)">
+        <fo:declarations>
+          <xsl:for-each select="//a[@name][contains(concat(' ', $destinations, ' '), concat(' ', @name, ' '))]">
+            <fox:destination internal-destination="{@name}"/>
+          </xsl:for-each>
+        </fo:declarations>
+      </xsl:if>
+
       <!-- generate bookmarks -->
-      <fo:bookmark-tree>
-        <xsl:apply-templates select="//h1[a/@name]" mode="bookmark"/>
-      </fo:bookmark-tree>
+      <xsl:if test="$part = 'all'">
+        <fo:bookmark-tree>
+          <xsl:apply-templates select="//h1[a/@name]" mode="bookmark"/>
+        </fo:bookmark-tree>
+      </xsl:if>
 
-      <fo:page-sequence master-reference="all-pages">
+      <fo:page-sequence master-reference="all-pages" initial-page-number="{$initial_page_number}">
+        <xsl:if test="$part = 'series'">
+          <xsl:attribute name="master-reference">basic</xsl:attribute>
+        </xsl:if>
 
         <!-- display div with id 'header' at top of all pages after the first -->
         <fo:static-content flow-name="header">
@@ -415,6 +442,25 @@
    <fo:block/>
  </xsl:template>
 
+ <!-- internal links to content that is not in this document: when rendering
+      in parts, content in another part is linked with a pdfsplit: uri,
+      which is replaced with a link to the named destination when the parts
+      are merged; otherwise the link is displayed as plain text -->
+ <xsl:template match="a[starts-with(@href, '#')][not(key('anchors', substring-after(@href, '#')))]"
+   priority="1">
+   <xsl:choose>
+     <xsl:when test="$part != 'all'">
+       <fo:basic-link text-decoration="underline" color="{$link_color}"
+         external-destination="url('pdfsplit:{substring-after(@href, '#')}')">
+         <xsl:apply-templates/>
+       </fo:basic-link>
+     </xsl:when>
+     <xsl:otherwise>
+       <xsl:apply-templates/>
+     </xsl:otherwise>
+   </xsl:choose>
+ </xsl:template>
+
  <xsl:template match="a[@href]">
    <fo:basic-link text-decoration="underline">
     <xsl:attribute name="color"><xsl:value-of select="$link_color" /></xsl:attribute>
@@ -27,17 +27,19 @@ from django.conf import settings
 from eulxml.xmlmap.core import load_xmlobject_from_file
 from eulexistdb.db import ExistDB, ExistDBException
 
+from findingaids.fa import pdfstore
 from findingaids.fa.models import FindingAid, Archive
-from findingaids.fa_admin.utils import check_ead
+from findingaids.fa_admin.utils import check_ead, document_loaded
 from findingaids.fa_admin.svn import svn_client
-from findingaids.fa_admin.tasks import reload_cached_pdf
+from findingaids.fa_admin.tasks import reload_cached_pdf, store_pdf
 
 
 class Command(BaseCommand):
     """Load all or specified EAD xml files in the configured source directory
 to the configured eXist collection.  For each document successfully loaded to
-eXist, this script will trigger a celery task to reload the PDF in the cache; the
-script will not exit until all tasks have completed.
+eXist, this script will trigger a celery task to generate the PDF in the local
+PDF store, if configured, or else to reload the PDF in the cache; the script will
+not exit until all tasks have completed.
 
 If filenames are specified as arguments, only those files will be loaded.
 Files should be specified by basename only (they will be loaded from the configured
@@ -90,6 +92,8 @@ directory will be loaded."""
                 print "** Skipping PDFs cache reload"
 
         db = ExistDB()
+        # generate PDFs in the local store if enabled; otherwise, reload the cache
+        pdf_task = store_pdf if pdfstore.enabled() else reload_cached_pdf
 
         loaded = 0
         errored = 0
@@ -123,11 +127,13 @@ directory will be loaded."""
                                 print "Loaded %s" % file
                             # load the file as a FindingAid object to get the eadid for PDF reload
                             ead = load_xmlobject_from_file(file, FindingAid)
+                            # update locally stored document information
+                            document_loaded(ead)
 
                             # trigger PDF regeneration in the cache and store task result
                             # - unless user has requested PDF reload be skipped
                             if not options['skip_pdf_reload']:
-                                pdf_tasks[ead.eadid.value] = reload_cached_pdf.delay(ead.eadid.value)
+                                pdf_tasks[ead.eadid.value] = pdf_task.delay(ead.eadid.value)
                                 # NOTE: unlike the web admin publish, this does not
                                 # generate TaskResult db records; task outcomes will be
                                 # checked & reported before the script finishes
@@ -149,7 +155,7 @@ directory will be loaded."""
             for ead in findingaids:
                 if verbosity > v_normal:
                      print "Queuing PDF request for %s" % ead.eadid.value
-                pdf_tasks[ead.eadid.value] = reload_cached_pdf.delay(ead.eadid.value)
+                pdf_tasks[ead.eadid.value] = pdf_task.delay(ead.eadid.value)
 
         if not options['skip_pdf_reload']:
             # check on the status of PDF cache reload tasks and wait until they all finish
@@ -0,0 +1,128 @@
+# file findingaids/fa_admin/management/commands/reconcile_catalog.py
+#
+#   Copyright 2012 Emory University Library
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+from optparse import make_option
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from eulexistdb.db import ExistDBException
+
+from findingaids.fa.models import CatalogEntry, CollectionWatermark, BrowseTitle
+
+
+class Command(BaseCommand):
+    """Rebuild the local catalog of EAD documents (eadid, document name,
+checksum, last modification time, etc.) from the documents currently in the
+configured eXist collections, and report on any catalog entries that were
+added, updated, or removed.
+
+The catalog is updated automatically when documents are published,
+previewed, or deleted through the admin site or loaded with the load_ead
+script; this script should be run after the catalog is first installed, and
+any time documents are loaded to or removed from eXist by other means.
+Until it has been run, the catalog is not used and eXist is queried instead.
+If any published documents have changed, the collection watermark used for
+browse and search Last-Modified and ETag headers is also updated.  Browse
+titles for the alphabetical title browse are regenerated for all published
+documents.
+"""
+    help = __doc__
+
+    option_list = BaseCommand.option_list + (
+        make_option('--dry-run', '-n',
+            action='store_true',
+            dest='dry_run',
+            default=False,
+            help='Report on differences without updating the catalog'),
+        make_option('--public-only',
+            action='store_true',
+            dest='public_only',
+            default=False,
+            help='Only reconcile the public collection (skip the preview collection)'),
+        )
+
+    # django default verbosity level options --  1 = normal, 0 = minimal, 2 = all
+    v_normal = 1
+    v_all = 2
+
+    def handle(self, *args, **options):
+        verbosity = int(options['verbosity'])
+
+        # check for required settings
+        if not hasattr(settings, 'EXISTDB_ROOT_COLLECTION') or not settings.EXISTDB_ROOT_COLLECTION:
+            raise CommandError("EXISTDB_ROOT_COLLECTION setting is missing")
+
+        modes = [False] if options['public_only'] else [False, True]
+        for preview in modes:
+            collection = settings.EXISTDB_PREVIEW_COLLECTION if preview \
+                else settings.EXISTDB_ROOT_COLLECTION
+            if verbosity == self.v_all:
+                print 'Cataloging documents in %s' % collection
+
+            try:
+                entries = CatalogEntry.from_exist(preview=preview)
+            except ExistDBException, e:
+                raise CommandError('Failed to retrieve documents from %s: %s' %
+                                   (collection, e.message()))
+
+            # compare with current catalog, by document path
+            current = dict(((e.collection_name, e.document_name), e)
+                           for e in CatalogEntry.objects.filter(preview=preview))
+            added = updated = unchanged = 0
+            for entry in entries:
+                key = (entry.collection_name, entry.document_name)
+                old = current.pop(key, None)
+                if old is None:
+                    added += 1
+                    if verbosity >= self.v_normal:
+                        print 'Added %s (%s)' % (entry.eadid, entry.document_name)
+                elif (old.eadid, old.hash, old.last_modified, old.repository,
+                      old.dao_count, old.public_dao_count) != \
+                     (entry.eadid, entry.hash, entry.last_modified, entry.repository,
+                      entry.dao_count, entry.public_dao_count):
+                    updated += 1
+                    if verbosity >= self.v_normal:
+                        print 'Updated %s (%s)' % (entry.eadid, entry.document_name)
+                else:
+                    unchanged += 1
+            # anything left in the current catalog is no longer in eXist
+            if verbosity >= self.v_normal:
+                for old in current.itervalues():
+                    print 'Removed %s (%s)' % (old.eadid, old.document_name)
+
+            if not options['dry_run']:
+                with transaction.commit_on_success():
+                    CatalogEntry.objects.filter(preview=preview).delete()
+                    CatalogEntry.objects.bulk_create(entries)
+                    CatalogEntry.mark_reconciled(preview)
+                # published documents changed outside the site; make sure
+                # collection-level headers and cached values are updated
+                if not preview and (added or updated or current):
+                    CollectionWatermark.bump()
+
+            print '%s: %d added, %d updated, %d removed, %d unchanged' % \
+                (collection, added, updated, len(current), unchanged)
+
+        if options['dry_run']:
+            print 'Dry run; catalog was not changed'
+        else:
+            try:
+                titles = BrowseTitle.rebuild()
+            except ExistDBException, e:
+                raise CommandError('Failed to generate browse titles: %s' % e.message())
+            print 'Generated %d browse title%s' % (len(titles), 's' if len(titles) != 1 else '')
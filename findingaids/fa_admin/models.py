@@ -19,7 +19,7 @@ from datetime import datetime
 from django.conf import settings
 from django.db import models
 
-from findingaids.fa.models import Archive
+from findingaids.fa.models import Archive, CatalogEntry
 from findingaids.fa.utils import get_findingaid
 
 
@@ -72,15 +72,21 @@ class EadFile:
     def __repr__(self):
         return '<%s %s>' % (self.__class__, self.filename)
 
+    def _last_modified(self, preview=False):
+        # last modification time in eXist, from the local catalog if available
+        if CatalogEntry.available(preview):
+            return CatalogEntry.last_modified_by_name([self.filename],
+                                                      preview).get(self.filename)
+        fa = get_findingaid(filter={'document_name': self.filename},
+                            only=['last_modified'], preview=preview)
+        if fa.count():
+            return fa[0].last_modified
+
     def get_published(self):
         "Date object was modified in eXist, if published"
-        # TODO: previewed & published logic substantially the same; consolidate
         if self._published is None:
             try:
-                fa = get_findingaid(filter={'document_name': self.filename},
-                                       only=['last_modified'])
-                if fa.count():
-                    self._published = fa[0].last_modified
+                self._published = self._last_modified()
             except Exception:
                 # FIXME: distinguish between not found and eXist error?
                 pass
@@ -103,10 +109,7 @@ class EadFile:
             available in preview."""
         if self._previewed is None:
             try:
-                fa = get_findingaid(filter={'document_name': self.filename},
-                                       only=['last_modified'], preview=True)
-                if fa.count():
-                    self._previewed = fa[0].last_modified
+                self._previewed = self._last_modified(preview=True)
             except Exception:
                 pass
 
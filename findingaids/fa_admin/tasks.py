@@ -28,6 +28,7 @@ from django.dispatch import receiver
 from eullocal.django.taskresult.models import TaskResult
 
 from findingaids import __version__ as SW_VERSION
+from findingaids.fa import pdfstore
 from findingaids.fa.models import Archive
 from findingaids.fa_admin.svn import svn_client
 
@@ -75,6 +76,21 @@ def reload_cached_pdf(eadid):
         raise Exception("PROXY_HOST and/or SITE_BASE_URL settings not available.  Failed to reload cached PDF.")
 
 
+@task
+def store_pdf(eadid):
+    """Generate the PDF of a published finding aid (specified by eadid) and
+    save it in the local PDF store (see :mod:`findingaids.fa.pdfstore`), so
+    the printable PDF can be served without generating it on demand."""
+    logger = store_pdf.get_logger()
+    if not pdfstore.enabled():
+        raise Exception("FINDINGAID_PDF_STORE directory is not configured.  Failed to store PDF.")
+    path = pdfstore.store_findingaid_pdf(eadid)
+    if path is None:
+        raise Exception("Failed to store PDF for %s" % eadid)
+    logger.info("Stored PDF for %s at %s" % (eadid, path))
+    return True
+
+
 @task
 def archive_svn_checkout(archive, update=False):
     client = svn_client()
@@ -34,7 +34,8 @@ from eullocal.django.taskresult.models import TaskResult
 from eulexistdb.testutil import TestCase
 from eulxml.xmlmap import load_xmlobject_from_file
 
-from findingaids.fa.models import Deleted, Archive, FindingAid
+from findingaids.fa.models import Deleted, Archive, FindingAid, CatalogEntry, \
+    BrowseTitle
 from findingaids.fa_admin import tasks, views
 from findingaids.fa_admin.models import EadFile
 from findingaids.fa_admin.mocks import MockDjangoPidmanClient  # MockHttplib unused?
@@ -341,6 +342,10 @@ class AdminViewsTest(BaseAdminViewsTest):
         # confirm that document was actually saved to exist
         docinfo = self.db.describeDocument(settings.EXISTDB_PREVIEW_COLLECTION + '/' + filename)
         self.assertEqual(docinfo['name'], settings.EXISTDB_PREVIEW_COLLECTION + '/' + filename)
+        # document should be in the local catalog for the preview collection
+        entry = CatalogEntry.find(eadid, preview=True)
+        self.assertEqual(filename, entry.document_name)
+        self.assertEqual(None, CatalogEntry.find(eadid))
 
         # GET should just list files available for preview
         # FIXME: preview list view doesn't currently use archive; this functionality
@@ -756,6 +761,10 @@ class AdminViewsTest(BaseAdminViewsTest):
         msgs = [str(msg) for msg in response.context['messages']]
         self.assert_('Successfully removed <b>%s</b>.' % eadid in msgs[0],
                 "delete success message is set in response context")
+        self.assertEqual(None, CatalogEntry.find(eadid),
+                "catalog entry should be removed when document is deleted")
+        self.assertFalse(BrowseTitle.objects.filter(eadid=eadid).exists(),
+                "browse title should be removed when document is deleted")
 
         # test for expected failures for a non-existent eadid
         # NOTE: logging in as superuser, because non-super admin will be denied
@@ -927,6 +936,11 @@ class CeleryAdminViewsTest(BaseAdminViewsTest):
         # confirm that document is no longer in preview collection
         docinfo = self.db.describeDocument(settings.EXISTDB_PREVIEW_COLLECTION + '/' + filename)
         self.assertEqual({}, docinfo)
+        # local catalog should be updated to match
+        self.assertEqual(filename, CatalogEntry.find(document_id).document_name)
+        self.assertEqual(None, CatalogEntry.find(document_id, preview=True))
+        # browse title should be generated for the published document
+        self.assert_(BrowseTitle.objects.filter(eadid=document_id).exists())
 
         task = TaskResult.objects.get(object_id=document_id)
         self.assert_(isinstance(task, TaskResult),
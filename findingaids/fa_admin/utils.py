@@ -28,7 +28,9 @@ from eulxml.xmlmap.eadmap import EAD_NAMESPACE
 from pidservices.djangowrapper.shortcuts import DjangoPidmanRestClient
 from pidservices.clients import is_ark, parse_ark
 
-from findingaids.fa.models import FindingAid, ID_DELIMITER
+from findingaids.fa import pagecache, pdfstore
+from findingaids.fa.models import FindingAid, NavigationItem, CatalogEntry, \
+    CollectionWatermark, BrowseTitle, ID_DELIMITER
 from findingaids.fa.urls import EADID_URL_REGEX, TITLE_LETTERS
 
 # pre-compile an xpath to easily get node names without EAD namespace
@@ -85,11 +87,15 @@ def check_ead(filename, dbpath, xml=None):
     if ead.eadid.value != expected_eadid:
         errors.append("eadid '%s' does not match expected value of '%s'" % (ead.eadid.value, expected_eadid))
     else:   # if eadid is acceptable, check for uniqueness in configured database
-        fa = FindingAid.objects.filter(eadid=ead.eadid.value).only("document_name", "collection_name")
-        if fa.count() > 1:
+        # (using the local catalog of published documents, if available)
+        if CatalogEntry.available():
+            fa = list(CatalogEntry.objects.filter(eadid=ead.eadid.value, preview=False))
+        else:
+            fa = FindingAid.objects.filter(eadid=ead.eadid.value).only("document_name", "collection_name")
+        if len(fa) > 1:
             errors.append("Database already contains %s instances of eadid '%s'! (%s)"
-                    % (fa.count(), ead.eadid.value, ", ".join([f.document_name for f in fa])))
-        elif fa.count() == 1:
+                    % (len(fa), ead.eadid.value, ", ".join([f.document_name for f in fa])))
+        elif len(fa) == 1:
             # some inconsistency in when /db is included on exist collection names
             path = fa[0].collection_name.replace('/db', '') + "/" + fa[0].document_name
             if path != dbpath:
@@ -364,3 +370,48 @@ def set_series_ids(series, eadid, position):
     if series.hasSubseries():
         for j, c in enumerate(series.c):
             set_series_ids(c, eadid, j)
+
+
+def document_loaded(ead, preview=False):
+    """Update information stored locally about an EAD document after it has
+    been loaded to eXist (published or loaded for preview).  Updates the
+    local catalog entry for the document (see
+    :class:`~findingaids.fa.models.CatalogEntry`), regenerates the series and
+    index navigation (see :class:`~findingaids.fa.models.NavigationItem`),
+    and removes any cached pages for it (see :mod:`findingaids.fa.pagecache`).
+    For published documents, also updates the browse title (see
+    :class:`~findingaids.fa.models.BrowseTitle`) and the collection watermark
+    (see :class:`~findingaids.fa.models.CollectionWatermark`).
+
+    :param ead: :class:`~findingaids.fa.models.FindingAid` instance for the
+        full document that was loaded
+    :param preview: boolean; True if the document was loaded to the preview
+        collection
+    """
+    CatalogEntry.update(ead.eadid.value, preview=preview)
+    NavigationItem.build(ead, preview=preview)
+    pagecache.invalidate(ead.eadid.value)
+    if not preview:
+        BrowseTitle.build(ead)
+        CollectionWatermark.bump()
+
+
+def document_removed(eadid, preview=False):
+    """Remove information stored locally about an EAD document after it has
+    been removed from eXist (deleted, or moved out of the preview collection
+    on publication).  Counterpart to :meth:`document_loaded`.
+
+    Stored PDFs for published documents are also removed (see
+    :mod:`findingaids.fa.pdfstore`).
+
+    :param eadid: eadid of the document that was removed
+    :param preview: boolean; True if the document was removed from the preview
+        collection
+    """
+    CatalogEntry.remove(eadid, preview=preview)
+    NavigationItem.remove(eadid, preview=preview)
+    pagecache.invalidate(eadid)
+    if not preview:
+        BrowseTitle.remove(eadid)
+        pdfstore.remove(eadid)
+        CollectionWatermark.bump()
@@ -44,14 +44,15 @@ from eullocal.django.taskresult.models import TaskResult
 from eulxml.xmlmap.core import load_xmlobject_from_file, load_xmlobject_from_string
 from eulexistdb.exceptions import DoesNotExist
 
-from findingaids.fa.models import FindingAid, Deleted, Archive
+from findingaids.fa import pagecache, pdfstore
+from findingaids.fa.models import FindingAid, Deleted, Archive, CatalogEntry
 from findingaids.fa.utils import pages_to_show, get_findingaid, paginate_queryset
 from findingaids.fa_admin.auth import archive_access
 from findingaids.fa_admin.forms import DeleteForm
 from findingaids.fa_admin.models import Archivist
 from findingaids.fa_admin.source import files_to_publish
 from findingaids.fa_admin.svn import svn_client
-from findingaids.fa_admin.tasks import reload_cached_pdf
+from findingaids.fa_admin.tasks import reload_cached_pdf, store_pdf
 from findingaids.fa_admin import utils
 
 logger = logging.getLogger(__name__)
@@ -90,7 +91,8 @@ def main(request):
         'archives': archives,
         'current_tab': current_tab,
         'login_url': login_url,
-        'task_results': recent_tasks})
+        'task_results': recent_tasks,
+        'page_cache': pagecache.stats()})
 
 
 # NOTE: viewing the file list sort of implies prep/preview/publish permissions
@@ -122,9 +124,13 @@ def list_files(request, archive):
 
     # query for publish/preview modification time all at once
     # (more efficient than individual queries for each file)
-    published = FindingAid.objects.only('document_name', 'last_modified') \
-        .filter(document_name__in=[f.filename for f in recent_files.object_list])
-    pubinfo = dict((r.document_name, r.last_modified) for r in published)
+    filenames = [f.filename for f in recent_files.object_list]
+    if CatalogEntry.available():
+        pubinfo = CatalogEntry.last_modified_by_name(filenames)
+    else:
+        published = FindingAid.objects.only('document_name', 'last_modified') \
+            .filter(document_name__in=filenames)
+        pubinfo = dict((r.document_name, r.last_modified) for r in published)
     # NOTE: if needed, we can also load preview info like this:
     # preview = published.using(settings.EXISTDB_PREVIEW_COLLECTION)
 
@@ -337,9 +343,17 @@ def publish(request):
         success = False
 
     if success:
-        # request the cache to reload the PDF - queue asynchronous task
-        result = reload_cached_pdf.delay(ead.eadid.value)
-        task = TaskResult(label='PDF reload', object_id=ead.eadid.value,
+        # document is no longer in the preview collection
+        utils.document_removed(ead.eadid.value, preview=True)
+        utils.document_loaded(ead)
+
+        # queue asynchronous task to generate the PDF in the local PDF
+        # store, if enabled, or else request the cache to reload the PDF
+        if pdfstore.enabled():
+            label, result = 'PDF generation', store_pdf.delay(ead.eadid.value)
+        else:
+            label, result = 'PDF reload', reload_cached_pdf.delay(ead.eadid.value)
+        task = TaskResult(label=label, object_id=ead.eadid.value,
             url=reverse('fa:findingaid', kwargs={'id': ead.eadid.value}),
             task_id=result.task_id)
         task.save()
@@ -384,6 +398,7 @@ def preview(request, archive):
         if success:
             # load the file as a FindingAid object so we can generate the preview url
             ead = load_xmlobject_from_file(fullpath, FindingAid)
+            utils.document_loaded(ead, preview=True)
             messages.success(request, 'Successfully loaded <b>%s</b> for preview.' % filename)
             # redirect to document preview page with code 303 (See Other)
             return HttpResponseSeeOtherRedirect(reverse('fa-admin:preview:findingaid', kwargs={'id': ead.eadid}))
@@ -550,7 +565,7 @@ def list_published(request, archive=None):
     show_pages = pages_to_show(paginator, fa_subset.number)
 
     return render(request, 'fa_admin/published_list.html', {'findingaids': fa_subset,
-        'querytime': [fa.queryTime()], 'show_pages': show_pages, 'archive': arch})
+        'show_pages': show_pages, 'archive': arch})
 
 @permission_required_with_403('fa_admin.can_delete')
 @user_passes_test_with_ajax(archive_access)
@@ -597,6 +612,7 @@ def delete_ead(request, id, archive=None):
                     success = db.removeDocument(fa.collection_name + '/' + fa.document_name)
                     if success:
                         DeleteForm(request.POST, instance=deleted_info).save()
+                        utils.document_removed(fa.eadid.value)
                         messages.success(request, 'Successfully removed <b>%s</b>.' % id)
                     else:
                         # remove exited normally but was not successful
@@ -24,6 +24,7 @@ djcelery.setup_loader()
 # explicitly set celery task to findingaids queue (let celery create the queue)
 CELERY_ROUTES = {
     'findingaids.fa_admin.tasks.reload_cached_pdf': {'queue': 'findingaids'},
+    'findingaids.fa_admin.tasks.store_pdf': {'queue': 'findingaids'},
     'findingaids.fa_admin.tasks.archive_svn_checkout': {'queue': 'findingaids'}
 }
 
@@ -160,6 +161,50 @@ MESSAGE_STORAGE = 'django.contrib.messages.storage.session.SessionStorage'
 # NOTE: using memory cache for now for simplicity
 CACHE_BACKEND = 'locmem://'
 
+# cache for rendered single finding aid pages; see findingaids.fa.pagecache
+# for available backends.  Default is an in-process LRU cache limited to
+# 20MB of rendered pages; override in localsettings if needed.
+FINDINGAID_PAGE_CACHE = {
+    'BACKEND': 'findingaids.fa.pagecache.LRUCache',
+    'OPTIONS': {'max_size': 20 * 1024 * 1024},
+}
+
+# on-disk store for generated PDFs; see findingaids.fa.pdfstore for details.
+# Disabled unless a directory is configured in localsettings.
+FINDINGAID_PDF_STORE = {
+    'DIR': None,
+    'MAX_SIZE': 2 * 1024 * 1024 * 1024,
+}
+
+# pool of persistent XSL-FO processor workers for PDF generation; see
+# findingaids.fa.foppool for details.  Disabled unless a worker command
+# is configured in localsettings.
+FINDINGAID_FOP_POOL = {
+    'COMMAND': None,
+    'WORKERS': 2,
+    'TIMEOUT': 300,
+}
+
+# limits on simultaneous on-demand PDF generation per process; see
+# findingaids.fa.pdfqueue for details
+FINDINGAID_PDF_RENDER = {
+    'MAX_RENDERS': 2,
+    'MAX_QUEUE': 10,
+    'RETRY_AFTER': 60,
+}
+
+# PDFs for finding aids with at least MIN_COMPONENTS components are rendered
+# in parts by series, in parallel; see findingaids.fa.pdfsplit for details.
+# Disabled unless MIN_COMPONENTS is configured in localsettings.
+FINDINGAID_PDF_SPLIT = {
+    'MIN_COMPONENTS': None,
+    'PROCESSES': 4,
+}
+
+# maximum number of matching items displayed (50 per page) for a search
+# within a single finding aid; the total number of matches is still reported
+FINDINGAID_DOCUMENT_SEARCH_MAX_HITS = 500
+
 INSTALLED_APPS = [
     'django.contrib.admin',
     'django.contrib.auth',